@@ -0,0 +1,211 @@
+# accounting.py
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from database import record_data_rate, record_data_rates
+from events import RateSample, publish
+from metrics import REGISTRY, TSHARK_PROCESSES
+
+# Length of one accounting window
+WINDOW_SECONDS = 5.0
+# An early rate is judged only once the window is this old, so the first
+# frames of a window are not extrapolated into a breach
+EARLY_MIN_SECONDS = 0.25
+
+FRAMES = REGISTRY.counter("iot_guardian_accounting_frames_total",
+                          "Frames read from the accounting tshark")
+
+# Per-device KB/s levels that trigger an early, mid-window RateSample
+# (final=False) before the window closes
+_watch_levels: Dict[str, float] = {}
+
+
+def set_watch_levels(levels: Dict[str, float]):
+    """Replace the per-device KB/s levels that trigger early publishes"""
+    global _watch_levels
+    _watch_levels = dict(levels)
+
+
+def get_watch_levels() -> Dict[str, float]:
+    """The current levels; a new dict object after every set_watch_levels()"""
+    return _watch_levels
+
+
+def record_rate(mac: str, rate: float):
+    """Store a measured rate and publish it"""
+    record_data_rate(mac, rate)
+    publish(RateSample(mac, rate))
+
+
+def publish_rates(rates: Dict[str, float]):
+    """Store one closed window and publish its rates"""
+    record_data_rates(rates)
+    for mac, rate in rates.items():
+        publish(RateSample(mac, rate))
+
+
+def publish_early(mac: str, rate: float):
+    publish(RateSample(mac, rate, False))
+
+
+def _is_unicast(mac: str) -> bool:
+    try:
+        return not int(mac[:2], 16) & 1
+    except ValueError:
+        return False
+
+
+class TrafficAccountant:
+    """Per-device byte accounting from a live tshark field stream.
+
+    Bytes are attributed to both the source and destination MAC of every
+    frame. When a window closes, every device's rate is stored in one batch
+    and published. A device whose rate so far in the window is above its
+    watch level is published as soon as the window is EARLY_MIN_SECONDS
+    old, so a breach is seen within a fraction of a second rather than at
+    the end of the window. No timer runs while there is no traffic.
+
+    on_rates / on_early receive closed windows and early rates; by default
+    they are stored and published here, a worker process forwards them to
+    the collector instead. `command` replaces the tshark command line.
+    """
+
+    def __init__(self, interface: str, window_seconds: float = WINDOW_SECONDS,
+                 clock: Callable[[], float] = time.monotonic,
+                 on_rates: Callable[[Dict[str, float]], None] = publish_rates,
+                 on_early: Callable[[str, float], None] = publish_early,
+                 command: List[str] = None):
+        self.interface = interface
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.on_rates = on_rates
+        self.on_early = on_early
+        self._command = command
+        self.frames = 0
+        self.process: Optional[subprocess.Popen] = None
+        self.running = False
+        self._bytes: Dict[str, int] = {}
+        self._early_sent = set()
+        self._window_start: Optional[float] = None
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self.own_mac = self._interface_mac(interface)
+
+    @staticmethod
+    def _interface_mac(interface: str) -> Optional[str]:
+        try:
+            with open(f"/sys/class/net/{interface}/address") as f:
+                return f.read().strip().lower()
+        except OSError:
+            return None
+
+    def command(self) -> List[str]:
+        if self._command:
+            return list(self._command)
+        return [
+            "tshark", "-i", self.interface, "-l", "-n", "-Q",
+            "-T", "fields", "-E", "separator=,",
+            "-e", "eth.src", "-e", "eth.dst", "-e", "frame.len"
+        ]
+
+    def add_frame(self, src: str, dst: str, length: int):
+        """Account one frame; may publish an early rate"""
+        early = []
+        with self._cond:
+            now = self.clock()
+            if self._window_start is None:
+                self._window_start = now
+                self._cond.notify()
+            elapsed = max(now - self._window_start, 1e-3)
+            for mac in (src, dst):
+                if mac == self.own_mac or not _is_unicast(mac):
+                    continue
+                total = self._bytes.get(mac, 0) + length
+                self._bytes[mac] = total
+                level = _watch_levels.get(mac)
+                if (level is not None and mac not in self._early_sent
+                        and now - self._window_start >= EARLY_MIN_SECONDS):
+                    rate = total / 1024 / elapsed
+                    if rate > level:
+                        self._early_sent.add(mac)
+                        early.append((mac, rate))
+        for mac, rate in early:
+            self.on_early(mac, rate)
+
+    def close_window(self) -> Dict[str, float]:
+        """Close the current window, store and publish its rates"""
+        with self._cond:
+            if self._window_start is None:
+                return {}
+            elapsed = max(self.clock() - self._window_start, self.window_seconds)
+            rates = {mac: total / 1024 / elapsed for mac, total in self._bytes.items()}
+            self._bytes = {}
+            self._early_sent = set()
+            self._window_start = None
+
+        if rates:
+            self.on_rates(rates)
+        return rates
+
+    def _read_frames(self):
+        for line in self.process.stdout:
+            if not self.running:
+                break
+            parts = line.strip().split(",")
+            if len(parts) != 3 or not parts[2].isdigit():
+                continue
+            FRAMES.inc()
+            self.frames += 1
+            self.add_frame(parts[0].lower(), parts[1].lower(), int(parts[2]))
+        TSHARK_PROCESSES.labels("accounting").dec()
+        self.running = False
+        with self._cond:
+            self._cond.notify()
+
+    def _close_windows(self):
+        while self.running:
+            with self._cond:
+                # Sleep indefinitely while idle; the first frame wakes us
+                while self.running and self._window_start is None:
+                    self._cond.wait()
+                if not self.running:
+                    break
+                remaining = self._window_start + self.window_seconds - self.clock()
+            if remaining > 0:
+                with self._cond:
+                    self._cond.wait(remaining)
+                continue
+            try:
+                self.close_window()
+            except Exception as e:
+                print(f"Accounting error: {e}")
+        self.close_window()
+
+    def start(self):
+        if self.running:
+            return
+        self.process = subprocess.Popen(
+            self.command(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True
+        )
+        TSHARK_PROCESSES.labels("accounting").inc()
+        self.running = True
+        self._threads = [
+            threading.Thread(target=self._read_frames, name=f"accounting-{self.interface}", daemon=True),
+            threading.Thread(target=self._close_windows, name=f"windows-{self.interface}", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.process:
+            self.process.terminate()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
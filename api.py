@@ -0,0 +1,441 @@
+# api.py
+"""Local HTTP/JSON API with live streams, on asyncio and the standard library.
+
+    GET /api/devices?limit=&cursor=                      devices ordered by MAC
+    GET /api/devices/<mac>
+    GET /api/devices/<mac>/rates?days=7&resolution=3600  rollups (60 or 3600 s buckets)
+    GET /api/ips/events?limit=&cursor=&mac=              newest first
+    GET /api/firewall/rules?limit=&cursor=
+    GET /api/stream?topics=rates,events,rules            Server-Sent Events
+    GET /api/ws?topics=rates,events,rules                WebSocket, JSON text frames
+
+Lists return {"items": [...], "next_cursor": ...}. Their ETag comes from a
+cheap table version, so a matching If-None-Match is answered with 304
+before the list query runs. Streams come from the event bus and are
+coalesced: every STREAM_INTERVAL subscribers get the latest rate per
+device, the IPS events and the rule changes since the last tick, each
+message serialized once for all of them.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit, unquote
+from archive import get_ips_events_page
+from database import (get_devices_page, get_device_info, get_rate_rollups,
+                      load_firewall_rules, get_table_version, ROLLUP_RESOLUTIONS)
+from events import BUS, COALESCE, IPSEvent, RateSample, RuleChanged
+
+API_HOST = os.environ.get("IOT_GUARDIAN_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("IOT_GUARDIAN_API_PORT", "8765"))
+
+DEFAULT_PAGE = 100
+MAX_PAGE = 1000
+
+# Streamed updates are batched into one message per topic per interval
+STREAM_INTERVAL = 1.0
+# Messages buffered per subscriber; a slow client loses the oldest first
+SUBSCRIBER_BUFFER = 16
+SSE_KEEPALIVE_SECONDS = 15
+
+TOPICS = ("rates", "events", "rules")
+# Bus events held between ticks
+EVENT_BUFFER = 1000
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_HEADER_BYTES = 16384
+
+STATUS_TEXT = {200: "OK", 101: "Switching Protocols", 304: "Not Modified",
+               400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(message or STATUS_TEXT.get(status, ""))
+        self.status = status
+
+
+def _limit(query: Dict[str, str]) -> int:
+    try:
+        limit = int(query.get("limit", DEFAULT_PAGE))
+    except ValueError:
+        raise HTTPError(400, "limit must be an integer")
+    return max(1, min(limit, MAX_PAGE))
+
+
+def _int_param(query: Dict[str, str], name: str, default=None):
+    value = query.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPError(400, f"{name} must be an integer")
+
+
+def _page(items: List[Dict], limit: int, cursor_key: str) -> Dict:
+    """Wrap one page; a full page means there may be more after its last item"""
+    next_cursor = items[-1][cursor_key] if len(items) == limit else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+# Handlers run on the executor and return a JSON-serialisable document
+
+def list_devices(query: Dict[str, str]) -> Dict:
+    limit = _limit(query)
+    return _page(get_devices_page(query.get("cursor") or None, limit), limit, 'mac')
+
+
+def show_device(query: Dict[str, str], mac: str) -> Dict:
+    device = get_device_info(mac)
+    if not device:
+        raise HTTPError(404, f"unknown device {mac}")
+    return dict(device, mac=mac)
+
+
+def list_rates(query: Dict[str, str], mac: str) -> Dict:
+    limit = _limit(query)
+    days = _int_param(query, "days", 7)
+    resolution = _int_param(query, "resolution", ROLLUP_RESOLUTIONS[-1])
+    if resolution not in ROLLUP_RESOLUTIONS:
+        raise HTTPError(400, f"resolution must be one of {ROLLUP_RESOLUTIONS}")
+    items = get_rate_rollups(mac, time.time() - days * 86400, resolution,
+                             _int_param(query, "cursor"), limit)
+    return dict(_page(items, limit, 'bucket'), mac=mac, resolution=resolution)
+
+
+def list_events(query: Dict[str, str]) -> Dict:
+    limit = _limit(query)
+    items = get_ips_events_page(_int_param(query, "cursor"), limit, query.get("mac") or None)
+    return _page(items, limit, 'id')
+
+
+def list_rules(query: Dict[str, str]) -> Dict:
+    limit = _limit(query)
+    offset = max(0, _int_param(query, "cursor", 0))
+    rules = load_firewall_rules()
+    items = [dict(rule, position=offset + i) for i, rule in enumerate(rules[offset:offset + limit])]
+    next_cursor = offset + limit if offset + limit < len(rules) else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+# (pattern, table whose version makes the ETag, handler)
+ROUTES: List[Tuple[re.Pattern, Optional[str], Callable]] = [
+    (re.compile(r"^/api/devices$"), "devices", list_devices),
+    (re.compile(r"^/api/devices/([^/]+)$"), "devices", show_device),
+    (re.compile(r"^/api/devices/([^/]+)/rates$"), "data_rate_rollups", list_rates),
+    (re.compile(r"^/api/ips/events$"), "ips_events", list_events),
+    (re.compile(r"^/api/firewall/rules$"), "firewall_rules", list_rules),
+]
+
+
+class Subscriber:
+    """One stream client: the topics it wants and its outgoing buffer"""
+
+    def __init__(self, topics: Set[str], encode: Callable[[str, bytes], bytes]):
+        self.topics = topics
+        self.encode = encode
+        self.queue: asyncio.Queue = asyncio.Queue(SUBSCRIBER_BUFFER)
+        self.dropped = 0
+
+    def offer(self, message: bytes):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class StreamHub:
+    """Buffers bus events between ticks and fans them out once per tick"""
+
+    def __init__(self, interval: float = STREAM_INTERVAL):
+        self.interval = interval
+        self.subscribers: Set[Subscriber] = set()
+        self.rates = None
+        self.events = None
+
+    def open(self):
+        # Latest final rate per device; early estimates are left to the IPS.
+        # Keyed with `final` so an early estimate never displaces a final sample.
+        self.rates = BUS.subscribe(RateSample, maxsize=65536, policy=COALESCE,
+                                   key=lambda e: (e.mac, e.final))
+        self.events = BUS.subscribe((IPSEvent, RuleChanged), maxsize=EVENT_BUFFER)
+
+    def close(self):
+        for subscription in (self.rates, self.events):
+            if subscription is not None:
+                subscription.close()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            rates = {e.mac: e.rate for e in self.rates.drain(timeout=0) if e.final}
+            pending = self.events.drain(timeout=0)
+            if not self.subscribers:
+                continue
+            if rates:
+                self.publish("rates", {'time': time.time(), 'rates': rates})
+            events = [e._asdict() for e in pending if isinstance(e, IPSEvent)]
+            if events:
+                self.publish("events", {'events': events})
+            rules = [e._asdict() for e in pending if isinstance(e, RuleChanged)]
+            if rules:
+                self.publish("rules", {'changes': rules})
+
+    def publish(self, topic: str, data: Dict):
+        payload = json.dumps(data, separators=(",", ":")).encode()
+        encoded: Dict[Callable, bytes] = {}
+        for subscriber in list(self.subscribers):
+            if topic in subscriber.topics:
+                if subscriber.encode not in encoded:
+                    encoded[subscriber.encode] = subscriber.encode(topic, payload)
+                subscriber.offer(encoded[subscriber.encode])
+
+
+def _sse_message(topic: str, payload: bytes) -> bytes:
+    return b"event: " + topic.encode() + b"\ndata: " + payload + b"\n\n"
+
+
+def _ws_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _ws_message(topic: str, payload: bytes) -> bytes:
+    return _ws_frame(b'{"topic":"' + topic.encode() + b'","data":' + payload + b"}")
+
+
+async def _read_ws_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return first & 0x0F, payload
+
+
+class APIServer:
+    """Runs the API on its own event loop thread"""
+
+    def __init__(self, host: str = API_HOST, port: int = API_PORT,
+                 interval: float = STREAM_INTERVAL):
+        self.host = host
+        self.port = port
+        self.hub = StreamHub(interval)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._task: Optional[asyncio.Task] = None
+        self._connections: Set[asyncio.Task] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    # Request handling
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                method, target, headers = self._parse_head(head)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    streamed = await self._dispatch(method, target, headers, reader, writer)
+                except HTTPError as e:
+                    self._respond(writer, e.status, {'error': str(e)})
+                    streamed = False
+                except Exception as e:
+                    print(f"API error on {target}: {e}")
+                    self._respond(writer, 500, {'error': "internal error"})
+                    streamed = False
+                await writer.drain()
+                if streamed or not keep_alive:
+                    return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    @staticmethod
+    def _parse_head(head: bytes) -> Tuple[str, str, Dict[str, str]]:
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise ConnectionError("malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    def _respond(self, writer: asyncio.StreamWriter, status: int, document=None,
+                 headers: Dict[str, str] = None):
+        body = b"" if document is None else json.dumps(document, separators=(",", ":")).encode()
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+                 f"Content-Length: {len(body)}"]
+        if document is not None:
+            lines.append("Content-Type: application/json")
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+
+    async def _dispatch(self, method: str, target: str, headers: Dict[str, str],
+                        reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Answer one request; returns True if the connection became a stream"""
+        if method != "GET":
+            raise HTTPError(405)
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if url.path in ("/api/stream", "/api/ws"):
+            topics = set(query.get("topics", ",".join(TOPICS)).split(",")) & set(TOPICS)
+            if not topics:
+                raise HTTPError(400, f"topics must be among {TOPICS}")
+            if url.path == "/api/stream":
+                await self._serve_sse(writer, topics)
+            else:
+                await self._serve_websocket(reader, writer, headers, topics)
+            return True
+
+        for pattern, table, handler in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            raise HTTPError(404)
+
+        loop = asyncio.get_running_loop()
+        args = [unquote(group).lower() for group in match.groups()]
+        version = await loop.run_in_executor(None, get_table_version, table)
+        etag = '"' + hashlib.blake2b(f"{version}|{target}".encode(), digest_size=12).hexdigest() + '"'
+        if etag in headers.get("if-none-match", ""):
+            self._respond(writer, 304, headers={'ETag': etag})
+            return False
+        document = await loop.run_in_executor(None, lambda: handler(query, *args))
+        self._respond(writer, 200, document, {'ETag': etag, 'Cache-Control': "no-cache"})
+        return False
+
+    # Streams
+
+    async def _pump(self, subscriber: Subscriber, writer: asyncio.StreamWriter,
+                    keepalive: Optional[bytes] = None):
+        self.hub.subscribers.add(subscriber)
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if keepalive is None:
+                        continue
+                    message = keepalive
+                writer.write(message)
+                await writer.drain()
+        finally:
+            self.hub.subscribers.discard(subscriber)
+
+    async def _serve_sse(self, writer: asyncio.StreamWriter, topics: Set[str]):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n")
+        await writer.drain()
+        await self._pump(Subscriber(topics, _sse_message), writer, keepalive=b": keepalive\n\n")
+
+    async def _serve_websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                               headers: Dict[str, str], topics: Set[str]):
+        key = headers.get("sec-websocket-key")
+        if headers.get("upgrade", "").lower() != "websocket" or not key:
+            raise HTTPError(400, "expected a WebSocket upgrade")
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WS_GUID).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        await writer.drain()
+
+        pump = asyncio.ensure_future(self._pump(Subscriber(topics, _ws_message), writer))
+        try:
+            # Client frames only matter for ping and close
+            while not pump.done():
+                opcode, payload = await _read_ws_frame(reader)
+                if opcode == 0x8:
+                    writer.write(_ws_frame(payload[:2], 0x8))
+                    break
+                if opcode == 0x9:
+                    writer.write(_ws_frame(payload, 0xA))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            pump.cancel()
+
+    # Lifecycle
+
+    async def _main(self):
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                      limit=MAX_HEADER_BYTES)
+        except OSError as e:
+            self._error = e
+            self._ready.set()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        hub = asyncio.ensure_future(self.hub.run())
+        self._ready.set()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            hub.cancel()
+            # Streams never end on their own
+            for connection in list(self._connections):
+                connection.cancel()
+            await asyncio.gather(hub, *self._connections, return_exceptions=True)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self._task = self.loop.create_task(self._main())
+            self.loop.run_until_complete(self._task)
+        finally:
+            self.loop.close()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._ready.clear()
+        self._error = None
+        self.hub.open()
+        self._thread = threading.Thread(target=self._run, name="api", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error:
+            self.hub.close()
+            raise self._error
+
+    def stop(self):
+        if self.loop and self._thread and self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self._task.cancel)
+            self._thread.join()
+        self._thread = None
+        self.hub.close()
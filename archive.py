@@ -0,0 +1,384 @@
+# archive.py
+"""Columnar archive of aged data rate samples and IPS events.
+
+Rows older than ARCHIVE_AFTER_DAYS move out of SQLite into one segment file
+per kind, device and UTC day:
+
+    archive/data_rates/2026-03-14/aabbccddeeff-<id>.npz   t, value
+    archive/ips_events/2026-03-14/aabbccddeeff-<id>.npz   id, t, value, action, action_offsets
+
+A segment is an uncompressed .npz with narrow columns: t is int32 seconds
+into the day and a rate sample's value is float32, so a sample takes 8
+bytes instead of the 40-odd an indexed SQLite row does. IPS events keep
+their detected rate as float64, and the action text is stored whole as
+UTF-8 bytes plus an offsets column (row i is action[offsets[i]:offsets[i+1]]). Because it is stored rather than
+deflated, a query memory-maps the columns in place and reads only the
+pages it touches. The `archive_segments` table is the manifest. It holds
+the path, row count, time range and min/max/sum of each segment, so a query
+opens only the segments overlapping its range.
+
+A pass writes a new generation of every segment it adds to. It then swaps
+the manifest entry and deletes the source rows in one transaction, and
+removes the old file afterwards. If the pass is interrupted, the manifest
+still points at complete files and the rows are still in SQLite, so the
+next pass simply redoes the work. Rate samples move only after they are
+folded into the rollups, and IPS events only after the sync log sent them.
+The IPS tab and /api/ips/events read through get_ips_events() and
+get_ips_events_page() here, which continue into the archive.
+
+    python archive.py            # archive now
+"""
+import os
+import struct
+import time
+import zipfile
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import database
+from database import (ARCHIVE_SOURCES, get_archivable_rows, commit_archive, get_archive_segments,
+                      delete_archive_segments, replace_archive_segment, get_data_rate_rows)
+
+ARCHIVE_DIR = os.environ.get("IOT_GUARDIAN_ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.environ.get("IOT_GUARDIAN_ARCHIVE_AFTER_DAYS", "7"))
+ARCHIVE_RETENTION_DAYS = int(os.environ.get("IOT_GUARDIAN_ARCHIVE_RETENTION_DAYS", "365"))
+
+# Rows read from SQLite per archival step
+CHUNK_ROWS = 200000
+# Variable-length text columns, stored as UTF-8 bytes plus <name>_offsets
+STRING_COLUMNS = ("action",)
+DAY = 86400
+
+
+def _day(day_number: int) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(day_number * DAY))
+
+
+def write_segment(path: str, columns: Dict[str, np.ndarray]):
+    """Write columns as a stored (memory-mappable) .npz, atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + ".partial"
+    with open(partial, "wb") as f:
+        np.savez(f, **columns)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+
+
+def read_segment(path: str) -> Dict[str, np.ndarray]:
+    """Memory-map every column of a segment written by write_segment()"""
+    columns = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                columns[name] = np.load(path)[name]
+                continue
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            if not int(np.prod(shape)):
+                columns[name] = np.empty(shape, dtype)
+                continue
+            columns[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(),
+                                      shape=shape, order="F" if fortran else "C")
+    return columns
+
+
+def encode_strings(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """UTF-8 bytes of all values and the offsets delimiting each one"""
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), np.uint8), offsets
+
+
+def decode_strings(columns: Dict[str, np.ndarray], name: str) -> List[str]:
+    """The values of a string column (row-sliced by _scan or whole)"""
+    if f"{name}_offsets" not in columns:
+        return [str(value) for value in columns[name].tolist()]  # fixed-width column
+    data, offsets = columns[name], columns[f"{name}_offsets"].tolist()
+    raw = bytes(data[offsets[0]:offsets[-1]]) if len(offsets) > 1 else b""
+    base = offsets[0]
+    return [raw[start - base:end - base].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+
+def _segment_columns(kind: str, rows: List[tuple], day_start: int) -> Dict[str, np.ndarray]:
+    columns = {
+        "t": np.fromiter((row[2] - day_start for row in rows), np.int32, len(rows)),
+    }
+    if kind == "ips_events":
+        columns["value"] = np.fromiter((row[3] or 0.0 for row in rows), np.float64, len(rows))
+        columns["id"] = np.fromiter((row[0] for row in rows), np.int64, len(rows))
+        columns["action"], columns["action_offsets"] = encode_strings([row[4] or "" for row in rows])
+    else:
+        columns["value"] = np.fromiter((row[3] or 0.0 for row in rows), np.float32, len(rows))
+    return columns
+
+
+def _merge(old: Dict[str, np.ndarray], new: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    names = [name for name in new if name not in STRING_COLUMNS and not name.endswith("_offsets")]
+    merged = {name: np.concatenate([np.asarray(old[name]), new[name]]) for name in names}
+    order = np.argsort(merged["t"], kind="stable")
+    merged = {name: column[order] for name, column in merged.items()}
+    for name in STRING_COLUMNS:
+        if name in new:
+            values = decode_strings(old, name) + decode_strings(new, name)
+            merged[name], merged[f"{name}_offsets"] = encode_strings([values[i] for i in order.tolist()])
+    return merged
+
+
+def archive_kind(kind: str, before: float, directory: str = ARCHIVE_DIR,
+                 chunk_rows: int = CHUNK_ROWS) -> int:
+    """Move rows of one kind older than `before` (unix time) into segments"""
+    moved = 0
+    while True:
+        rows = get_archivable_rows(kind, before, chunk_rows)
+        if not rows:
+            return moved
+        groups: Dict[Tuple[str, int], List[tuple]] = {}
+        for row in rows:
+            groups.setdefault((row[1] or "", row[2] // DAY), []).append(row)
+
+        first_id, last_id = rows[0][0], rows[-1][0]
+        current = {(s['mac'], s['day']): s for s in get_archive_segments(
+            kind, since=rows[0][2] - DAY, until=rows[-1][2] + DAY)}
+        segments, replaced = [], []
+        for (mac, day_number), group in groups.items():
+            day = _day(day_number)
+            columns = _segment_columns(kind, group, day_number * DAY)
+            existing = current.get((mac, day))
+            if existing:
+                columns = _merge(read_segment(os.path.join(directory, existing['path'])), columns)
+                replaced.append(existing['path'])
+            path = os.path.join(kind, day, f"{mac.replace(':', '') or 'unknown'}-{last_id}.npz")
+            write_segment(os.path.join(directory, path), columns)
+            segments.append(_segment_entry(mac, day, path, columns, day_number * DAY))
+
+        commit_archive(kind, segments, first_id, last_id)
+        for path in replaced:
+            _remove(os.path.join(directory, path))
+        moved += len(rows)
+
+
+def _segment_entry(mac: str, day: str, path: str, columns: Dict[str, np.ndarray], day_start: int) -> Dict:
+    """The manifest entry describing a written segment"""
+    values = columns["value"].astype(np.float64)
+    return {
+        'mac': mac, 'day': day, 'path': path, 'rows': len(values),
+        't_min': day_start + int(columns["t"][0]),
+        't_max': day_start + int(columns["t"][-1]),
+        'min_value': float(values.min()), 'max_value': float(values.max()),
+        'total': float(values.sum()),
+    }
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def sweep_orphans(directory: str = ARCHIVE_DIR) -> int:
+    """Delete segment files no manifest entry points at (left by an interrupted pass)"""
+    removed = 0
+    for kind in ARCHIVE_SOURCES:
+        known = {s['path'] for s in get_archive_segments(kind)}
+        root = os.path.join(directory, kind)
+        for folder, _, files in os.walk(root):
+            for name in files:
+                path = os.path.relpath(os.path.join(folder, name), directory)
+                if path not in known:
+                    _remove(os.path.join(directory, path))
+                    removed += 1
+    return removed
+
+
+def prune_archive(retention_days: int = ARCHIVE_RETENTION_DAYS, directory: str = ARCHIVE_DIR) -> int:
+    """Drop segments of days older than the archive retention"""
+    cutoff = _day(int(time.time() // DAY) - retention_days)
+    removed = 0
+    for kind in ARCHIVE_SOURCES:
+        for path in delete_archive_segments(kind, before_day=cutoff):
+            _remove(os.path.join(directory, path))
+            removed += 1
+    return removed
+
+
+def run_archive(after_days: int = ARCHIVE_AFTER_DAYS, directory: str = ARCHIVE_DIR) -> Dict[str, int]:
+    """One archival pass: sweep, move aged rows of every kind, prune"""
+    sweep_orphans(directory)
+    before = time.time() - after_days * DAY
+    moved = {kind: archive_kind(kind, before, directory) for kind in ARCHIVE_SOURCES}
+    moved['pruned_segments'] = prune_archive(directory=directory)
+    return moved
+
+
+def delete_device_archive(mac: str, directory: str = ARCHIVE_DIR):
+    """Remove every archived row of a device"""
+    for kind in ARCHIVE_SOURCES:
+        for path in delete_archive_segments(kind, mac=mac):
+            _remove(os.path.join(directory, path))
+
+
+def delete_rate_sample(mac: str, when: int, directory: str = ARCHIVE_DIR) -> int:
+    """Remove a device's archived samples at unix time `when`; returns how many.
+
+    The segment is rewritten without them as a new file, the manifest is
+    switched to it, and the old file is removed.
+    """
+    removed = 0
+    for segment in get_archive_segments("data_rates", mac, when, when):
+        day_start = segment['t_min'] // DAY * DAY
+        columns = read_segment(os.path.join(directory, segment['path']))
+        keep = np.asarray(columns["t"]) != when - day_start
+        count = len(keep) - int(keep.sum())
+        if not count:
+            continue
+        if keep.any():
+            columns = {name: np.asarray(column)[keep] for name, column in columns.items()}
+            path = os.path.join("data_rates", segment['day'],
+                                f"{mac.replace(':', '')}-d{time.time_ns()}.npz")
+            write_segment(os.path.join(directory, path), columns)
+            replace_archive_segment("data_rates", mac, segment['day'],
+                                    _segment_entry(mac, segment['day'], path, columns, day_start))
+        else:
+            replace_archive_segment("data_rates", mac, segment['day'])
+        _remove(os.path.join(directory, segment['path']))
+        removed += count
+    return removed
+
+
+def _scan(kind: str, mac: Optional[str], since: float, until: Optional[float],
+          directory: str) -> List[Tuple[Dict, Dict[str, np.ndarray], np.ndarray]]:
+    """(segment, columns, absolute times) for every segment in range, sliced to it"""
+    parts = []
+    for segment in get_archive_segments(kind, mac, since, until):
+        day_start = segment['t_min'] // DAY * DAY
+        columns = read_segment(os.path.join(directory, segment['path']))
+        t = columns["t"]
+        start = np.searchsorted(t, since - day_start, "left") if since > segment['t_min'] else 0
+        end = (np.searchsorted(t, until - day_start, "right")
+               if until is not None and until < segment['t_max'] else len(t))
+        if end > start:
+            sliced = {name: column[start:end] for name, column in columns.items()
+                      if not name.endswith("_offsets")}
+            for name in STRING_COLUMNS:
+                if f"{name}_offsets" in columns:
+                    sliced[name] = columns[name]
+                    sliced[f"{name}_offsets"] = columns[f"{name}_offsets"][start:end + 1]
+            parts.append((segment, sliced, sliced["t"].astype(np.int64) + day_start))
+    return parts
+
+
+def load_rate_series(mac: str, since: float, until: float = None,
+                     directory: str = ARCHIVE_DIR) -> Tuple[np.ndarray, np.ndarray, int]:
+    """A device's samples from `since`: archived segments followed by the
+    rows still in SQLite. Returns (unix times, KB/s, last hot row id)."""
+    parts = _scan("data_rates", mac, since, until, directory)
+    times = [t for _, _, t in parts]
+    values = [columns["value"].astype(np.float64) for _, columns, _ in parts]
+    last_id = 0
+    hot = get_data_rate_rows(mac, since)
+    if until is not None:
+        hot = [row for row in hot if row[1] <= until]
+    if hot:
+        last_id = max(row[0] for row in hot)
+        times.append(np.fromiter((row[1] for row in hot), np.int64, len(hot)))
+        values.append(np.fromiter((row[2] for row in hot), np.float64, len(hot)))
+    if not times:
+        return np.empty(0, np.int64), np.empty(0, np.float64), 0
+    return np.concatenate(times), np.concatenate(values), last_id
+
+
+def get_data_rate_history(mac: str, days: int = 7, directory: str = ARCHIVE_DIR) -> List[Dict]:
+    """database.get_data_rate_history() including archived days"""
+    times, values, _ = load_rate_series(mac, time.time() - days * DAY, directory=directory)
+    return [{'timestamp': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t)), 'data_rate': float(v)}
+            for t, v in zip(times.tolist(), values.tolist())]
+
+
+def load_ips_events(mac: str = None, since: float = 0, until: float = None,
+                    directory: str = ARCHIVE_DIR) -> List[Dict]:
+    """Archived IPS events, oldest first"""
+    events = []
+    for segment, columns, times in _scan("ips_events", mac, since, until, directory):
+        for event_id, t, value, action in zip(columns["id"].tolist(), times.tolist(),
+                                              columns["value"].tolist(), decode_strings(columns, "action")):
+            events.append({'id': event_id, 'mac': segment['mac'],
+                           'timestamp': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t)),
+                           'detected_rate': value, 'action_taken': action})
+    return events
+
+
+def _archived_events_desc(mac: Optional[str], before_id: Optional[int], limit: int,
+                          directory: str) -> List[Dict]:
+    """Archived IPS events newest first with id below `before_id`, a day at a time"""
+    days: Dict[str, List[Dict]] = {}
+    for segment in get_archive_segments("ips_events", mac):
+        days.setdefault(segment['day'], []).append(segment)
+    events: List[Dict] = []
+    for day in sorted(days, reverse=True):
+        found = []
+        for segment in days[day]:
+            columns = read_segment(os.path.join(directory, segment['path']))
+            times = columns["t"].astype(np.int64) + segment['t_min'] // DAY * DAY
+            for event_id, t, value, action in zip(columns["id"].tolist(), times.tolist(),
+                                                  columns["value"].tolist(), decode_strings(columns, "action")):
+                if before_id is None or event_id < before_id:
+                    found.append({'id': event_id, 'mac': segment['mac'],
+                                  'timestamp': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t)),
+                                  'detected_rate': value, 'action_taken': action})
+        found.sort(key=lambda event: event['id'], reverse=True)
+        events.extend(found[:limit - len(events)])
+        if len(events) >= limit:
+            break
+    return events
+
+
+def get_ips_events_page(before_id: int = None, limit: int = 100, mac: str = None,
+                        directory: str = ARCHIVE_DIR) -> List[Dict]:
+    """database.get_ips_events_page() continuing into archived events.
+
+    Archived events are older than every row still in SQLite, so a page
+    takes the rows first and fills up from the archive below their ids.
+    """
+    events = database.get_ips_events_page(before_id, limit, mac)
+    if len(events) < limit:
+        below = events[-1]['id'] if events else before_id
+        events += _archived_events_desc(mac, below, limit - len(events), directory)
+    return events
+
+
+def get_ips_events(limit: int = 50, directory: str = ARCHIVE_DIR) -> List[Dict]:
+    """database.get_ips_events() continuing into archived events"""
+    events = database.get_ips_events(limit)
+    if len(events) < limit:
+        archived = _archived_events_desc(None, None, limit - len(events), directory)
+        events += [{key: event[key] for key in ('mac', 'timestamp', 'detected_rate', 'action_taken')}
+                   for event in archived]
+    return events
+
+
+def rate_summary(mac: str, since: float = 0, until: float = None) -> Dict:
+    """Count/min/max/mean over archived days from the manifest alone (whole segments)"""
+    segments = get_archive_segments("data_rates", mac, since, until)
+    rows = sum(s['rows'] for s in segments)
+    return {
+        'segments': len(segments),
+        'rows': rows,
+        'min': min((s['min_value'] for s in segments), default=None),
+        'max': max((s['max_value'] for s in segments), default=None),
+        'mean': sum(s['total'] for s in segments) / rows if rows else None,
+    }
+
+
+if __name__ == "__main__":
+    from database import init_db
+    init_db()
+    print(run_archive())
@@ -0,0 +1,154 @@
+# baseline.py
+import time
+from typing import Dict, Tuple
+import numpy as np
+
+# Smoothing factor for the per-device EWMA mean/variance
+DEFAULT_ALPHA = 0.1
+
+# Hour-of-week profile: one (mean, variance, count) bucket per hour
+HOURS_PER_WEEK = 168
+PROFILE_ALPHA = 0.2
+PROFILE_MIN_SAMPLES = 5
+
+# Quantile sketch: exponentially decayed counts over log-spaced rate bins
+SKETCH_BINS = 64
+SKETCH_MIN_RATE = 0.01      # KB/s, lower edge of the first bin
+SKETCH_GAMMA = 1.35         # bin growth factor; covers up to ~2 GB/s
+SKETCH_DECAY = 0.999        # per-sample decay, half-life ~700 samples
+SKETCH_EDGES = SKETCH_MIN_RATE * SKETCH_GAMMA ** np.arange(1, SKETCH_BINS + 1)
+
+# Anomaly rules
+WARMUP_SAMPLES = 50
+Z_THRESHOLD = 4.0
+QUANTILE = 0.99
+QUANTILE_MARGIN = 1.5
+STD_FLOOR = 1.0             # KB/s, so near-constant devices don't alarm on noise
+STD_FLOOR_RATIO = 0.1       # ... or 10% of the mean, whichever is larger
+
+
+def hour_of_week(timestamp: float) -> int:
+    """Local hour of the week, 0 = Monday 00:00"""
+    local = time.localtime(timestamp)
+    return local.tm_wday * 24 + local.tm_hour
+
+
+class BaselineModel:
+    """Learned per-device traffic baselines in fixed-size NumPy state.
+
+    Each device slot keeps an EWMA mean/variance, a 168-bucket hour-of-week
+    profile and a 64-bin decayed log-histogram used as a quantile sketch,
+    about 2.3 KB per device. A sample is anomalous once the device is warmed
+    up, its z-score against the hour-of-week bucket (or the EWMA while the
+    bucket is still cold) exceeds Z_THRESHOLD, and it is also well above the
+    learned 99th percentile. Samples are winsorized before they update the
+    mean/variance so a single attack does not become the new normal.
+    """
+
+    def __init__(self, capacity: int, alpha: float = DEFAULT_ALPHA):
+        self.alpha = alpha
+        self.samples = np.zeros(0, dtype=np.int64)
+        self.ewma = np.zeros(0, dtype=np.float64)
+        self.ewvar = np.zeros(0, dtype=np.float64)
+        self.profile = np.zeros((0, HOURS_PER_WEEK, 3), dtype=np.float32)
+        self.sketch = np.zeros((0, SKETCH_BINS), dtype=np.float32)
+        self.resize(capacity)
+
+    def resize(self, capacity: int):
+        old = self.samples.shape[0]
+        for name in ("samples", "ewma", "ewvar", "profile", "sketch"):
+            current = getattr(self, name)
+            grown = np.zeros((capacity,) + current.shape[1:], dtype=current.dtype)
+            grown[:old] = current
+            setattr(self, name, grown)
+
+    def reset(self, slot: int):
+        self.samples[slot] = 0
+        self.ewma[slot] = 0.0
+        self.ewvar[slot] = 0.0
+        self.profile[slot] = 0.0
+        self.sketch[slot] = 0.0
+
+    def quantile(self, slots: np.ndarray, q: float = QUANTILE) -> np.ndarray:
+        """Estimated q-quantile of each slot's rate distribution (inf if empty)"""
+        cumulative = np.cumsum(self.sketch[slots], axis=1)
+        total = cumulative[:, -1]
+        bins = np.argmax(cumulative >= (q * total)[:, None], axis=1)
+        return np.where(total > 0, SKETCH_EDGES[bins], np.inf)
+
+    def evaluate(self, slots: np.ndarray, rates: np.ndarray, how: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Score fresh samples against the baselines, then learn from them.
+
+        Returns (anomalous mask, z-scores) aligned with `slots`.
+        """
+        alpha = self.alpha
+        n = self.samples[slots]
+        mean = self.ewma[slots]
+        std = np.sqrt(self.ewvar[slots])
+        floor = np.maximum(STD_FLOOR, STD_FLOOR_RATIO * np.abs(mean))
+        scale = np.maximum(std, floor)
+        z_ewma = (rates - mean) / scale
+
+        bucket = self.profile[slots, how].astype(np.float64)
+        p_mean, p_var, p_count = bucket[:, 0], bucket[:, 1], bucket[:, 2]
+        p_scale = np.maximum(np.sqrt(p_var), np.maximum(STD_FLOOR, STD_FLOOR_RATIO * p_mean))
+        warm_bucket = p_count >= PROFILE_MIN_SAMPLES
+        z = np.where(warm_bucket, (rates - p_mean) / p_scale, z_ewma)
+
+        warm = n >= WARMUP_SAMPLES
+        anomalous = warm & (z > Z_THRESHOLD)
+        # The sketch is only consulted for the few samples past the z-score gate
+        candidates = np.flatnonzero(anomalous)
+        if candidates.size:
+            above = rates[candidates] > self.quantile(slots[candidates]) * QUANTILE_MARGIN
+            anomalous[candidates[~above]] = False
+
+        # Winsorize before learning so outliers only nudge the baseline
+        learn = np.where(warm, np.minimum(rates, mean + Z_THRESHOLD * scale), rates)
+
+        # EWMA mean/variance; the first sample seeds the mean
+        first = n == 0
+        diff = learn - mean
+        incr = alpha * diff
+        self.ewma[slots] = np.where(first, learn, mean + incr)
+        self.ewvar[slots] = np.where(first, 0.0, (1.0 - alpha) * (self.ewvar[slots] + diff * incr))
+        self.samples[slots] = n + 1
+
+        # Hour-of-week bucket, same update with its own smoothing
+        p_first = p_count == 0
+        p_diff = learn - p_mean
+        p_incr = PROFILE_ALPHA * p_diff
+        bucket[:, 0] = np.where(p_first, learn, p_mean + p_incr)
+        bucket[:, 1] = np.where(p_first, 0.0, (1.0 - PROFILE_ALPHA) * (p_var + p_diff * p_incr))
+        bucket[:, 2] = np.minimum(p_count + 1, 65535)
+        self.profile[slots, how] = bucket
+
+        # Decayed log-histogram sketch; quantiles are robust, so it sees raw rates
+        # and recurring bursts raise the p99 instead of alarming forever
+        bins = np.log(np.maximum(rates, SKETCH_MIN_RATE) / SKETCH_MIN_RATE) / np.log(SKETCH_GAMMA)
+        bins = np.clip(bins.astype(np.int64), 0, SKETCH_BINS - 1)
+        self.sketch[slots] *= SKETCH_DECAY
+        self.sketch[slots, bins] += 1.0
+
+        return anomalous, z
+
+    def state(self, slot: int) -> Dict:
+        """Serializable state of one slot"""
+        return {
+            'samples': int(self.samples[slot]),
+            'ewma': float(self.ewma[slot]),
+            'ewvar': float(self.ewvar[slot]),
+            'profile': self.profile[slot].tobytes(),
+            'sketch': self.sketch[slot].tobytes()
+        }
+
+    def load(self, slot: int, state: Dict):
+        """Restore one slot from `state()` output (as stored in SQLite)"""
+        self.samples[slot] = state['samples']
+        self.ewma[slot] = state['ewma']
+        self.ewvar[slot] = state['ewvar']
+        profile = np.frombuffer(state['profile'], dtype=np.float32)
+        sketch = np.frombuffer(state['sketch'], dtype=np.float32)
+        if profile.size == HOURS_PER_WEEK * 3 and sketch.size == SKETCH_BINS:
+            self.profile[slot] = profile.reshape(HOURS_PER_WEEK, 3)
+            self.sketch[slot] = sketch
@@ -0,0 +1,43 @@
+# benchmarks/bench_detection.py
+"""Benchmark one IPS detection tick across many simulated devices.
+
+Run from the repository root:
+    python -m benchmarks.bench_detection [devices] [ticks]
+"""
+import sys
+import time
+import numpy as np
+from detection import DeviceRateTable
+
+
+def run(devices: int = 10000, ticks: int = 200):
+    rng = np.random.default_rng(42)
+    table = DeviceRateTable()
+
+    start = time.perf_counter()
+    for i in range(devices):
+        table.add_device(f"02:00:{i >> 16 & 0xff:02x}:{i >> 8 & 0xff:02x}:{i & 0xff:02x}:00",
+                         max_rate=100.0, min_rate=10.0)
+    add_seconds = time.perf_counter() - start
+
+    slots = np.fromiter(table.index.values(), dtype=np.int64)
+    tick_times = []
+    breaches = 0
+    for _ in range(ticks):
+        rates = rng.gamma(2.0, 20.0, size=slots.size)
+        start = time.perf_counter()
+        table.set_rates(slots, rates)
+        breaches += table.tick().size
+        tick_times.append(time.perf_counter() - start)
+
+    tick_times = np.array(tick_times) * 1000
+    print(f"devices:         {devices}")
+    print(f"add all devices: {add_seconds * 1000:.1f} ms")
+    print(f"tick p50:        {np.percentile(tick_times, 50):.3f} ms")
+    print(f"tick p99:        {np.percentile(tick_times, 99):.3f} ms")
+    print(f"ticks/sec:       {1000 / tick_times.mean():.0f}")
+    print(f"breaches/tick:   {breaches / ticks:.1f}")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:3]))
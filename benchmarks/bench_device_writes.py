@@ -0,0 +1,116 @@
+# benchmarks/bench_device_writes.py
+"""Device persistence benchmark: write amplification per discovery cycle.
+
+Runs N discovery cycles over D devices (a scan every 10 virtual seconds,
+a small share of devices changing IP each cycle) against a throwaway
+database, in two ways:
+  * replace  the old path: INSERT OR REPLACE of every seen device plus its
+             presence row, every cycle
+  * upsert   database.save_devices(): ON CONFLICT DO UPDATE only for changed
+             profiles, presence last_seen flushed every LAST_SEEN_FLUSH_SECONDS
+
+Reports rows written and bytes handed to write() (from /proc/self/io on
+Linux) per cycle. Run from the repository root:
+    python -m benchmarks.bench_device_writes [devices] [cycles] [churn]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import database
+from presence import PresenceTracker
+
+SCAN_INTERVAL = 10
+
+
+def written_bytes() -> int:
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def make_devices(n: int):
+    return [{
+        "mac": f"02:00:00:{i >> 16 & 255:02x}:{i >> 8 & 255:02x}:{i & 255:02x}",
+        "ipv4": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+        "name": f"device-{i}",
+        "vendor": "Espressif",
+        "model": "", "version": "", "description": "",
+    } for i in range(n)]
+
+
+def churn(devices, share: float, rng: random.Random):
+    for device in rng.sample(devices, int(len(devices) * share)):
+        device["ipv4"] = f"10.200.{rng.randrange(256)}.{rng.randrange(256)}"
+
+
+def replace_cycle(devices, now: float) -> int:
+    conn = sqlite3.connect(database.DB_PATH)
+    c = conn.cursor()
+    c.executemany('''INSERT OR REPLACE INTO devices
+                     (mac, name, ipv4, vendor, model, os_version, description)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                  [(d["mac"], d["name"], d["ipv4"], d["vendor"], d["model"], d["version"],
+                    d["description"]) for d in devices])
+    c.executemany('''INSERT OR REPLACE INTO device_presence
+                     (mac, state, first_seen, last_seen, changed_at) VALUES (?, 'online', ?, ?, ?)''',
+                  [(d["mac"], now, now, now) for d in devices])
+    conn.commit()
+    changes = conn.total_changes
+    conn.close()
+    return changes
+
+
+def run_mode(mode: str, devices: int, cycles: int, share: float) -> dict:
+    rng = random.Random(7)
+    data = make_devices(devices)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        database.init_db()
+        tracker = PresenceTracker()
+        clock = 1_000_000.0
+        rows = bytes_written = 0
+        elapsed = 0.0
+        for cycle in range(cycles + 1):
+            if cycle:
+                churn(data, share, rng)
+            clock += SCAN_INTERVAL
+            before = written_bytes()
+            start = time.perf_counter()
+            if mode == "replace":
+                changed = replace_cycle(data, clock)
+            else:
+                seen = [d["mac"] for d in data]
+                transitions = tracker.update(seen, clock)
+                presence = tracker.unsaved(transitions, seen)
+                changed = database.save_devices(data, presence) + len(presence)
+            if cycle:   # the first cycle only populates the database
+                elapsed += time.perf_counter() - start
+                bytes_written += written_bytes() - before
+                rows += changed
+    return {"rows": rows / cycles, "bytes": bytes_written / cycles, "ms": elapsed / cycles * 1e3}
+
+
+def run(devices: int = 10000, cycles: int = 30, share: float = 0.01):
+    print(f"{devices} devices, {cycles} cycles every {SCAN_INTERVAL}s, "
+          f"{share:.0%} changing IP per cycle (per-cycle averages)")
+    print(f"{'mode':>8} {'rows':>9} {'KiB written':>12} {'ms':>8}")
+    results = {}
+    for mode in ("replace", "upsert"):
+        r = results[mode] = run_mode(mode, devices, cycles, share)
+        print(f"{mode:>8} {r['rows']:>9.0f} {r['bytes'] / 1024:>12.0f} {r['ms']:>8.1f}")
+    if results["upsert"]["bytes"]:
+        print(f"\nwrite reduction: {results['replace']['bytes'] / results['upsert']['bytes']:.1f}x bytes, "
+              f"{results['replace']['rows'] / max(results['upsert']['rows'], 1):.1f}x rows")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:4]
+    run(*(int(arg) for arg in args[:2]), *(float(arg) for arg in args[2:3]))
@@ -0,0 +1,88 @@
+# benchmarks/bench_events.py
+"""Event bus microbenchmarks: publish cost and fan-out throughput.
+
+  * publish cost with 0, 1, 10 and 100 idle subscribers per policy
+  * fan-out: one publisher, N subscribers each draining on its own thread,
+    reporting delivered, dropped and coalesced counts
+
+Run from the repository root:
+    python -m benchmarks.bench_events [events] [devices]
+"""
+import sys
+import threading
+import time
+from events import COALESCE, DROP_NEWEST, DROP_OLDEST, EventBus, RateSample
+
+
+def publish_cost(events: int, subscribers: int, policy: str) -> float:
+    """Mean microseconds per publish() with idle (never drained) subscribers"""
+    bus = EventBus()
+    for _ in range(subscribers):
+        bus.subscribe(RateSample, maxsize=1024, policy=policy,
+                      key=(lambda e: e.mac) if policy == COALESCE else None)
+    samples = [RateSample(f"02:00:00:00:{i >> 8 & 0xff:02x}:{i & 0xff:02x}", float(i))
+               for i in range(1000)]
+    publish = bus.publish
+    start = time.perf_counter()
+    for i in range(events):
+        publish(samples[i % 1000])
+    return (time.perf_counter() - start) / events * 1e6
+
+
+def fan_out(events: int, subscribers: int, devices: int, policy: str) -> dict:
+    bus = EventBus()
+    delivered = [0] * subscribers
+    subs = [bus.subscribe(RateSample, maxsize=1024, policy=policy,
+                          key=(lambda e: e.mac) if policy == COALESCE else None)
+            for _ in range(subscribers)]
+
+    def consume(i):
+        while True:
+            batch = subs[i].drain()
+            if not batch:
+                return
+            delivered[i] += len(batch)
+
+    threads = [threading.Thread(target=consume, args=(i,)) for i in range(subscribers)]
+    for thread in threads:
+        thread.start()
+    samples = [RateSample(f"02:00:00:00:{i >> 8 & 0xff:02x}:{i & 0xff:02x}", float(i))
+               for i in range(devices)]
+    start = time.perf_counter()
+    for i in range(events):
+        bus.publish(samples[i % devices])
+    publish_seconds = time.perf_counter() - start
+    for sub in subs:
+        sub.close()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'publish_per_sec': events / publish_seconds,
+        'delivered_per_sec': sum(delivered) / elapsed,
+        'delivered': sum(delivered),
+        'dropped': sum(s.dropped for s in subs),
+        'coalesced': sum(s.coalesced for s in subs),
+    }
+
+
+def run(events: int = 200000, devices: int = 500):
+    print("publish cost (us/event, idle subscribers)")
+    print(f"{'subscribers':>12} " + " ".join(f"{p:>12}" for p in (DROP_OLDEST, DROP_NEWEST, COALESCE)))
+    for subscribers in (0, 1, 10, 100):
+        n = events if subscribers < 100 else events // 10
+        costs = [publish_cost(n, subscribers, policy) for policy in (DROP_OLDEST, DROP_NEWEST, COALESCE)]
+        print(f"{subscribers:>12} " + " ".join(f"{cost:>12.2f}" for cost in costs))
+
+    print(f"\nfan-out ({events} events over {devices} devices, draining subscribers)")
+    print(f"{'subscribers':>12} {'policy':>12} {'publish/s':>12} {'delivered/s':>12} "
+          f"{'dropped':>9} {'coalesced':>9}")
+    for subscribers in (1, 4, 16):
+        for policy in (DROP_OLDEST, COALESCE):
+            r = fan_out(events, subscribers, devices, policy)
+            print(f"{subscribers:>12} {policy:>12} {r['publish_per_sec']:>12,.0f} "
+                  f"{r['delivered_per_sec']:>12,.0f} {r['dropped']:>9} {r['coalesced']:>9}")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,71 @@
+# benchmarks/bench_search.py
+"""Device search benchmark: index build, incremental sync and query latency.
+
+Types a query one character at a time against N synthetic devices, the way
+the Device Manager search box does, and compares with a linear scan.
+
+Run from the repository root:
+    python -m benchmarks.bench_search [devices]
+"""
+import random
+import sys
+import time
+from device_index import DeviceIndex
+
+VENDORS = ["Apple", "Samsung", "Espressif", "Tuya", "Google", "Amazon", "Xiaomi", "Sonos"]
+STATUSES = ["online", "idle", "offline", "new"]
+
+
+def make_devices(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    return [{
+        "mac": ":".join(f"{rng.randrange(256):02x}" for _ in range(6)),
+        "name": f"{rng.choice(['cam', 'plug', 'bulb', 'sensor', 'tv'])}-{i}",
+        "ipv4": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+        "vendor": rng.choice(VENDORS),
+        "status": rng.choice(STATUSES),
+    } for i in range(n)]
+
+
+def linear(devices, query):
+    query = query.lower()
+    return [d for d in devices
+            if any(query in str(d.get(f, "")).lower() for f in ("name", "ipv4", "mac", "vendor"))]
+
+
+def ms(start):
+    return (time.perf_counter() - start) * 1e3
+
+
+def run(devices: int = 10000):
+    data = make_devices(devices)
+    index = DeviceIndex()
+    start = time.perf_counter()
+    index.sync(data)
+    print(f"{devices} devices: build {ms(start):.1f} ms")
+
+    data[devices // 2] = dict(data[devices // 2], name="renamed-device")
+    start = time.perf_counter()
+    changed = index.sync(data)
+    print(f"resync with {changed} change: {ms(start):.1f} ms")
+
+    query = data[devices // 3]["name"]
+    print(f"\ntyping {query!r} (index / linear scan, ms)")
+    for i in range(1, len(query) + 1):
+        start = time.perf_counter()
+        found = index.search(query[:i])
+        indexed = ms(start)
+        start = time.perf_counter()
+        linear(data, query[:i])
+        print(f"{query[:i]:>14} {len(found):>7} {indexed:>8.2f} {ms(start):>8.2f}")
+
+    print("\nstructured")
+    for query in ("vendor:tuya", "status:idle vendor:apple", "10.0.7.0/24", "10.0.0.0/20 status:online"):
+        index.search("")   # no narrowing from the previous query
+        start = time.perf_counter()
+        found = index.search(query)
+        print(f"{query:>28} {len(found):>7} {ms(start):>8.2f}")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:2]))
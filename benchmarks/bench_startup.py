@@ -0,0 +1,141 @@
+# benchmarks/bench_startup.py
+"""Startup benchmark: import cost and time to first frame against a large database.
+
+Seeds a throwaway database, then in fresh interpreters:
+  * runs `python -X importtime` on the UI and daemon entry points, and
+  * calls main.main() with a recording page and times the first page.add().
+
+A live collector heartbeat is seeded so the app starts as a thin client and
+the measurement covers only UI construction. Run from the repository root:
+    python -m benchmarks.bench_startup [--devices N] [--samples N] [--max-first-frame-ms MS]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import database
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_FRAME_PROBE = r'''
+import json, time
+t0 = time.perf_counter()
+import main
+
+class RecordingPage:
+    """Just enough of ft.Page for main(); records when the first frame is added"""
+    def __init__(self):
+        self.controls = []
+        self.first_frame = None
+    def add(self, *controls):
+        self.controls.extend(controls)
+        if self.first_frame is None:
+            self.first_frame = time.perf_counter()
+    def update(self):
+        pass
+
+imported = time.perf_counter()
+page = RecordingPage()
+main.main(page)
+print(json.dumps({"import_ms": (imported - t0) * 1000,
+                  "first_frame_ms": (page.first_frame - t0) * 1000}))
+'''
+
+
+def seed(db_path: str, devices: int, samples: int, events: int):
+    database.DB_PATH = db_path
+    database.init_db()
+    conn = sqlite3.connect(db_path)
+    macs = [f"02:00:00:{i >> 16 & 0xff:02x}:{i >> 8 & 0xff:02x}:{i & 0xff:02x}" for i in range(devices)]
+    conn.executemany('INSERT INTO devices (mac, name, ipv4, vendor) VALUES (?, ?, ?, ?)',
+                     [(mac, f"device-{i}", f"10.{i >> 16 & 0xff}.{i >> 8 & 0xff}.{i & 0xff}", "Unknown")
+                      for i, mac in enumerate(macs)])
+    conn.executemany('INSERT INTO device_data_rates (mac, data_rate) VALUES (?, ?)',
+                     ((macs[i % devices], (i * 7919) % 1000 / 10) for i in range(samples)))
+    conn.executemany('INSERT INTO ips_events (mac, detected_rate, action_taken) VALUES (?, ?, ?)',
+                     ((macs[i % devices], 100.0, "Throttled") for i in range(events)))
+    conn.commit()
+    conn.close()
+    # Pretend a collector daemon is alive so the app does not start its own
+    database.update_service_status("bench", 0, "bench", time.time(), time.time() + 3600)
+
+
+def importtime(module: str, env: dict) -> dict:
+    """Total and top cumulative import times (ms) for `import module`"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        # Nested imports are indented below their parent
+        rows.append((int(cumulative_us), name[1:].rstrip()))
+    top_level = [row for row in rows if not row[1].startswith(" ")]
+    return {
+        'total_ms': sum(us for us, _ in top_level) / 1000,
+        'top': [(name, us / 1000) for us, name in sorted(top_level, reverse=True)[:8]],
+    }
+
+
+def first_frame(env: dict, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", FIRST_FRAME_PROBE],
+                                cwd=REPO, env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        timings.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def run(devices: int = 5000, samples: int = 1000000, events: int = 50000,
+        runs: int = 5, max_first_frame_ms: float = None) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "startup.db")
+        start = time.perf_counter()
+        seed(db_path, devices, samples, events)
+        print(f"seeded {devices} devices, {samples} samples, {events} events "
+              f"in {time.perf_counter() - start:.1f} s")
+
+        env = dict(os.environ, IOT_GUARDIAN_DB=db_path, PYTHONPATH=REPO)
+        for module in ("daemon", "main"):
+            try:
+                report = importtime(module, env)
+            except RuntimeError as e:
+                print(f"import {module}: failed ({e})")
+                continue
+            print(f"import {module}: {report['total_ms']:.1f} ms")
+            for name, ms in report['top']:
+                print(f"    {ms:8.1f} ms  {name}")
+
+        try:
+            timings = sorted(first_frame(env, runs), key=lambda t: t['first_frame_ms'])
+        except RuntimeError as e:
+            print(f"first frame: failed ({e})")
+            return 1
+        median = timings[len(timings) // 2]
+        print(f"first frame (median of {runs}): {median['first_frame_ms']:.1f} ms "
+              f"(imports {median['import_ms']:.1f} ms)")
+
+    if max_first_frame_ms is not None and median['first_frame_ms'] > max_first_frame_ms:
+        print(f"REGRESSION: first frame above {max_first_frame_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=5000)
+    parser.add_argument("--samples", type=int, default=1000000)
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-first-frame-ms", type=float)
+    args = parser.parse_args()
+    sys.exit(run(args.devices, args.samples, args.events, args.runs, args.max_first_frame_ms))
@@ -0,0 +1,139 @@
+# benchmarks/bench_usage_history.py
+"""Usage History benchmark: opening a device with many samples.
+
+Seeds a throwaway database with one device's samples and times what the
+tab does when the device is opened:
+  * full     the old path: history as dicts, a tooltip string per sample,
+             and the same query again for the records table
+  * lttb     rate_series: load into arrays + LTTB to CHART_POINTS, a
+             tooltip per drawn point and one table page (cache miss)
+  * cached   the same device again with no new sample (cache hit)
+
+Then one new sample arrives per frame, and it times one frame of each path:
+  * redraw   what the tab did on a RateSample: cache miss, LTTB, points
+  * live     LiveSeries.update(): read the new row, append, slide the window
+
+When flet is installed, building the chart/table controls is timed too.
+Run from the repository root:
+    python -m benchmarks.bench_usage_history [samples]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import numpy as np
+import database
+
+MAC = "02:00:00:00:00:01"
+
+try:
+    import flet as ft
+except ImportError:
+    ft = None
+
+
+def seed(samples: int):
+    rng = np.random.default_rng(3)
+    rates = rng.gamma(2.0, 5.0, samples)
+    rates[rng.integers(0, samples, 20)] *= 40   # bursts the chart must keep
+    now = int(time.time())
+    conn = sqlite3.connect(database.DB_PATH)
+    conn.executemany("INSERT INTO device_data_rates (mac, timestamp, data_rate) VALUES (?, ?, ?)",
+                     [(MAC, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - (samples - i) * 5)), float(r))
+                      for i, r in enumerate(rates)])
+    conn.commit()
+    conn.close()
+    return float(rates.max())
+
+
+def full_path() -> int:
+    history = database.get_data_rate_history(MAC, 365)
+    points = [(i, h['data_rate'], f"{h['timestamp']}\n{h['data_rate']:.2f} KB/s") for i, h in enumerate(history)]
+    if ft:
+        points = [ft.LineChartDataPoint(x=i, y=y, tooltip=tip) for i, y, tip in points]
+    table = database.get_data_rate_history(MAC, 365)
+    if ft:
+        table = [ft.DataRow(cells=[ft.DataCell(ft.Text(r['timestamp'])),
+                                   ft.DataCell(ft.Text(f"{r['data_rate']:.2f}"))]) for r in table]
+    return len(points)
+
+
+def lttb_path(cache) -> tuple:
+    from rate_series import CHART_POINTS
+    series = cache.get(MAC, 365)
+    indices = series.chart_points(CHART_POINTS)
+    times, rates = series.times[indices].tolist(), series.rates[indices].tolist()
+    points = [(t, y, f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))}\n{y:.2f} KB/s")
+              for t, y in zip(times, rates)]
+    if ft:
+        points = [ft.LineChartDataPoint(x=t, y=y, tooltip=tip) for t, y, tip in points]
+    table = series.page(0)
+    if ft:
+        table = [ft.DataRow(cells=[ft.DataCell(ft.Text(ts)), ft.DataCell(ft.Text(f"{r:.2f}"))])
+                 for ts, r in table]
+    return len(points), max(rates)
+
+
+def redraw_frame(cache) -> int:
+    from rate_series import CHART_POINTS
+    series = cache.get(MAC, 365)
+    indices = series.chart_points(CHART_POINTS)
+    points = [(t, y, f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))}\n{y:.2f} KB/s")
+              for t, y in zip(series.times[indices].tolist(), series.rates[indices].tolist())]
+    if ft:
+        points = [ft.LineChartDataPoint(x=t, y=y, tooltip=tip) for t, y, tip in points]
+    return len(points)
+
+
+def live_frame(live) -> int:
+    samples, added, removed, _ = live.update()
+    points = [(t, y, f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))}\n{y:.2f} KB/s")
+              for t, y in added + [live.tail]]
+    if ft:
+        points = [ft.LineChartDataPoint(x=t, y=y, tooltip=tip) for t, y, tip in points]
+    return len(points)
+
+
+def frames(function, arg, count: int) -> float:
+    """Mean ms per frame with one new sample written before each"""
+    total = 0.0
+    for _ in range(count):
+        database.record_data_rate(MAC, 7.0)
+        ms, _ = timed(function, arg)
+        total += ms
+    return total / count
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1e3, result
+
+
+def run(samples: int = 100000):
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        database.init_db()
+        peak = seed(samples)
+        import rate_series
+        cache = rate_series.SeriesCache()
+        print(f"{samples} samples for one device; flet controls {'included' if ft else 'not timed (flet missing)'}")
+        print(f"{'path':>8} {'ms':>9} {'points':>8}")
+        ms, points = timed(full_path)
+        print(f"{'full':>8} {ms:>9.1f} {points:>8}")
+        ms, (points, kept_peak) = timed(lttb_path, cache)
+        print(f"{'lttb':>8} {ms:>9.1f} {points:>8}")
+        ms, _ = timed(lttb_path, cache)
+        print(f"{'cached':>8} {ms:>9.1f} {points:>8}")
+        print(f"\npeak kept: {kept_peak == peak} ({peak:.1f} KB/s); cache hits={cache.hits} misses={cache.misses}")
+
+        print(f"\n{'frame':>8} {'ms':>9}")
+        print(f"{'redraw':>8} {frames(redraw_frame, cache, 20):>9.2f}")
+        live = rate_series.LiveSeries(cache.get(MAC, 365))
+        print(f"{'live':>8} {frames(live_frame, live, 200):>9.2f}")
+        print(f"live series: {len(live)} samples, {len(live.drawn)} drawn points")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:2]))
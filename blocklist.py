@@ -0,0 +1,326 @@
+# blocklist.py
+import argparse
+import gzip
+import hashlib
+import ipaddress
+import os
+import re
+import sqlite3
+import subprocess
+from typing import Dict, Iterator, List, Tuple
+from database import DB_PATH, delete_blocklist_source, get_blocklist_domains, get_blocklist_sources
+from events import RuleChanged, publish
+
+# Rows sent to SQLite per executemany call
+BATCH_SIZE = 50000
+
+# Listed domains are enforced by the LAN's DNS server: dnsmasq reads this file
+# (conf-file=/conf-dir=) and answers NXDOMAIN for each domain and its subdomains.
+# The reload command, if set, is run after each export, e.g.
+# IOT_GUARDIAN_DNS_RELOAD="systemctl restart dnsmasq"
+DNSMASQ_FILE = os.environ.get("IOT_GUARDIAN_DNSMASQ_FILE", "/tmp/iot_guardian.dnsmasq.conf")
+DNS_RELOAD = os.environ.get("IOT_GUARDIAN_DNS_RELOAD", "")
+
+# Sinkhole addresses used by hosts-format lists
+HOSTS_SINKHOLES = {"0.0.0.0", "127.0.0.1", "::", "::1"}
+IGNORED_HOSTS = {"localhost", "localhost.localdomain", "local", "broadcasthost",
+                 "ip6-localhost", "ip6-loopback", "0.0.0.0"}
+
+HOSTS_SINKHOLES_BYTES = {s.encode() for s in HOSTS_SINKHOLES}
+
+# Dot-separated labels of up to 63 chars; total length is checked separately
+DOMAIN_RE = re.compile(r"[a-z0-9_-]{1,63}(?:\.[a-z0-9_-]{1,63})+")
+
+
+def _open_list(path: str):
+    """Open a plain or gzip-compressed list file for binary streaming"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def normalize_domain(value: str) -> str:
+    """Return the canonical form of a domain, or '' if it is not one"""
+    value = value.lower().rstrip(".")
+    if value.startswith("*."):
+        value = value[2:]
+    if value in IGNORED_HOSTS or len(value) > 253 or not DOMAIN_RE.fullmatch(value):
+        return ""
+    return value
+
+
+def _is_address(value: str) -> bool:
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_line(line: str) -> List[Tuple[str, object]]:
+    """Parse one hosts/domain/CIDR/adblock line into (entry_type, value) pairs.
+
+    Domain values are normalised strings; CIDR values are ip_network objects.
+    """
+    if "#" in line:
+        line = line.split("#", 1)[0]
+    tokens = line.split()
+    if not tokens:
+        return []
+    first = tokens[0]
+    if first[0] in "![":
+        return []
+
+    # Adblock-style domain anchors: ||example.com^
+    if first.startswith("||"):
+        domain = normalize_domain(first[2:].split("^", 1)[0])
+        return [("domain", domain)] if domain else []
+
+    # hosts format: "0.0.0.0 ads.example.com tracker.example.com". A line
+    # mapping names to any other address lists the names; the address is
+    # not blocked, since it is usually a real, routable host.
+    if len(tokens) > 1 and (first in HOSTS_SINKHOLES or _is_address(first)):
+        entries = []
+        for token in tokens[1:]:
+            domain = normalize_domain(token)
+            if domain:
+                entries.append(("domain", domain))
+        return entries
+
+    if first[0].isdigit() or ":" in first:
+        try:
+            return [("cidr", ipaddress.ip_network(first, strict=False))]
+        except ValueError:
+            pass
+
+    domain = normalize_domain(first)
+    return [("domain", domain)] if domain else []
+
+
+def _reverse_labels(domain: str) -> str:
+    """ads.example.com -> com.example.ads, so parents sort before children"""
+    return ".".join(domain.split(".")[::-1])
+
+
+def file_checksum(path: str) -> str:
+    """SHA-256 of the list file contents"""
+    digest = hashlib.sha256()
+    with _open_list(path) as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _batched(rows: Iterator, size: int = BATCH_SIZE) -> Iterator[List]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _staged_batches(path: str, stats: Dict, networks: Dict[int, List]) -> Iterator[List[Tuple[str]]]:
+    """Yield batches of reversed-label domain keys; collect networks on the side.
+
+    This is the import hot loop, so hosts lines take an inlined fast path and
+    everything else goes through parse_line.
+    """
+    sinkholes = HOSTS_SINKHOLES_BYTES
+    ignored = IGNORED_HOSTS
+    match = DOMAIN_RE.fullmatch
+    batch = []
+    append = batch.append
+    lines = skipped = 0
+
+    with _open_list(path) as f:
+        for raw in f:
+            lines += 1
+            tokens = raw.split()
+            if len(tokens) == 2 and tokens[0] in sinkholes and b"#" not in raw:
+                domain = tokens[1].decode("utf-8", "replace").lower().rstrip(".")
+                if domain not in ignored and len(domain) <= 253 and match(domain):
+                    append((".".join(domain.split(".")[::-1]),))
+                    if len(batch) >= BATCH_SIZE:
+                        yield batch
+                        batch = []
+                        append = batch.append
+                    continue
+
+            entries = parse_line(raw.decode("utf-8", "replace"))
+            if not entries:
+                if raw.strip() and not raw.lstrip().startswith((b"#", b"!")):
+                    skipped += 1
+                continue
+            for entry_type, value in entries:
+                if entry_type == "domain":
+                    append((_reverse_labels(value),))
+                else:
+                    networks[value.version].append(value)
+            if len(batch) >= BATCH_SIZE:
+                yield batch
+                batch = []
+                append = batch.append
+
+    stats['lines'] = lines
+    stats['skipped'] = skipped
+    if batch:
+        yield batch
+
+
+def import_blocklist(name: str, path: str, db_path: str = DB_PATH) -> Dict:
+    """Import a named blocklist file, applying only the delta since the last import.
+
+    Domains are normalised and streamed into a temporary staging table whose
+    primary key deduplicates them, so memory is bounded by the batch size
+    rather than the list size (CIDRs, usually a small share of a list, are
+    collapsed in memory). Domains already covered by a listed parent domain
+    are dropped before the staged set is diffed against the stored version
+    of the source. Everything runs in a single transaction; an unchanged
+    file (same checksum) is a no-op.
+    """
+    stats = {'lines': 0, 'skipped': 0}
+    checksum = file_checksum(path)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    c = conn.cursor()
+    try:
+        c.execute('SELECT checksum, version FROM blocklist_sources WHERE name = ?', (name,))
+        existing = c.fetchone()
+        if existing and existing[0] == checksum:
+            return {'source': name, 'version': existing[1], 'added': 0, 'removed': 0,
+                    'total': None, 'lines': None, 'skipped': None, 'unchanged': True}
+
+        c.execute('BEGIN')
+        # Append-only heap: one sort at the end beats random-order B-tree inserts
+        c.execute('''CREATE TEMP TABLE IF NOT EXISTS blocklist_stage (rkey TEXT)''')
+        c.execute('''CREATE TEMP TABLE IF NOT EXISTS blocklist_kept
+                     (entry_type TEXT, value TEXT,
+                      PRIMARY KEY (entry_type, value)) WITHOUT ROWID''')
+        c.execute('DELETE FROM blocklist_stage')
+        c.execute('DELETE FROM blocklist_kept')
+
+        # Stage: domains keyed by reversed labels, networks collected for collapsing
+        networks = {4: [], 6: []}
+        for batch in _staged_batches(path, stats, networks):
+            c.executemany('INSERT INTO blocklist_stage VALUES (?)', batch)
+
+        # Dedupe and keep a domain only if no parent domain is listed;
+        # with reversed labels, parents sort immediately before their children
+        def kept_domains():
+            last_kept = None
+            for (rkey,) in conn.execute('SELECT DISTINCT rkey FROM blocklist_stage ORDER BY rkey'):
+                if last_kept and rkey.startswith(last_kept + "."):
+                    continue
+                last_kept = rkey
+                yield ("domain", _reverse_labels(rkey))
+
+        for batch in _batched(kept_domains()):
+            c.executemany('INSERT INTO blocklist_kept VALUES (?, ?)', batch)
+
+        collapsed = [("cidr", str(net))
+                     for version in (4, 6)
+                     for net in ipaddress.collapse_addresses(networks[version])]
+        c.executemany('INSERT INTO blocklist_kept VALUES (?, ?)', collapsed)
+
+        # Apply the delta against the stored version of this source
+        c.execute('''DELETE FROM blocklist_entries
+                     WHERE source = ?
+                     AND NOT EXISTS (SELECT 1 FROM blocklist_kept k
+                                     WHERE k.entry_type = blocklist_entries.entry_type
+                                     AND k.value = blocklist_entries.value)''', (name,))
+        removed = c.rowcount
+        c.execute('''INSERT OR IGNORE INTO blocklist_entries (source, entry_type, value)
+                     SELECT ?, entry_type, value FROM blocklist_kept''', (name,))
+        added = c.rowcount
+
+        c.execute('SELECT COUNT(*) FROM blocklist_kept')
+        total = c.fetchone()[0]
+        version = (existing[1] if existing else 0) + (1 if added or removed or not existing else 0)
+
+        c.execute('''INSERT INTO blocklist_sources
+                     (name, path, version, checksum, entry_count, imported_at)
+                     VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                     ON CONFLICT(name) DO UPDATE SET
+                         path = excluded.path,
+                         version = excluded.version,
+                         checksum = excluded.checksum,
+                         entry_count = excluded.entry_count,
+                         imported_at = excluded.imported_at''',
+                  (name, path, version, checksum, total))
+
+        c.execute('DELETE FROM blocklist_stage')
+        c.execute('DELETE FROM blocklist_kept')
+        c.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            c.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    publish(RuleChanged("blocklist", total))
+    return {'source': name, 'version': version, 'added': added, 'removed': removed,
+            'total': total, 'lines': stats['lines'], 'skipped': stats['skipped'],
+            'unchanged': False}
+
+
+def export_dnsmasq(path: str = None, reload_command: str = None) -> int:
+    """Write every listed domain as a dnsmasq `address=/domain/` line.
+
+    The file is replaced atomically, then `reload_command` (default
+    IOT_GUARDIAN_DNS_RELOAD) is run if set. Returns the number of domains.
+    """
+    path = path or DNSMASQ_FILE
+    reload_command = DNS_RELOAD if reload_command is None else reload_command
+    domains = get_blocklist_domains()
+    partial = path + ".tmp"
+    with open(partial, "w") as f:
+        f.write("# Generated by IoT Guardian from the imported blocklists; do not edit\n")
+        for domain in domains:
+            f.write(f"address=/{domain}/\n")
+    os.replace(partial, path)
+    if reload_command:
+        subprocess.run(reload_command.split(), capture_output=True, text=True, check=True)
+    return len(domains)
+
+
+def remove_blocklist(name: str):
+    """Delete a named source and its entries; Apply Rules or export_dnsmasq()
+    then drops them from the firewall and the DNS sinkhole"""
+    delete_blocklist_source(name)
+    publish(RuleChanged("blocklist", 0))
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="IoT Guardian blocklists")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("import", help="import or update a named list file")
+    add.add_argument("name")
+    add.add_argument("path")
+    remove = commands.add_parser("remove", help="delete a named list")
+    remove.add_argument("name")
+    commands.add_parser("list", help="show the imported lists")
+    export = commands.add_parser("export-dnsmasq", help="write the domains for dnsmasq")
+    export.add_argument("--file", default=DNSMASQ_FILE)
+    args = parser.parse_args(argv)
+
+    from database import init_db
+    init_db()
+    if args.command == "import":
+        print(import_blocklist(args.name, args.path))
+    elif args.command == "remove":
+        remove_blocklist(args.name)
+    elif args.command == "list":
+        for source in get_blocklist_sources():
+            print(f"{source['name']} v{source['version']}: {source['entry_count']} entries "
+                  f"from {source['path']} ({source['imported_at']})")
+    if args.command != "list":
+        path = getattr(args, "file", DNSMASQ_FILE)
+        print(f"{export_dnsmasq(path)} domains written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# capture.py
+import heapq
+import itertools
+import os
+import struct
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from database import record_evidence_capture
+from events import CaptureDone, publish
+from metrics import REGISTRY, TSHARK_PROCESSES
+
+CAPTURE_DIR = os.environ.get("IOT_GUARDIAN_CAPTURE_DIR", "captures")
+
+# Concurrent tshark processes and queued requests
+CAPTURE_WORKERS = 2
+MAX_QUEUED = 64
+CAPTURE_SECONDS = 10
+
+QUEUE_DEPTH = REGISTRY.gauge("iot_guardian_capture_queue_depth",
+                             "Evidence captures waiting for a worker")
+IN_FLIGHT = REGISTRY.gauge("iot_guardian_capture_in_flight",
+                           "Evidence captures running")
+CAPTURES = REGISTRY.counter("iot_guardian_captures_total",
+                            "Evidence capture requests by outcome", ["outcome"])
+CAPTURE_DURATION = REGISTRY.histogram("iot_guardian_capture_seconds",
+                                      "Wall time of one evidence capture",
+                                      buckets=(1, 5, 10, 15, 20, 30, 45, 60, 120))
+
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": "<", b"\x4d\x3c\xb2\xa1": "<",   # little-endian (us / ns)
+    b"\xa1\xb2\xc3\xd4": ">", b"\xa1\xb2\x3c\x4d": ">",   # big-endian (us / ns)
+}
+
+
+def count_pcap_packets(path: str) -> int:
+    """Count records in a classic pcap file by walking its record headers"""
+    with open(path, "rb") as f:
+        header = f.read(24)
+        if len(header) < 24 or header[:4] not in PCAP_MAGIC:
+            raise ValueError(f"{path} is not a pcap file")
+        record = struct.Struct(PCAP_MAGIC[header[:4]] + "IIII")
+        packets = 0
+        while True:
+            raw = f.read(record.size)
+            if len(raw) < record.size:
+                return packets
+            captured_length = record.unpack(raw)[2]
+            f.seek(captured_length, os.SEEK_CUR)
+            packets += 1
+
+
+class EvidenceCapturePool:
+    """Fixed pool of workers taking evidence captures for flagged devices.
+
+    Requests wait in a bounded priority queue ordered by severity. A device
+    has at most one capture queued or running; repeated requests only raise
+    its priority. When the queue is full, a more severe request evicts the
+    least severe one. Results go to the `evidence_captures` table.
+
+    `interface_for(mac)` picks the interface a device is on; captures fall
+    back to `interface` when it returns None.
+    """
+
+    def __init__(self, interface: str, workers: int = CAPTURE_WORKERS,
+                 max_queued: int = MAX_QUEUED, duration: int = CAPTURE_SECONDS,
+                 output_dir: str = CAPTURE_DIR, runner: Callable = None,
+                 clock: Callable[[], float] = time.time,
+                 interface_for: Callable[[str], Optional[str]] = None):
+        self.interface = interface
+        self.interface_for = interface_for
+        self.workers = workers
+        self.max_queued = max_queued
+        self.duration = duration
+        self.output_dir = output_dir
+        self.runner = runner or self._run_tshark
+        self.clock = clock
+        self._heap: List[list] = []
+        self._queued: Dict[str, list] = {}
+        self._in_flight = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self.running = False
+        self.metrics = {
+            'submitted': 0,
+            'deduplicated': 0,
+            'dropped': 0,
+            'completed': 0,
+            'failed': 0,
+            'max_queue_depth': 0,
+        }
+
+    def command(self, mac: str, filename: str) -> List[str]:
+        return [
+            "tshark", "-i", (self.interface_for and self.interface_for(mac)) or self.interface, "-q",
+            "-a", f"duration:{self.duration}",
+            "-F", "pcap", "-w", filename,
+            "-f", f"ether host {mac}"
+        ]
+
+    def _run_tshark(self, cmd: List[str]):
+        tshark = TSHARK_PROCESSES.labels("capture")
+        tshark.inc()
+        try:
+            subprocess.run(cmd, check=True, capture_output=True, timeout=self.duration + 30)
+        finally:
+            tshark.dec()
+
+    def submit(self, mac: str, severity: float = 1.0, reason: str = None) -> bool:
+        """Request a capture; returns False if the device already has one pending"""
+        with self._cond:
+            self.metrics['submitted'] += 1
+            entry = self._queued.get(mac)
+            if entry is not None:
+                self.metrics['deduplicated'] += 1
+                CAPTURES.labels("deduplicated").inc()
+                if severity > -entry[0]:
+                    # Re-queue with the higher priority; the old entry is skipped
+                    entry[2] = None
+                    self._push(mac, severity, reason)
+                return False
+            if mac in self._in_flight:
+                self.metrics['deduplicated'] += 1
+                CAPTURES.labels("deduplicated").inc()
+                return False
+
+            if len(self._queued) >= self.max_queued:
+                weakest = min(self._queued.values(), key=lambda e: (-e[0], -e[1]))
+                if -weakest[0] >= severity:
+                    self.metrics['dropped'] += 1
+                    CAPTURES.labels("dropped").inc()
+                    return False
+                self._queued.pop(weakest[2])
+                weakest[2] = None
+                self.metrics['dropped'] += 1
+                CAPTURES.labels("dropped").inc()
+
+            self._push(mac, severity, reason)
+            self.metrics['max_queue_depth'] = max(self.metrics['max_queue_depth'], len(self._queued))
+            self._cond.notify()
+            return True
+
+    def _push(self, mac: str, severity: float, reason: Optional[str]):
+        entry = [-severity, next(self._seq), mac, reason]
+        self._queued[mac] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _next(self) -> Optional[list]:
+        with self._cond:
+            while self.running:
+                while self._heap:
+                    entry = heapq.heappop(self._heap)
+                    if entry[2] is None:
+                        continue  # superseded or evicted
+                    mac = entry[2]
+                    del self._queued[mac]
+                    self._in_flight.add(mac)
+                    return entry
+                self._cond.wait()
+            return None
+
+    def _capture(self, mac: str, severity: float, reason: Optional[str]) -> Dict:
+        started_at = self.clock()
+        filename = os.path.join(
+            self.output_dir, f"abnormal_{mac.replace(':', '')}_{int(started_at)}.pcap")
+        capture = {
+            'mac': mac,
+            'file': filename,
+            'severity': severity,
+            'reason': reason,
+            'started_at': started_at,
+        }
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self.runner(self.command(mac, filename))
+            capture['size_bytes'] = os.path.getsize(filename)
+            capture['packets'] = count_pcap_packets(filename)
+            capture['status'] = "completed"
+        except Exception as e:
+            capture['status'] = "failed"
+            capture['error'] = str(e)
+        capture['finished_at'] = self.clock()
+        return capture
+
+    def _worker(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+            severity, mac, reason = -entry[0], entry[2], entry[3]
+            capture = self._capture(mac, severity, reason)
+            try:
+                record_evidence_capture(capture)
+            except Exception as e:
+                print(f"Failed to record capture for {mac}: {e}")
+            publish(CaptureDone(mac, capture['file'], capture['status'], severity,
+                                capture['started_at'], capture.get('packets'),
+                                capture.get('size_bytes'), capture.get('error')))
+            with self._cond:
+                self._in_flight.discard(mac)
+                self.metrics[capture['status']] += 1
+            CAPTURES.labels(capture['status']).inc()
+            CAPTURE_DURATION.observe(capture['finished_at'] - capture['started_at'])
+
+    def stats(self) -> Dict:
+        """Queue depth, in-flight count and lifetime counters"""
+        with self._cond:
+            return dict(self.metrics, queued=len(self._queued), in_flight=len(self._in_flight))
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        QUEUE_DEPTH.set_function(lambda: len(self._queued))
+        IN_FLIGHT.set_function(lambda: len(self._in_flight))
+        self._threads = [threading.Thread(target=self._worker, name=f"capture-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop taking new work; running captures finish, queued ones are dropped"""
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -0,0 +1,466 @@
+# daemon.py
+"""Headless IoT Guardian collector.
+
+Runs device discovery, traffic accounting, the IPS and data retention as
+background services, with state shared through SQLite so the Flet UI only
+has to read it. Nothing here imports Flet.
+
+    python daemon.py [--interface br0 [--interface br1 ...]] [--no-ips] [--no-accounting]
+
+With more than one interface, discovery and accounting run in a worker
+process per interface (workers.py) and are merged here.
+"""
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Callable, List, Optional
+from database import (init_db, save_devices, get_device_presence, cleanup_old_records, update_service_status,
+                      clear_service_status, get_service_status, rollup_data_rates, get_interfaces)
+from events import DeviceJoined, DeviceLeft, PresenceChanged, publish
+from presence import IDLE_SECONDS, OFFLINE, PresenceTracker
+from tracing import install_signal_handlers
+
+DISCOVERY_MIN_INTERVAL = 10
+# Well below IDLE_SECONDS, so a device has to miss two scans in a row
+# before it goes idle
+DISCOVERY_MAX_INTERVAL = IDLE_SECONDS // 3
+RETENTION_INTERVAL = 3600
+ROLLUP_INTERVAL = 60
+HEARTBEAT_INTERVAL = 15
+
+# A collector whose heartbeat is older than this is considered gone
+HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+
+class Service:
+    """A background service with start/stop and a one-line status"""
+
+    name = ""
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def status(self) -> str:
+        return ""
+
+
+class PeriodicService(Service):
+    """Runs `run_once` on its own thread every `interval` seconds"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.runs = 0
+        self.busy = False
+        self.last_error: Optional[str] = None
+        self._done = threading.Condition()
+        self._stop = threading.Event()
+        self._trigger = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def trigger(self):
+        """Run again now instead of waiting for the interval"""
+        self._trigger.set()
+
+    def run_now(self, timeout: float = None) -> bool:
+        """Wait for a fresh run: the one in progress, or a newly triggered one"""
+        with self._done:
+            target = self.runs + 1
+            if not self.busy:
+                self._trigger.set()
+            return self._done.wait_for(lambda: self.runs >= target, timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._trigger.clear()
+            with self._done:
+                self.busy = True
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"{self.name} error: {e}")
+            with self._done:
+                self.busy = False
+                self.runs += 1
+                self._done.notify_all()
+            self._trigger.wait(self.interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.busy = True  # the first run starts right away
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._trigger.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def status(self) -> str:
+        return f"runs={self.runs}" + (f" error={self.last_error}" if self.last_error else "")
+
+
+class DiscoveryService(PeriodicService):
+    """Scans for connected devices in the background and tracks their presence.
+
+    The interval adapts: after a scan that changed any device's presence it
+    drops to DISCOVERY_MIN_INTERVAL, and each quiet scan stretches it by half
+    up to DISCOVERY_MAX_INTERVAL, never more than a third of IDLE_SECONDS. Each scan is written in one transaction
+    that skips unchanged profiles and only refreshes presence last_seen
+    every LAST_SEEN_FLUSH_SECONDS. Only the changes are published: PresenceChanged for every state
+    change, DeviceJoined for arrivals and DeviceLeft when a device goes offline.
+
+    `scanner` replaces the in-process scan, e.g. with one that merges the
+    scans of several interface workers.
+    """
+
+    name = "discovery"
+
+    def __init__(self, min_interval: float = DISCOVERY_MIN_INTERVAL,
+                 max_interval: float = DISCOVERY_MAX_INTERVAL,
+                 scanner: Callable[[], List[dict]] = None):
+        super().__init__(min_interval)
+        self.min_interval = min_interval
+        self.max_interval = min(max_interval, IDLE_SECONDS / 3)
+        self.scanner = scanner
+        self.last_count = 0
+        self.last_written = 0
+        self.tracker: Optional[PresenceTracker] = None
+
+    def run_once(self):
+        from device_utils import get_connected_devices
+        if self.tracker is None:
+            self.tracker = PresenceTracker(get_device_presence())
+        devices = self.scanner() if self.scanner else get_connected_devices()
+        seen = {device['mac'] for device in devices}
+        transitions = self.tracker.update(seen)
+        self.last_written = save_devices(devices, self.tracker.unsaved(transitions, seen))
+        self.last_count = len(devices)
+
+        by_mac = {device['mac']: device for device in devices}
+        for mac, previous, state in transitions:
+            publish(PresenceChanged(mac, state, previous))
+            if previous in (None, OFFLINE):
+                device = by_mac.get(mac, {})
+                publish(DeviceJoined(mac, device.get('ipv4'), device.get('name'), device.get('vendor')))
+            elif state == OFFLINE:
+                publish(DeviceLeft(mac))
+
+        if transitions:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 1.5, self.max_interval)
+
+    def status(self) -> str:
+        return (f"devices={self.last_count} written={self.last_written} "
+                f"interval={self.interval:.0f}s " + super().status())
+
+
+class RetentionService(PeriodicService):
+    """Archives aged samples and IPS events, then deletes data rate samples
+    older than the retention period"""
+
+    name = "retention"
+
+    def __init__(self, interval: float = RETENTION_INTERVAL):
+        super().__init__(interval)
+        self.last_archived = {}
+
+    def run_once(self):
+        from archive import run_archive
+        self.last_archived = run_archive()
+        cleanup_old_records()
+
+    def status(self) -> str:
+        archived = " ".join(f"{kind}={count}" for kind, count in self.last_archived.items())
+        return (f"archived: {archived} " if archived else "") + super().status()
+
+
+class RollupService(PeriodicService):
+    """Folds new data rate samples into the per-minute and hourly rollups"""
+
+    name = "rollup"
+
+    def __init__(self, interval: float = ROLLUP_INTERVAL):
+        super().__init__(interval)
+        self.last_folded = 0
+
+    def run_once(self):
+        self.last_folded = 0
+        while True:
+            folded = rollup_data_rates()
+            self.last_folded += folded
+            if not folded or self._stop.is_set():
+                break
+
+    def status(self) -> str:
+        return f"folded={self.last_folded} " + super().status()
+
+
+class AccountingService(Service):
+    """Per-device traffic accounting on the hotspot interface"""
+
+    name = "accounting"
+
+    def __init__(self, interface: str):
+        from accounting import TrafficAccountant
+        self.accountant = TrafficAccountant(interface)
+
+    def start(self):
+        self.accountant.start()
+
+    def stop(self):
+        self.accountant.stop()
+
+    def status(self) -> str:
+        return f"interface={self.accountant.interface} running={self.accountant.running}"
+
+
+class IPSService(Service):
+    """The IPS, evaluating the rates published by the accounting service"""
+
+    name = "ips"
+
+    def __init__(self, backend, backends=None):
+        from ips import IPSMonitor
+        self.monitor = IPSMonitor(backend=backend, accountant=False, backends=backends)
+
+    def start(self):
+        self.monitor.start_monitoring()
+
+    def stop(self):
+        self.monitor.stop_monitoring()
+
+    def status(self) -> str:
+        captures = self.monitor.captures.stats()
+        return (f"devices={len(self.monitor.rate_table)} "
+                f"throttled={len(self.monitor.throttles.active)} "
+                f"captures_queued={captures['queued']}")
+
+
+class MetricsService(Service):
+    """Prometheus text endpoint for the metrics registry"""
+
+    name = "metrics"
+
+    def __init__(self, port: int = None):
+        from metrics import MetricsServer, METRICS_PORT
+        self.server = MetricsServer(port=METRICS_PORT if port is None else port)
+
+    def start(self):
+        self.server.start()
+
+    def stop(self):
+        self.server.stop()
+
+    def status(self) -> str:
+        return f"port={self.server.port}"
+
+
+class APIService(Service):
+    """Local HTTP/JSON API with live rate and IPS event streams"""
+
+    name = "api"
+
+    def __init__(self, port: int = None):
+        from api import APIServer, API_PORT
+        self.server = APIServer(port=API_PORT if port is None else port)
+
+    def start(self):
+        try:
+            self.server.start()
+        except OSError as e:
+            print(f"API unavailable: {e}")
+
+    def stop(self):
+        self.server.stop()
+
+    def status(self) -> str:
+        return f"port={self.server.port} streams={len(self.server.hub.subscribers)}"
+
+
+class Collector:
+    """Starts the services, writes their heartbeats and stops them in reverse order"""
+
+    def __init__(self, services: List[Service], clock: Callable[[], float] = time.time):
+        self.services = services
+        self.clock = clock
+        self.pid = os.getpid()
+        self.host = socket.gethostname()
+        self.started_at = clock()
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def get(self, name: str) -> Optional[Service]:
+        return next((s for s in self.services if s.name == name), None)
+
+    def heartbeat(self):
+        now = self.clock()
+        for service in self.services:
+            update_service_status(service.name, self.pid, self.host, self.started_at,
+                                  now, service.status())
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"Heartbeat error: {e}")
+
+    def start(self):
+        for service in self.services:
+            service.start()
+        self.heartbeat()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+        for service in reversed(self.services):
+            try:
+                service.stop()
+            except Exception as e:
+                print(f"Failed to stop {service.name}: {e}")
+        clear_service_status(self.pid)
+
+    def request_stop(self):
+        self._stop.set()
+
+    def wait(self):
+        self._stop.wait()
+
+
+def monitored_interfaces(names: List[str] = None) -> List[dict]:
+    """Interfaces to monitor: the given names, else the enabled ones in the
+    interfaces table; empty means the platform default"""
+    if names:
+        configured = {i['name']: i for i in get_interfaces(enabled_only=False)}
+        return [configured.get(name, {'name': name, 'subnet': None}) for name in names]
+    return get_interfaces()
+
+
+def build_collector(interfaces: List[str] = None, ips: bool = True, accounting: bool = True,
+                    discovery: bool = True, retention: bool = True,
+                    metrics_port: Optional[int] = None,
+                    api_port: Optional[int] = None,
+                    sync_url: Optional[str] = None, site: Optional[str] = None) -> Collector:
+    """Collector with the requested services; heavy modules load only when used.
+
+    interfaces: names to monitor (see monitored_interfaces()). With more than
+    one, discovery and accounting run in a worker process per interface,
+    and devices are shaped on the interface they were discovered on;
+    firewall rules stay on the first.
+    metrics_port / api_port: serve /metrics or the JSON API on this port;
+    None uses the default, 0 disables it.
+    sync_url: ship this site's changes to a central collector (sync.py);
+    None uses IOT_GUARDIAN_SYNC_URL, "" disables it.
+    """
+    from firewall_backend import get_firewall_backend
+    monitored = monitored_interfaces(interfaces)
+    backends = {interface['name']: get_firewall_backend(interface['name'])
+                for interface in monitored}
+    backend = backends[monitored[0]['name']] if monitored else get_firewall_backend()
+    services: List[Service] = []
+    if metrics_port != 0:
+        try:
+            services.append(MetricsService(metrics_port))
+        except OSError as e:
+            print(f"Metrics endpoint unavailable: {e}")
+    if len(monitored) > 1 and (discovery or accounting):
+        from device_utils import get_connected_devices
+        from workers import InterfaceSupervisor
+        supervisor = InterfaceSupervisor(monitored, accounting=accounting)
+        services.append(supervisor)
+        if discovery:
+            services.append(DiscoveryService(
+                scanner=lambda: get_connected_devices(observations=supervisor.scan())))
+    else:
+        if discovery:
+            scanner = None
+            if monitored:
+                from device_utils import get_connected_devices
+                interface = monitored[0]
+                scanner = lambda: get_connected_devices(interface=interface['name'],
+                                                        subnet=interface.get('subnet'))
+            services.append(DiscoveryService(scanner=scanner))
+        if accounting:
+            services.append(AccountingService(backend.interface))
+    if ips:
+        services.append(IPSService(backend, backends))
+    if retention:
+        services.append(RetentionService())
+        services.append(RollupService())
+    if api_port != 0:
+        services.append(APIService(api_port))
+    if sync_url is None:
+        sync_url = os.environ.get("IOT_GUARDIAN_SYNC_URL", "")
+    if sync_url:
+        from sync import SyncService, SITE
+        services.append(SyncService(sync_url, site or SITE))
+    return Collector(services)
+
+
+def running_collector(max_age: float = HEARTBEAT_TIMEOUT) -> Optional[dict]:
+    """Heartbeat of a live collector in another process, if any"""
+    now = time.time()
+    for status in get_service_status():
+        if status['pid'] != os.getpid() and now - status['heartbeat'] <= max_age:
+            return status
+    return None
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="IoT Guardian headless collector")
+    parser.add_argument("--interface", action="append",
+                        help="interface to monitor, repeatable (default: the interfaces table, "
+                             "else per platform)")
+    parser.add_argument("--no-ips", action="store_true", help="do not run the IPS")
+    parser.add_argument("--no-accounting", action="store_true", help="do not run traffic accounting")
+    parser.add_argument("--no-discovery", action="store_true", help="do not scan for devices")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Prometheus endpoint port on localhost (default 9464, 0 disables)")
+    parser.add_argument("--api-port", type=int,
+                        help="JSON API port on localhost (default 8765, 0 disables)")
+    parser.add_argument("--sync-url",
+                        help="central collector to sync this site to, e.g. http://hq:8766 (sync.py)")
+    parser.add_argument("--site", help="site name for --sync-url (default: hostname)")
+    args = parser.parse_args(argv)
+
+    init_db()
+    other = running_collector()
+    if other:
+        parser.exit(1, f"A collector is already running (pid {other['pid']} on {other['host']})\n")
+
+    collector = build_collector(args.interface, ips=not args.no_ips,
+                                accounting=not args.no_accounting,
+                                discovery=not args.no_discovery,
+                                metrics_port=args.metrics_port,
+                                api_port=args.api_port,
+                                sync_url=args.sync_url, site=args.site)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: collector.request_stop())
+    install_signal_handlers()
+    collector.start()
+    print(f"IoT Guardian collector running: {', '.join(s.name for s in collector.services)}")
+    collector.wait()
+    collector.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
 # data_rate_tab.py
 import flet as ft
+import calendar
+import threading
 import time
 from datetime import datetime, timedelta
 from typing import List, Dict
-from database import get_all_devices, get_data_rate_history, get_retention_days, set_retention_days, cleanup_old_records
+from database import DB_PATH, get_all_devices, get_retention_days, set_retention_days, cleanup_old_records, record_data_rate
+from archive import delete_device_archive, delete_rate_sample
+from rate_series import (CHART_POINTS, LIVE_FPS, LIVE_POLL_SECONDS, PAGE_ROWS, LiveSeries,
+                         cache as series_cache, tick_step, time_ticks)
 import sqlite3
+from events import COALESCE, DeviceJoined, RateSample, subscribe
+from tracing import span, traced
 
 def get_data_rate_tab(page: ft.Page) -> ft.Column:
     """Tab for viewing and managing data rate history"""
@@ -58,6 +65,31 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
     
     status_text = ft.Text("", color=ft.colors.GREY_600)
     
+    # Live mode: new samples are appended to the shown series by a frame
+    # loop running at LIVE_FPS, instead of reloading and redrawing it
+    live_switch = ft.Switch(label="Live", value=False)
+    live = None
+    live_scale = 1
+    live_step = None
+    render_lock = threading.RLock()
+    new_sample = threading.Event()
+    live_stop = None
+    
+    # Records table paging over the series the chart shows
+    current_series = None
+    table_page = 0
+    page_label = ft.Text("", color=ft.colors.GREY_600)
+    previous_button = ft.IconButton(
+        icon=ft.icons.CHEVRON_LEFT,
+        tooltip="Newer records",
+        on_click=lambda e: change_page(-1)
+    )
+    next_button = ft.IconButton(
+        icon=ft.icons.CHEVRON_RIGHT,
+        tooltip="Older records",
+        on_click=lambda e: change_page(1)
+    )
+    
     # Add refresh button
     refresh_button = ft.IconButton(
         icon=ft.icons.REFRESH,
@@ -66,7 +98,7 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
     )
     
     # Load devices into dropdown
-    def load_devices():
+    def load_devices(keep_selection: bool = False):
         devices = get_all_devices()
         device_dropdown.options = [
             ft.dropdown.Option(
@@ -74,7 +106,7 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
                 key=d.get('mac')
             ) for d in devices
         ]
-        if devices:
+        if devices and not (keep_selection and device_dropdown.value):
             device_dropdown.value = devices[0].get('mac')
         page.update()
     
@@ -88,12 +120,19 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
         page.update()
     
     # Generate and display graph
+    @traced("ui")
     def update_graph(mac: str, days: int):
+        with render_lock:
+            draw_graph(mac, days)
+    
+    def draw_graph(mac: str, days: int):
+        nonlocal current_series, table_page, live, live_scale, live_step
+        live = None
         if not mac:
             return
             
-        history = get_data_rate_history(mac, days)
-        if not history:
+        series = series_cache.get(mac, days)
+        if not len(series):
             graph_container.content = ft.Text(
                 f"No data available for selected device in last {days} days",
                 size=16,
@@ -101,24 +140,29 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
             )
             status_text.value = f"No data available for selected device in last {days} days"
             status_text.color = ft.colors.ORANGE
+            current_series = None
+            if live_switch.value:
+                live = LiveSeries(series)  # wait for the first samples
+            update_table()
             page.update()
             return
-            
-        timestamps = [h['timestamp'] for h in history]
-        rates = [h['data_rate'] for h in history]
         
         # Ensure we have meaningful rates (convert from B/s if needed)
-        if max(rates) < 0.1:
-            rates = [rate * 1024 for rate in rates]  # Convert to KB/s
+        scale = 1024 if series.rates.max() < 0.1 else 1  # Convert to KB/s
+        
+        # One point per pixel column, chosen by LTTB so peaks survive
+        with span("downsample", cat="ui", samples=len(series)):
+            width = int(graph_container.width or CHART_POINTS)
+            if live_switch.value:
+                live = LiveSeries(series, width)
+                live_scale = scale
+                drawn = list(live.drawn) + ([live.tail] if live.tail else [])
+            else:
+                points = series.chart_points(width)
+                drawn = zip(series.times[points].tolist(), series.rates[points].tolist())
         
         # Create chart data points
-        data_points = [
-            ft.LineChartDataPoint(
-                x=i,
-                y=rate,
-                tooltip=f"{timestamps[i]}\n{rate:.2f} KB/s"
-            ) for i, rate in enumerate(rates)
-        ]
+        data_points = [chart_point(t, rate * scale) for t, rate in drawn]
         
         # Update chart
         chart.data_series = [
@@ -132,18 +176,44 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
             )
         ]
         
-        # Update bottom axis labels (show every nth timestamp)
-        n = max(1, len(timestamps) // 5)
-        chart.bottom_axis.labels = [
-            ft.ChartAxisLabel(
-                value=i,
-                label=ft.Text(timestamps[i].split()[0], size=10)
-            ) for i in range(0, len(timestamps), n)
-        ]
+        # Update bottom axis labels: ticks on round times, as dates unless
+        # the range spans less than two days. A live chart spans its window.
+        if live is not None:
+            first, last = live.start, int(series.times[-1])
+        else:
+            first, last = int(series.times[0]), int(series.times[-1])
+        live_step = tick_step(last - first)
+        chart.min_x, chart.max_x = first, last
+        chart.bottom_axis.labels = [time_label(value) for value in time_ticks(first, last, live_step)]
         
         # Update left axis based on data range
-        max_rate = max(rates) if rates else 10
-        min_rate = min(rates) if rates else 0
+        set_rate_axis(float(series.rates.max()) * scale, float(series.rates.min()) * scale)
+        
+        graph_container.content = chart
+        if series is not current_series:
+            table_page = 0
+        current_series = series
+        update_table()
+        status_text.value = f"Showing {len(data_points)} of {len(series)} samples for last {days} days"
+        status_text.color = ft.colors.GREEN
+        with span("page.update", cat="ui", points=len(data_points)):
+            page.update()
+    
+    def chart_point(t: int, rate: float) -> ft.LineChartDataPoint:
+        return ft.LineChartDataPoint(
+            x=t,
+            y=rate,
+            tooltip=f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))}\n{rate:.2f} KB/s"
+        )
+    
+    def time_label(value: int) -> ft.ChartAxisLabel:
+        label_format = "%Y-%m-%d" if chart.max_x - chart.min_x > 2 * 86400 else "%H:%M"
+        return ft.ChartAxisLabel(
+            value=value,
+            label=ft.Text(time.strftime(label_format, time.gmtime(value)), size=10)
+        )
+    
+    def set_rate_axis(max_rate: float, min_rate: float):
         chart.left_axis.labels = [
             ft.ChartAxisLabel(
                 value=value,
@@ -158,54 +228,140 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
         # Set visible range for the y-axis
         if max_rate > min_rate:
             chart.left_axis.interval = (max_rate - min_rate) / 5
-        
-        graph_container.content = chart
-        update_table(mac, days)
-        status_text.value = f"Showing data for last {days} days"
-        status_text.color = ft.colors.GREEN
-        page.update()
     
-    # Update data table
-    def update_table(mac: str, days: int):
-        if not mac:
-            return
+    # One live frame: append the rows written since the last frame and slide
+    # the window. Only new and evicted points, ticks and table rows change.
+    @traced("ui")
+    def live_frame():
+        with render_lock:
+            if live is None:
+                return
+            samples, added, removed, bounds_changed = live.update()
+            if not (samples or removed):
+                return
+            series = live.series
+            series_cache.put(series)
             
-        history = get_data_rate_history(mac, days)
+            if graph_container.content is chart:
+                data_points = chart.data_series[0].data_points
+                if samples and data_points:
+                    data_points.pop()  # the open bucket's point is redrawn below
+                del data_points[:removed]
+                data_points.extend(chart_point(t, rate * live_scale) for t, rate in added)
+                if samples and live.tail:
+                    data_points.append(chart_point(live.tail[0], live.tail[1] * live_scale))
+                
+                # Slide the time axis: drop ticks that left, add ticks that came in
+                chart.min_x, chart.max_x = live.start, max(chart.max_x, live.cursor)
+                labels = chart.bottom_axis.labels
+                while labels and labels[0].value < chart.min_x:
+                    labels.pop(0)
+                since = labels[-1].value + live_step if labels else chart.min_x
+                labels.extend(time_label(value) for value in time_ticks(since, chart.max_x, live_step))
+                if bounds_changed:
+                    set_rate_axis(live.high * live_scale, live.low * live_scale)
+            elif samples:
+                # First samples of an empty series: draw it from scratch
+                draw_graph(series.mac, series.days)
+                return
+            
+            # Newest rows go on top of the first table page
+            if table_page == 0 and current_series is series:
+                for t, rate in samples:
+                    data_table.rows.insert(0, table_row(series.mac, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t)), rate))
+                del data_table.rows[PAGE_ROWS:]
+            update_pager()
+            if samples:
+                t, rate = samples[-1]
+                status_text.value = (f"Live: {len(series)} samples, latest {rate * live_scale:.2f} KB/s "
+                                     f"at {time.strftime('%H:%M:%S', time.gmtime(t))}")
+                status_text.color = ft.colors.GREEN
+            with span("page.update", cat="ui", points=len(added), removed=removed):
+                page.update()
+    
+    # Frames run at LIVE_FPS at most. A frame reads the database when a
+    # RateSample for the device arrived, or every LIVE_POLL_SECONDS anyway.
+    def live_loop(stop: threading.Event):
+        next_poll = 0
+        while not stop.wait(1 / LIVE_FPS):
+            if not new_sample.is_set() and time.monotonic() < next_poll:
+                continue
+            new_sample.clear()
+            next_poll = time.monotonic() + LIVE_POLL_SECONDS
+            live_frame()
+    
+    def toggle_live(e):
+        nonlocal live_stop
+        if live_stop is not None:
+            live_stop.set()
+            live_stop = None
+        if live_switch.value:
+            live_stop = threading.Event()
+            threading.Thread(target=live_loop, args=(live_stop,), name="usage-live", daemon=True).start()
+        update_graph(device_dropdown.value, int(days_slider.value))
+    
+    # Update data table: one page of the series the chart shows, newest first
+    def update_table():
+        series = current_series
         data_table.rows.clear()
+        if series is None:
+            page_label.value = ""
+            return
         
-        for record in history:
-            data_table.rows.append(
-                ft.DataRow(
-                    cells=[
-                        ft.DataCell(ft.Text(record['timestamp'])),
-                        ft.DataCell(ft.Text(f"{record['data_rate']:.2f}")),
-                        ft.DataCell(
-                            ft.IconButton(
-                                icon=ft.icons.DELETE,
-                                tooltip="Delete record",
-                                on_click=lambda e, ts=record['timestamp']: delete_record(mac, ts)
-                            )
-                        )
-                    ]
+        for timestamp, rate in series.page(table_page):
+            data_table.rows.append(table_row(series.mac, timestamp, rate))
+        update_pager()
+    
+    def table_row(mac: str, timestamp: str, rate: float) -> ft.DataRow:
+        return ft.DataRow(
+            cells=[
+                ft.DataCell(ft.Text(timestamp)),
+                ft.DataCell(ft.Text(f"{rate:.2f}")),
+                ft.DataCell(
+                    ft.IconButton(
+                        icon=ft.icons.DELETE,
+                        tooltip="Delete record",
+                        on_click=lambda e: delete_record(mac, timestamp)
+                    )
                 )
-            )
+            ]
+        )
+    
+    def update_pager():
+        series = current_series
+        page_label.value = f"Page {table_page + 1} of {series.pages()} ({len(series)} records)"
+        previous_button.disabled = table_page == 0
+        next_button.disabled = table_page >= series.pages() - 1
+    
+    def change_page(step: int):
+        nonlocal table_page
+        if current_series is None:
+            return
+        with render_lock:
+            table_page = min(max(table_page + step, 0), current_series.pages() - 1)
+            update_table()
         page.update()
     
     # Delete a single record
     def delete_record(mac: str, timestamp: str):
-        conn = sqlite3.connect('iot_guardian.db')
+        conn = sqlite3.connect(DB_PATH)
         c = conn.cursor()
         
         c.execute('''DELETE FROM device_data_rates 
                      WHERE mac = ? AND timestamp = ?''', 
                   (mac, timestamp))
+        deleted = c.rowcount
         
         conn.commit()
         conn.close()
+        if not deleted:
+            # Older rows live in the archive
+            deleted = delete_rate_sample(mac, calendar.timegm(time.strptime(timestamp, "%Y-%m-%d %H:%M:%S")))
+        series_cache.invalidate(mac)
         
         update_graph(mac, int(days_slider.value))
-        status_text.value = "Record deleted"
-        status_text.color = ft.colors.GREEN
+        status_text.value = "Record deleted" if deleted else "Record not found"
+        status_text.color = ft.colors.GREEN if deleted else ft.colors.ORANGE
         page.update()
     
     # Delete all records for device
@@ -214,7 +370,7 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
         if not mac:
             return
             
-        conn = sqlite3.connect('iot_guardian.db')
+        conn = sqlite3.connect(DB_PATH)
         c = conn.cursor()
         
         c.execute('''DELETE FROM device_data_rates 
@@ -222,6 +378,8 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
         
         conn.commit()
         conn.close()
+        delete_device_archive(mac)
+        series_cache.invalidate(mac)
         
         update_graph(mac, int(days_slider.value))
         status_text.value = "All records deleted for this device"
@@ -256,9 +414,24 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
     def device_changed(e):
         update_graph(device_dropdown.value, int(days_slider.value))
     
+    # Live updates from the event bus: new devices join the dropdown, and a
+    # closed accounting window for the selected device wakes the live frame
+    # loop. With live mode off the graph is only redrawn when the selection
+    # or range changes, not reloaded on every sample.
+    def on_bus_events(batch):
+        if any(isinstance(event, DeviceJoined) for event in batch):
+            load_devices(keep_selection=True)
+        selected = device_dropdown.value
+        if live_switch.value and any(isinstance(event, RateSample) and event.final and event.mac == selected
+                                     for event in batch):
+            new_sample.set()
+    
     # Initialize UI
     load_devices()
+    subscribe((DeviceJoined, RateSample), maxsize=4096, policy=COALESCE,
+              key=lambda e: (e.mac, getattr(e, 'final', None)), callback=on_bus_events, name="usage-tab-events")
     device_dropdown.on_change = device_changed
+    live_switch.on_change = toggle_live
     days_slider.on_change_end = lambda e: update_graph(device_dropdown.value, int(days_slider.value))
     
     if device_dropdown.value:
@@ -272,7 +445,8 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
             ft.Row([
                 ft.Row([
                     device_dropdown,
-                    refresh_button  # Added refresh button
+                    refresh_button,  # Added refresh button
+                    live_switch
                 ], spacing=5),
                 ft.Column([
                     ft.Text("Retention Period (days)"),
@@ -317,6 +491,7 @@ def get_data_rate_tab(page: ft.Page) -> ft.Column:
                 border_radius=5,
                 height=300
             ),
+            ft.Row([previous_button, page_label, next_button], spacing=5),
             status_text
         ],
         spacing=20,
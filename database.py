@@ -1,15 +1,43 @@
 # database.py
 import sqlite3
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import List, Dict, Optional
 import time
 import os
+from functools import wraps
+from metrics import REGISTRY
+import tracing
+
+DB_PATH = os.environ.get('IOT_GUARDIAN_DB', 'iot_guardian.db')
+
+# Stored in PRAGMA user_version; bump whenever init_db() changes
+SCHEMA_VERSION = 8
+
+# Rate rollup bucket sizes in seconds; minute rollups follow the raw
+# retention period, hourly ones are kept for ROLLUP_RETENTION_DAYS
+ROLLUP_RESOLUTIONS = (60, 3600)
+ROLLUP_RETENTION_DAYS = 365
+
+def _add_column(c: sqlite3.Cursor, table: str, column: str, declaration: str):
+    """ALTER TABLE ADD COLUMN unless a database from an older schema already has it"""
+    c.execute(f'PRAGMA table_info({table})')
+    if column not in (row[1] for row in c.fetchall()):
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
 
 def init_db():
-    """Initialize the database with required tables"""
-    conn = sqlite3.connect('iot_guardian.db')
+    """Initialize the database with required tables.
+
+    Called once at startup by the app, the daemon and the tools; a database
+    already at SCHEMA_VERSION is left untouched.
+    """
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
+    c.execute('PRAGMA user_version')
+    if c.fetchone()[0] == SCHEMA_VERSION:
+        conn.close()
+        return
+    
     # Create devices table
     c.execute('''CREATE TABLE IF NOT EXISTS devices
                  (mac TEXT PRIMARY KEY,
@@ -67,6 +95,110 @@ def init_db():
                   action_taken TEXT,
                   FOREIGN KEY(mac) REFERENCES devices(mac))''')
     
+    # Create learned per-device baselines table (fixed-size binary state)
+    c.execute('''CREATE TABLE IF NOT EXISTS device_baselines
+                 (mac TEXT PRIMARY KEY,
+                  samples INTEGER,
+                  ewma REAL,
+                  ewvar REAL,
+                  profile BLOB,
+                  sketch BLOB,
+                  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    
+    # Create active throttles table (survives restarts until expiry)
+    c.execute('''CREATE TABLE IF NOT EXISTS active_throttles
+                 (mac TEXT PRIMARY KEY,
+                  slot INTEGER UNIQUE,
+                  rate REAL,
+                  ipv4 TEXT,
+                  started_at REAL,
+                  expires_at REAL)''')
+    
+    # Create blocklist tables (one versioned row per named list source)
+    c.execute('''CREATE TABLE IF NOT EXISTS blocklist_sources
+                 (name TEXT PRIMARY KEY,
+                  path TEXT,
+                  version INTEGER DEFAULT 0,
+                  checksum TEXT,
+                  entry_count INTEGER DEFAULT 0,
+                  imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS blocklist_entries
+                 (source TEXT,
+                  entry_type TEXT,
+                  value TEXT,
+                  PRIMARY KEY (source, entry_type, value)) WITHOUT ROWID''')
+    
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_blocklist_entries_value
+                 ON blocklist_entries (entry_type, value)''')
+    
+    # Heartbeats of background services (collector daemon or in-app)
+    c.execute('''CREATE TABLE IF NOT EXISTS service_status
+                 (name TEXT PRIMARY KEY,
+                  pid INTEGER,
+                  host TEXT,
+                  started_at REAL,
+                  heartbeat REAL,
+                  detail TEXT)''')
+    
+    # Evidence captures taken by the IPS
+    c.execute('''CREATE TABLE IF NOT EXISTS evidence_captures
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  mac TEXT,
+                  file TEXT,
+                  size_bytes INTEGER,
+                  packets INTEGER,
+                  severity REAL,
+                  reason TEXT,
+                  status TEXT,
+                  error TEXT,
+                  started_at REAL,
+                  finished_at REAL)''')
+    
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_evidence_captures_mac
+                 ON evidence_captures (mac, started_at)''')
+    
+    # Outbound notification queue; one pending row per (channel, recipient, dedup_key)
+    c.execute('''CREATE TABLE IF NOT EXISTS notification_outbox
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  channel TEXT,
+                  recipient TEXT,
+                  dedup_key TEXT,
+                  subject TEXT,
+                  body TEXT,
+                  occurrences INTEGER DEFAULT 1,
+                  attempts INTEGER DEFAULT 0,
+                  status TEXT DEFAULT 'pending',
+                  last_error TEXT,
+                  created_at REAL,
+                  next_attempt REAL,
+                  sent_at REAL)''')
+    
+    c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_notification_outbox_pending
+                 ON notification_outbox (channel, recipient, dedup_key)
+                 WHERE status = 'pending' ''')
+    
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+                 ON notification_outbox (status, next_attempt)''')
+    
+    # Per-device rate aggregates; raw samples are folded in up to a watermark
+    c.execute('''CREATE TABLE IF NOT EXISTS data_rate_rollups
+                 (mac TEXT,
+                  resolution INTEGER,
+                  bucket INTEGER,
+                  samples INTEGER,
+                  total REAL,
+                  min_rate REAL,
+                  max_rate REAL,
+                  PRIMARY KEY (mac, resolution, bucket)) WITHOUT ROWID''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS data_rate_rollup_state
+                 (id INTEGER PRIMARY KEY,
+                  last_id INTEGER)''')
+    
+    c.execute('''INSERT OR IGNORE INTO data_rate_rollup_state (id, last_id)
+                 VALUES (1, 0)''')
+    
     # Initialize config if not exists
     c.execute('''INSERT OR IGNORE INTO data_rate_config (id, retention_days) 
                  VALUES (1, 30)''')
@@ -75,27 +207,153 @@ def init_db():
     c.execute('''INSERT OR IGNORE INTO ips_config (id, enabled, throttle_minutes) 
                  VALUES (1, 1, 5)''')
     
+    # Discovery presence per device (presence.py states; unix times)
+    c.execute('''CREATE TABLE IF NOT EXISTS device_presence
+                 (mac TEXT PRIMARY KEY,
+                  state TEXT,
+                  first_seen REAL,
+                  last_seen REAL,
+                  changed_at REAL) WITHOUT ROWID''')
+    
+    # Monitored interfaces; discovery, accounting and captures run per row
+    c.execute('''CREATE TABLE IF NOT EXISTS interfaces
+                 (name TEXT PRIMARY KEY,
+                  subnet TEXT,
+                  label TEXT,
+                  enabled BOOLEAN DEFAULT 1,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    
+    # Interface a device was last discovered on
+    _add_column(c, 'devices', 'interface', 'TEXT')
+    
+    # Interface a throttle's shaping was applied on
+    _add_column(c, 'active_throttles', 'interface', 'TEXT')
+    
+    # Covers per-device history reads, so they never touch the table itself
+    c.execute('DROP INDEX IF EXISTS idx_device_data_rates_mac')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_device_data_rates_series
+                 ON device_data_rates (mac, timestamp, data_rate)''')
+    
+    # Aged rows moved to columnar segment files (archive.py), one per kind,
+    # device and UTC day, with per-segment stats so queries can skip files
+    c.execute('''CREATE TABLE IF NOT EXISTS archive_segments
+                 (kind TEXT,
+                  mac TEXT,
+                  day TEXT,
+                  path TEXT,
+                  rows INTEGER,
+                  t_min INTEGER,
+                  t_max INTEGER,
+                  min_value REAL,
+                  max_value REAL,
+                  total REAL,
+                  PRIMARY KEY (kind, mac, day)) WITHOUT ROWID''')
+    
+    # Rows changed since the collector last acknowledged a sync batch (sync.py);
+    # filled by triggers once enable_sync_changes() has run. A row changed
+    # again moves to a new seq instead of adding an entry.
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_changes
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  kind TEXT,
+                  mac TEXT,
+                  resolution INTEGER DEFAULT 0,
+                  ref INTEGER DEFAULT 0,
+                  UNIQUE (kind, mac, resolution, ref))''')
+    
+    # Devices from before presence tracking start out offline
+    c.execute('''INSERT OR IGNORE INTO device_presence
+                 SELECT mac, 'offline', CAST(strftime('%s', last_seen) AS REAL),
+                        CAST(strftime('%s', last_seen) AS REAL), CAST(strftime('%s', last_seen) AS REAL)
+                 FROM devices''')
+    
+    c.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    
     conn.commit()
     conn.close()
 
+# Profile upsert: a missing (None) field keeps its stored value, and a row
+# whose fields are all unchanged is not written at all. last_seen marks the
+# last profile change; presence has its own table.
+_DEVICE_UPSERT = '''INSERT INTO devices
+                     (mac, name, ipv4, vendor, model, os_version, description, interface, last_seen)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+                     ON CONFLICT (mac) DO UPDATE SET
+                         name = COALESCE(excluded.name, name),
+                         ipv4 = COALESCE(excluded.ipv4, ipv4),
+                         vendor = COALESCE(excluded.vendor, vendor),
+                         model = COALESCE(excluded.model, model),
+                         os_version = COALESCE(excluded.os_version, os_version),
+                         description = COALESCE(excluded.description, description),
+                         interface = COALESCE(excluded.interface, interface),
+                         last_seen = excluded.last_seen
+                     WHERE (excluded.name IS NOT NULL AND excluded.name IS NOT name)
+                        OR (excluded.ipv4 IS NOT NULL AND excluded.ipv4 IS NOT ipv4)
+                        OR (excluded.vendor IS NOT NULL AND excluded.vendor IS NOT vendor)
+                        OR (excluded.model IS NOT NULL AND excluded.model IS NOT model)
+                        OR (excluded.os_version IS NOT NULL AND excluded.os_version IS NOT os_version)
+                        OR (excluded.description IS NOT NULL AND excluded.description IS NOT description)
+                        OR (excluded.interface IS NOT NULL AND excluded.interface IS NOT interface)'''
+
+def _device_row(device: Dict) -> tuple:
+    return (device.get('mac'),
+            device.get('name'),
+            device.get('ipv4'),
+            device.get('vendor'),
+            device.get('model'),
+            device.get('version'),
+            device.get('description'),
+            device.get('interface'))
+
 def save_device_info(device: Dict):
-    """Save or update device information in database"""
-    conn = sqlite3.connect('iot_guardian.db')
+    """Save or update device information in database; unchanged rows are not rewritten"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute(_DEVICE_UPSERT, _device_row(device))
+    
+    conn.commit()
+    conn.close()
+
+def save_devices(devices: List[Dict], presence: List[Dict] = ()) -> int:
+    """Store one discovery scan: changed profiles and presence in one transaction.
+
+    Returns the number of device rows actually written.
+    """
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
-    c.execute('''INSERT OR REPLACE INTO devices 
-                 (mac, name, ipv4, vendor, model, os_version, description)
-                 VALUES (?, ?, ?, ?, ?, ?, ?)''',
-              (device.get('mac'),
-               device.get('name'),
-               device.get('ipv4'),
-               device.get('vendor'),
-               device.get('model'),
-               device.get('version'),
-               device.get('description')))
+    before = conn.total_changes
+    c.executemany(_DEVICE_UPSERT, [_device_row(device) for device in devices])
+    written = conn.total_changes - before
+    
+    c.executemany('''INSERT INTO device_presence (mac, state, first_seen, last_seen, changed_at)
+                     VALUES (:mac, :state, :first_seen, :last_seen, :changed_at)
+                     ON CONFLICT (mac) DO UPDATE SET
+                         state = excluded.state,
+                         last_seen = excluded.last_seen,
+                         changed_at = excluded.changed_at''', list(presence))
     
     conn.commit()
     conn.close()
+    return written
+
+def get_device_presence() -> List[Dict]:
+    """Presence state of every device discovery has seen"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT mac, state, first_seen, last_seen, changed_at
+                 FROM device_presence''')
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'mac': row[0],
+        'state': row[1],
+        'first_seen': row[2],
+        'last_seen': row[3],
+        'changed_at': row[4]
+    } for row in results]
 
 def record_data_rate(mac: str, data_rate: float):
     """Record a new data rate measurement for a device"""
@@ -103,7 +361,7 @@ def record_data_rate(mac: str, data_rate: float):
     if data_rate < 0.1:  # If rate is suspiciously low (likely in B/s)
         data_rate *= 1024  # Convert to KB/s
     
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('''INSERT INTO device_data_rates (mac, data_rate)
@@ -114,7 +372,7 @@ def record_data_rate(mac: str, data_rate: float):
 
 def get_data_rate_history(mac: str, days: int = 7) -> List[Dict]:
     """Get data rate history for a device"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('''SELECT timestamp, data_rate 
@@ -128,9 +386,47 @@ def get_data_rate_history(mac: str, days: int = 7) -> List[Dict]:
     
     return [{'timestamp': row[0], 'data_rate': row[1]} for row in results]
 
+def get_data_rate_rows(mac: str, since: float) -> List[tuple]:
+    """(id, unix time, KB/s) tuples for a device from `since`, oldest first"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT id, CAST(strftime('%s', timestamp) AS INTEGER), data_rate
+                 FROM device_data_rates
+                 WHERE mac = ? AND timestamp >= datetime(?, 'unixepoch')
+                 ORDER BY timestamp''', (mac, int(since)))
+    results = c.fetchall()
+    conn.close()
+    
+    return results
+
+def get_last_data_rate_id(mac: str) -> int:
+    """Id of the device's newest sample, 0 if it has none; changes with every new sample"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT MAX(id) FROM device_data_rates
+                 WHERE mac = ? AND timestamp = (SELECT MAX(timestamp) FROM device_data_rates WHERE mac = ?)''',
+              (mac, mac))
+    result = c.fetchone()[0]
+    conn.close()
+    
+    return result or 0
+
+def record_data_rates(rates: Dict[str, float]):
+    """Record one window of per-device rates (KB/s) in a single transaction"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.executemany('''INSERT INTO device_data_rates (mac, data_rate)
+                     VALUES (?, ?)''', list(rates.items()))
+    
+    conn.commit()
+    conn.close()
+
 def get_retention_days() -> int:
     """Get current retention period in days"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('SELECT retention_days FROM data_rate_config WHERE id = 1')
@@ -141,7 +437,7 @@ def get_retention_days() -> int:
 
 def set_retention_days(days: int):
     """Update retention period"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('UPDATE data_rate_config SET retention_days = ? WHERE id = 1', (days,))
@@ -150,7 +446,7 @@ def set_retention_days(days: int):
 
 def cleanup_old_records():
     """Delete records older than retention period"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     days = get_retention_days()
@@ -158,15 +454,20 @@ def cleanup_old_records():
                  WHERE timestamp < datetime('now', ?)''', 
               (f'-{days} days',))
     
+    now = int(time.time())
+    c.execute('''DELETE FROM data_rate_rollups
+                 WHERE (resolution < 3600 AND bucket < ?) OR bucket < ?''',
+              (now - days * 86400, now - ROLLUP_RETENTION_DAYS * 86400))
+    
     conn.commit()
     conn.close()
 
 def get_device_info(mac: str) -> Dict:
     """Retrieve device information from database"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
-    c.execute('''SELECT name, ipv4, vendor, model, os_version, description 
+    c.execute('''SELECT name, ipv4, vendor, model, os_version, description, interface
                  FROM devices WHERE mac = ?''', (mac,))
     result = c.fetchone()
     conn.close()
@@ -178,13 +479,14 @@ def get_device_info(mac: str) -> Dict:
             'vendor': result[2],
             'model': result[3],
             'version': result[4],
-            'description': result[5]
+            'description': result[5],
+            'interface': result[6]
         }
     return {}
 
 def get_all_devices() -> List[Dict]:
     """Get all devices from database"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('''SELECT mac, name, ipv4, vendor, model, os_version, description 
@@ -206,30 +508,117 @@ def get_all_devices() -> List[Dict]:
         })
     return devices
 
+def get_devices_changed_since(since: str = None) -> List[Dict]:
+    """Device rows written at or after `since` (a last_seen value), or all of them"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT mac, name, ipv4, vendor, model, os_version, description, last_seen, interface
+                 FROM devices WHERE last_seen >= ?''', (since or '',))
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'mac': row[0],
+        'name': row[1],
+        'ipv4': row[2],
+        'vendor': row[3],
+        'model': row[4],
+        'version': row[5],
+        'description': row[6],
+        'last_seen': row[7],
+        'interface': row[8]
+    } for row in results]
+
+def get_present_devices() -> List[Dict]:
+    """Get devices discovery does not consider offline, most recently seen first"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT d.mac, d.name, d.ipv4, d.vendor, d.model, d.os_version, d.description,
+                        p.state, p.first_seen, p.last_seen, d.interface
+                 FROM device_presence p JOIN devices d ON d.mac = p.mac
+                 WHERE p.state != 'offline'
+                 ORDER BY p.last_seen DESC''')
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'mac': row[0],
+        'name': row[1],
+        'ipv4': row[2],
+        'vendor': row[3],
+        'model': row[4],
+        'version': row[5],
+        'description': row[6],
+        'status': row[7],
+        'first_seen': row[8],
+        'last_seen': row[9],
+        'interface': row[10],
+        'source': 'database'
+    } for row in results]
+
+def get_interfaces(enabled_only: bool = True) -> List[Dict]:
+    """Configured monitoring interfaces, in the order they were added"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT name, subnet, label, enabled FROM interfaces
+                 WHERE enabled OR NOT ? ORDER BY created_at, name''', (enabled_only,))
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'name': row[0],
+        'subnet': row[1],
+        'label': row[2],
+        'enabled': bool(row[3])
+    } for row in results]
+
+def save_interface(name: str, subnet: str = None, label: str = None, enabled: bool = True):
+    """Add or update a monitoring interface; `subnet` (CIDR) limits DHCP leases to it"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''INSERT INTO interfaces (name, subnet, label, enabled) VALUES (?, ?, ?, ?)
+                 ON CONFLICT (name) DO UPDATE SET
+                     subnet = excluded.subnet,
+                     label = excluded.label,
+                     enabled = excluded.enabled''', (name, subnet, label, enabled))
+    
+    conn.commit()
+    conn.close()
+
+def delete_interface(name: str):
+    """Stop monitoring an interface"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('DELETE FROM interfaces WHERE name = ?', (name,))
+    conn.commit()
+    conn.close()
+
 def save_firewall_rules(rules: List[Dict]):
     """Save firewall rules to database"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
-    # Clear existing rules
+    # Replace all rules in a single transaction
     c.execute('DELETE FROM firewall_rules')
-    
-    # Insert new rules
-    for rule in rules:
-        c.execute('''INSERT INTO firewall_rules 
+    c.executemany('''INSERT INTO firewall_rules 
                      (rule_type, target, protocol, action)
                      VALUES (?, ?, ?, ?)''',
-                  (rule.get('type'),
-                   rule.get('target'),
-                   rule.get('protocol'),
-                   rule.get('action')))
+                  [(rule.get('type'),
+                    rule.get('target'),
+                    rule.get('protocol'),
+                    rule.get('action')) for rule in rules])
     
     conn.commit()
     conn.close()
 
 def load_firewall_rules() -> List[Dict]:
     """Load firewall rules from database"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('''SELECT rule_type, target, protocol, action 
@@ -247,18 +636,71 @@ def load_firewall_rules() -> List[Dict]:
         })
     return rules
 
+def get_blocklist_sources() -> List[Dict]:
+    """Get imported blocklist sources"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT name, path, version, entry_count, imported_at
+                 FROM blocklist_sources ORDER BY name''')
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'name': row[0],
+        'path': row[1],
+        'version': row[2],
+        'entry_count': row[3],
+        'imported_at': row[4]
+    } for row in results]
+
+def delete_blocklist_source(name: str):
+    """Remove a blocklist source and all of its entries"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('DELETE FROM blocklist_entries WHERE source = ?', (name,))
+    c.execute('DELETE FROM blocklist_sources WHERE name = ?', (name,))
+    
+    conn.commit()
+    conn.close()
+
+def get_blocklist_networks() -> List[str]:
+    """Get all blocked CIDRs across blocklist sources"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT DISTINCT value FROM blocklist_entries
+                 WHERE entry_type = 'cidr' ''')
+    results = [row[0] for row in c.fetchall()]
+    conn.close()
+    
+    return results
+
+def get_blocklist_domains() -> List[str]:
+    """Get all blocked domains across blocklist sources, sorted"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT DISTINCT value FROM blocklist_entries
+                 WHERE entry_type = 'domain' ORDER BY value''')
+    results = [row[0] for row in c.fetchall()]
+    conn.close()
+    
+    return results
+
 def get_database_tables() -> List[Dict]:
     """Get list of all tables in database"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     c.execute("SELECT name FROM sqlite_master WHERE type='table'")
     tables = [{'name': row[0]} for row in c.fetchall()]
     conn.close()
     return tables
 
-def get_table_data(table_name: str) -> List[Dict]:
-    """Get all data from a specific table"""
-    conn = sqlite3.connect('iot_guardian.db')
+def get_table_data(table_name: str, limit: int = None) -> List[Dict]:
+    """Get data from a specific table, optionally only the first `limit` rows"""
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     # Get column names
@@ -266,7 +708,10 @@ def get_table_data(table_name: str) -> List[Dict]:
     columns = [col[1] for col in c.fetchall()]
     
     # Get table data
-    c.execute(f"SELECT * FROM {table_name}")
+    if limit is None:
+        c.execute(f"SELECT * FROM {table_name}")
+    else:
+        c.execute(f"SELECT * FROM {table_name} LIMIT ?", (limit,))
     rows = c.fetchall()
     conn.close()
     
@@ -276,7 +721,7 @@ def get_table_data(table_name: str) -> List[Dict]:
 # IPS-related functions
 def get_device_thresholds(mac: str = None) -> List[Dict]:
     """Get device threshold configurations"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     if mac:
@@ -297,7 +742,7 @@ def get_device_thresholds(mac: str = None) -> List[Dict]:
 
 def set_device_thresholds(mac: str, max_rate: float, min_rate: float):
     """Set data rate thresholds for a device"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('''INSERT OR REPLACE INTO device_thresholds 
@@ -310,7 +755,7 @@ def set_device_thresholds(mac: str, max_rate: float, min_rate: float):
 
 def get_ips_config() -> Dict:
     """Get IPS configuration"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('''SELECT enabled, throttle_minutes, notification_email, notification_phone 
@@ -330,7 +775,7 @@ def get_ips_config() -> Dict:
 def update_ips_config(enabled: bool, throttle_minutes: int, 
                      email: str = None, phone: str = None):
     """Update IPS configuration"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('''UPDATE ips_config 
@@ -344,7 +789,7 @@ def update_ips_config(enabled: bool, throttle_minutes: int,
 
 def record_ips_event(mac: str, rate: float, action: str):
     """Record an IPS event"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('''INSERT INTO ips_events (mac, detected_rate, action_taken)
@@ -353,9 +798,307 @@ def record_ips_event(mac: str, rate: float, action: str):
     conn.commit()
     conn.close()
 
+def save_device_baselines(baselines: List[Dict]):
+    """Upsert learned baselines for many devices in one transaction"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.executemany('''INSERT INTO device_baselines
+                     (mac, samples, ewma, ewvar, profile, sketch, updated_at)
+                     VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                     ON CONFLICT(mac) DO UPDATE SET
+                         samples = excluded.samples,
+                         ewma = excluded.ewma,
+                         ewvar = excluded.ewvar,
+                         profile = excluded.profile,
+                         sketch = excluded.sketch,
+                         updated_at = excluded.updated_at''',
+                  [(b['mac'], b['samples'], b['ewma'], b['ewvar'], b['profile'], b['sketch'])
+                   for b in baselines])
+    
+    conn.commit()
+    conn.close()
+
+def get_device_baselines(macs: List[str] = None) -> List[Dict]:
+    """Get learned baselines, optionally only for the given devices"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    query = 'SELECT mac, samples, ewma, ewvar, profile, sketch FROM device_baselines'
+    if macs is None:
+        c.execute(query)
+        results = c.fetchall()
+    else:
+        # Chunk to stay under SQLite's bound-parameter limit
+        results = []
+        for i in range(0, len(macs), 500):
+            chunk = macs[i:i + 500]
+            c.execute(query + f" WHERE mac IN ({','.join('?' * len(chunk))})", chunk)
+            results.extend(c.fetchall())
+    conn.close()
+    
+    return [{
+        'mac': row[0],
+        'samples': row[1],
+        'ewma': row[2],
+        'ewvar': row[3],
+        'profile': row[4],
+        'sketch': row[5]
+    } for row in results]
+
+def save_active_throttle(mac: str, slot: int, rate: float, ipv4: str,
+                         started_at: float, expires_at: float, interface: str = None):
+    """Insert or update an active throttle (times are Unix timestamps)"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''INSERT INTO active_throttles
+                 (mac, slot, rate, ipv4, started_at, expires_at, interface)
+                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                 ON CONFLICT(mac) DO UPDATE SET
+                     slot = excluded.slot,
+                     rate = excluded.rate,
+                     ipv4 = excluded.ipv4,
+                     expires_at = excluded.expires_at,
+                     interface = excluded.interface''',
+              (mac, slot, rate, ipv4, started_at, expires_at, interface))
+    
+    conn.commit()
+    conn.close()
+
+def delete_active_throttle(mac: str):
+    """Remove an active throttle"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('DELETE FROM active_throttles WHERE mac = ?', (mac,))
+    
+    conn.commit()
+    conn.close()
+
+def get_active_throttles() -> List[Dict]:
+    """Get all active throttles"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT mac, slot, rate, ipv4, started_at, expires_at, interface
+                 FROM active_throttles ORDER BY expires_at''')
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'mac': row[0],
+        'slot': row[1],
+        'rate': row[2],
+        'ipv4': row[3],
+        'started_at': row[4],
+        'expires_at': row[5],
+        'interface': row[6]
+    } for row in results]
+
+def update_service_status(name: str, pid: int, host: str, started_at: float,
+                          heartbeat: float, detail: str = None):
+    """Record a service heartbeat"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''INSERT INTO service_status (name, pid, host, started_at, heartbeat, detail)
+                 VALUES (?, ?, ?, ?, ?, ?)
+                 ON CONFLICT(name) DO UPDATE SET
+                     pid = excluded.pid,
+                     host = excluded.host,
+                     started_at = excluded.started_at,
+                     heartbeat = excluded.heartbeat,
+                     detail = excluded.detail''',
+              (name, pid, host, started_at, heartbeat, detail))
+    
+    conn.commit()
+    conn.close()
+
+def clear_service_status(pid: int):
+    """Remove the heartbeats of a stopping process"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('DELETE FROM service_status WHERE pid = ?', (pid,))
+    
+    conn.commit()
+    conn.close()
+
+def get_service_status() -> List[Dict]:
+    """Get the last heartbeat of every service"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT name, pid, host, started_at, heartbeat, detail
+                 FROM service_status ORDER BY name''')
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'name': row[0],
+        'pid': row[1],
+        'host': row[2],
+        'started_at': row[3],
+        'heartbeat': row[4],
+        'detail': row[5]
+    } for row in results]
+
+def record_evidence_capture(capture: Dict) -> int:
+    """Store the metadata of a finished (or failed) evidence capture"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''INSERT INTO evidence_captures
+                 (mac, file, size_bytes, packets, severity, reason, status, error,
+                  started_at, finished_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+              (capture['mac'], capture.get('file'), capture.get('size_bytes'),
+               capture.get('packets'), capture.get('severity'), capture.get('reason'),
+               capture['status'], capture.get('error'),
+               capture.get('started_at'), capture.get('finished_at')))
+    capture_id = c.lastrowid
+    
+    conn.commit()
+    conn.close()
+    return capture_id
+
+def get_evidence_captures(limit: int = 50, mac: str = None) -> List[Dict]:
+    """Get recent evidence captures, optionally for one device"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    query = '''SELECT id, mac, file, size_bytes, packets, severity, reason, status,
+                      error, started_at, finished_at
+               FROM evidence_captures'''
+    if mac:
+        c.execute(query + ' WHERE mac = ? ORDER BY started_at DESC LIMIT ?', (mac, limit))
+    else:
+        c.execute(query + ' ORDER BY started_at DESC LIMIT ?', (limit,))
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'id': row[0],
+        'mac': row[1],
+        'file': row[2],
+        'size_bytes': row[3],
+        'packets': row[4],
+        'severity': row[5],
+        'reason': row[6],
+        'status': row[7],
+        'error': row[8],
+        'started_at': row[9],
+        'finished_at': row[10]
+    } for row in results]
+
+def enqueue_notification(channel: str, recipient: str, dedup_key: str,
+                         subject: str, body: str, now: float):
+    """Queue a notification; a pending one with the same dedup key is folded in"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''INSERT INTO notification_outbox
+                 (channel, recipient, dedup_key, subject, body, created_at, next_attempt)
+                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                 ON CONFLICT(channel, recipient, dedup_key) WHERE status = 'pending'
+                 DO UPDATE SET
+                     subject = excluded.subject,
+                     body = excluded.body,
+                     occurrences = occurrences + 1''',
+              (channel, recipient, dedup_key, subject, body, now, now))
+    
+    conn.commit()
+    conn.close()
+
+def get_due_notifications(now: float, limit: int = 500) -> List[Dict]:
+    """Get pending notifications whose next attempt is due, oldest first"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT id, channel, recipient, dedup_key, subject, body,
+                        occurrences, attempts, created_at
+                 FROM notification_outbox
+                 WHERE status = 'pending' AND next_attempt <= ?
+                 ORDER BY created_at LIMIT ?''', (now, limit))
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'id': row[0],
+        'channel': row[1],
+        'recipient': row[2],
+        'dedup_key': row[3],
+        'subject': row[4],
+        'body': row[5],
+        'occurrences': row[6],
+        'attempts': row[7],
+        'created_at': row[8]
+    } for row in results]
+
+def get_next_notification_time() -> float:
+    """Earliest next attempt among pending notifications, or None"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT MIN(next_attempt) FROM notification_outbox
+                 WHERE status = 'pending' ''')
+    result = c.fetchone()
+    conn.close()
+    
+    return result[0]
+
+def mark_notifications_sent(ids: List[int], now: float):
+    """Mark notifications as delivered"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.executemany('''UPDATE notification_outbox
+                     SET status = 'sent', attempts = attempts + 1, sent_at = ?
+                     WHERE id = ?''', [(now, i) for i in ids])
+    
+    conn.commit()
+    conn.close()
+
+def retry_notifications(ids: List[int], next_attempt: float, error: str):
+    """Record a failed attempt; next_attempt None gives up on the notifications"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    status = 'failed' if next_attempt is None else 'pending'
+    c.executemany('''UPDATE notification_outbox
+                     SET status = ?, attempts = attempts + 1,
+                         next_attempt = ?, last_error = ?
+                     WHERE id = ?''', [(status, next_attempt, error, i) for i in ids])
+    
+    conn.commit()
+    conn.close()
+
+def postpone_notifications(ids: List[int], next_attempt: float):
+    """Delay notifications without counting an attempt (rate limits, digests)"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.executemany('''UPDATE notification_outbox SET next_attempt = ?
+                     WHERE id = ?''', [(next_attempt, i) for i in ids])
+    
+    conn.commit()
+    conn.close()
+
+def cleanup_notifications(older_than: float):
+    """Drop delivered or abandoned notifications older than the given time"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''DELETE FROM notification_outbox
+                 WHERE status != 'pending' AND created_at < ?''', (older_than,))
+    
+    conn.commit()
+    conn.close()
+
 def get_ips_events(limit: int = 50) -> List[Dict]:
     """Get recent IPS events"""
-    conn = sqlite3.connect('iot_guardian.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     c.execute('''SELECT mac, timestamp, detected_rate, action_taken 
@@ -373,5 +1116,472 @@ def get_ips_events(limit: int = 50) -> List[Dict]:
         'action_taken': row[3]
     } for row in results]
 
-# Initialize database when module is imported
-init_db()
\ No newline at end of file
+
+def get_ips_events_page(before_id: int = None, limit: int = 100, mac: str = None) -> List[Dict]:
+    """IPS events newest first, continuing below `before_id`"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    query = 'SELECT id, mac, timestamp, detected_rate, action_taken FROM ips_events WHERE 1'
+    params: list = []
+    if before_id is not None:
+        query += ' AND id < ?'
+        params.append(before_id)
+    if mac:
+        query += ' AND mac = ?'
+        params.append(mac)
+    c.execute(query + ' ORDER BY id DESC LIMIT ?', params + [limit])
+    
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'id': row[0],
+        'mac': row[1],
+        'timestamp': row[2],
+        'detected_rate': row[3],
+        'action_taken': row[4]
+    } for row in results]
+
+def get_devices_page(after_mac: str = None, limit: int = 100) -> List[Dict]:
+    """Devices ordered by MAC, continuing after `after_mac`"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''SELECT d.mac, d.name, d.ipv4, d.vendor, d.model, d.os_version, d.description,
+                        p.state, p.first_seen, p.last_seen
+                 FROM devices d LEFT JOIN device_presence p ON p.mac = d.mac
+                 WHERE d.mac > ?
+                 ORDER BY d.mac LIMIT ?''', (after_mac or '', limit))
+    
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'mac': row[0],
+        'name': row[1],
+        'ipv4': row[2],
+        'vendor': row[3],
+        'model': row[4],
+        'version': row[5],
+        'description': row[6],
+        'status': row[7],
+        'first_seen': row[8],
+        'last_seen': row[9]
+    } for row in results]
+
+def rollup_data_rates(batch: int = 100000) -> int:
+    """Fold raw samples past the watermark into the rollups; returns samples folded"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('SELECT last_id FROM data_rate_rollup_state WHERE id = 1')
+    last_id = c.fetchone()[0]
+    c.execute('''SELECT COUNT(*), MAX(id) FROM
+                 (SELECT id FROM device_data_rates WHERE id > ? ORDER BY id LIMIT ?)''',
+              (last_id, batch))
+    count, upto = c.fetchone()
+    if not count:
+        conn.close()
+        return 0
+    
+    for resolution in ROLLUP_RESOLUTIONS:
+        c.execute('''INSERT INTO data_rate_rollups
+                     (mac, resolution, bucket, samples, total, min_rate, max_rate)
+                     SELECT mac, ?, CAST(strftime('%s', timestamp) AS INTEGER) / ? * ?,
+                            COUNT(*), SUM(data_rate), MIN(data_rate), MAX(data_rate)
+                     FROM device_data_rates WHERE id > ? AND id <= ?
+                     GROUP BY 1, 2, 3
+                     ON CONFLICT (mac, resolution, bucket) DO UPDATE SET
+                         samples = samples + excluded.samples,
+                         total = total + excluded.total,
+                         min_rate = MIN(min_rate, excluded.min_rate),
+                         max_rate = MAX(max_rate, excluded.max_rate)''',
+                  (resolution, resolution, resolution, last_id, upto))
+    c.execute('UPDATE data_rate_rollup_state SET last_id = ? WHERE id = 1', (upto,))
+    
+    conn.commit()
+    conn.close()
+    return count
+
+def get_rate_rollups(mac: str, since: float, resolution: int = 3600,
+                     after_bucket: int = None, limit: int = 1000) -> List[Dict]:
+    """Rolled-up rates for a device from `since` (unix time), oldest bucket first"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    start = int(since) // resolution * resolution
+    if after_bucket is not None:
+        start = max(start, after_bucket + 1)
+    c.execute('''SELECT bucket, samples, total, min_rate, max_rate
+                 FROM data_rate_rollups
+                 WHERE mac = ? AND resolution = ? AND bucket >= ?
+                 ORDER BY bucket LIMIT ?''', (mac, resolution, start, limit))
+    
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'bucket': row[0],
+        'samples': row[1],
+        'avg': row[2] / row[1],
+        'min': row[3],
+        'max': row[4]
+    } for row in results]
+
+# Tables archive.py moves aged rows out of: (table, value column, extra
+# column or None). Only rate samples already folded into the rollups move,
+# and only IPS events the sync log no longer waits to send.
+ARCHIVE_SOURCES = {
+    'data_rates': ('device_data_rates', 'data_rate', None),
+    'ips_events': ('ips_events', 'detected_rate', 'action_taken'),
+}
+
+def _first_id_at(c: sqlite3.Cursor, table: str, cutoff: int) -> int:
+    """Smallest id whose timestamp is at or after `cutoff` (unix time).
+
+    Rows are inserted with CURRENT_TIMESTAMP, so timestamps grow with the
+    id and a binary search over the rowid finds the boundary without a
+    timestamp index.
+    """
+    c.execute(f'SELECT MIN(id), MAX(id) FROM {table}')
+    low, high = c.fetchone()
+    if low is None:
+        return 0
+    high += 1
+    while low < high:
+        middle = (low + high) // 2
+        c.execute(f'''SELECT id, CAST(strftime('%s', timestamp) AS INTEGER) FROM {table}
+                      WHERE id >= ? ORDER BY id LIMIT 1''', (middle,))
+        row = c.fetchone()
+        if row is None or row[1] >= cutoff:
+            high = middle
+        else:
+            low = row[0] + 1
+    return low
+
+def get_archivable_rows(kind: str, before: float, limit: int = 200000) -> List[tuple]:
+    """The oldest rows of an ARCHIVE_SOURCES kind older than `before` (unix
+    time): (id, mac, unix time, value[, extra]) tuples in id order"""
+    table, value, extra = ARCHIVE_SOURCES[kind]
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    boundary = _first_id_at(c, table, int(before))
+    if kind == 'data_rates':
+        c.execute('SELECT last_id FROM data_rate_rollup_state WHERE id = 1')
+        boundary = min(boundary, c.fetchone()[0] + 1)
+    elif kind == 'ips_events':
+        c.execute("SELECT MIN(ref) FROM sync_changes WHERE kind = 'event'")
+        unsynced = c.fetchone()[0]
+        if unsynced is not None:
+            boundary = min(boundary, unsynced)
+    columns = f"id, mac, CAST(strftime('%s', timestamp) AS INTEGER), {value}" + (f", {extra}" if extra else "")
+    c.execute(f'''SELECT {columns} FROM {table}
+                  WHERE id < ? ORDER BY id LIMIT ?''', (boundary, limit))
+    results = c.fetchall()
+    conn.close()
+    
+    return results
+
+def commit_archive(kind: str, segments: List[Dict], first_id: int, last_id: int):
+    """Record written segments and delete the rows they now hold, in one transaction"""
+    table = ARCHIVE_SOURCES[kind][0]
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.executemany('''INSERT OR REPLACE INTO archive_segments
+                     (kind, mac, day, path, rows, t_min, t_max, min_value, max_value, total)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                  [(kind, s['mac'], s['day'], s['path'], s['rows'], s['t_min'], s['t_max'],
+                    s['min_value'], s['max_value'], s['total']) for s in segments])
+    c.execute(f'DELETE FROM {table} WHERE id BETWEEN ? AND ?', (first_id, last_id))
+    
+    conn.commit()
+    conn.close()
+
+def get_archive_segments(kind: str, mac: str = None, since: float = None,
+                         until: float = None) -> List[Dict]:
+    """Manifest entries of a kind overlapping [since, until], oldest day first"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    query = '''SELECT mac, day, path, rows, t_min, t_max, min_value, max_value, total
+               FROM archive_segments WHERE kind = ?'''
+    params: list = [kind]
+    if mac:
+        query += ' AND mac = ?'
+        params.append(mac)
+    if since is not None:
+        query += ' AND t_max >= ?'
+        params.append(since)
+    if until is not None:
+        query += ' AND t_min <= ?'
+        params.append(until)
+    c.execute(query + ' ORDER BY day, mac', params)
+    results = c.fetchall()
+    conn.close()
+    
+    return [{
+        'mac': row[0],
+        'day': row[1],
+        'path': row[2],
+        'rows': row[3],
+        't_min': row[4],
+        't_max': row[5],
+        'min_value': row[6],
+        'max_value': row[7],
+        'total': row[8]
+    } for row in results]
+
+def delete_archive_segments(kind: str, mac: str = None, before_day: str = None) -> List[str]:
+    """Drop manifest entries of a device and/or older than a day; returns their paths"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    where = 'kind = ?'
+    params: list = [kind]
+    if mac:
+        where += ' AND mac = ?'
+        params.append(mac)
+    if before_day:
+        where += ' AND day < ?'
+        params.append(before_day)
+    c.execute(f'SELECT path FROM archive_segments WHERE {where}', params)
+    paths = [row[0] for row in c.fetchall()]
+    c.execute(f'DELETE FROM archive_segments WHERE {where}', params)
+    
+    conn.commit()
+    conn.close()
+    return paths
+
+def replace_archive_segment(kind: str, mac: str, day: str, segment: Optional[Dict] = None):
+    """Point a device's day at a rewritten segment, or drop it when `segment` is None"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    if segment is None:
+        c.execute('DELETE FROM archive_segments WHERE kind = ? AND mac = ? AND day = ?', (kind, mac, day))
+    else:
+        c.execute('''INSERT OR REPLACE INTO archive_segments
+                     (kind, mac, day, path, rows, t_min, t_max, min_value, max_value, total)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (kind, mac, day, segment['path'], segment['rows'], segment['t_min'], segment['t_max'],
+                   segment['min_value'], segment['max_value'], segment['total']))
+    
+    conn.commit()
+    conn.close()
+
+# Columns of the rows in a sync batch, in order
+SYNC_COLUMNS = {
+    'devices': ('mac', 'name', 'ipv4', 'vendor', 'model', 'os_version', 'description',
+                'interface', 'last_seen', 'state', 'first_seen', 'seen_at'),
+    'rollups': ('mac', 'resolution', 'bucket', 'samples', 'total', 'min_rate', 'max_rate'),
+    'events': ('id', 'mac', 'timestamp', 'detected_rate', 'action_taken'),
+}
+
+# (name, table, event, change row) for the triggers feeding sync_changes
+_SYNC_TRIGGERS = [
+    ('sync_devices_insert', 'devices', 'INSERT', "'device', NEW.mac, 0, 0"),
+    ('sync_devices_update', 'devices', 'UPDATE', "'device', NEW.mac, 0, 0"),
+    ('sync_presence_insert', 'device_presence', 'INSERT', "'device', NEW.mac, 0, 0"),
+    ('sync_presence_update', 'device_presence', 'UPDATE', "'device', NEW.mac, 0, 0"),
+    ('sync_rollups_insert', 'data_rate_rollups', 'INSERT', "'rollup', NEW.mac, NEW.resolution, NEW.bucket"),
+    ('sync_rollups_update', 'data_rate_rollups', 'UPDATE', "'rollup', NEW.mac, NEW.resolution, NEW.bucket"),
+    ('sync_events_insert', 'ips_events', 'INSERT', "'event', NEW.mac, 0, NEW.id"),
+]
+
+_SYNC_BACKFILL = [
+    "SELECT 'device', mac, 0, 0 FROM devices",
+    "SELECT 'rollup', mac, resolution, bucket FROM data_rate_rollups",
+    "SELECT 'event', mac, 0, id FROM ips_events",
+]
+
+def enable_sync_changes() -> bool:
+    """Start logging changed rows for sync; True if the triggers were new.
+
+    The first time every existing row is logged too, so the first batches
+    carry a full copy.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    names = [name for name, _, _, _ in _SYNC_TRIGGERS]
+    c.execute(f'''SELECT COUNT(*) FROM sqlite_master
+                  WHERE type = 'trigger' AND name IN ({','.join('?' * len(names))})''', names)
+    created = c.fetchone()[0] < len(names)
+    for name, table, event, change in _SYNC_TRIGGERS:
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}
+                      BEGIN
+                          INSERT OR REPLACE INTO sync_changes (kind, mac, resolution, ref)
+                          VALUES ({change});
+                      END''')
+    if created:
+        for query in _SYNC_BACKFILL:
+            c.execute(f'''INSERT OR REPLACE INTO sync_changes (kind, mac, resolution, ref)
+                          {query}''')
+    
+    conn.commit()
+    conn.close()
+    return created
+
+def restart_sync_changes(after_seq: int):
+    """Log every row again with sequence numbers above `after_seq`.
+
+    For a collector whose copy does not match this node's log: one that lost
+    data, or one that acknowledged more than this (recreated) database sent.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'sync_changes'")
+    row = c.fetchone()
+    if row is None:
+        c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('sync_changes', ?)", (after_seq,))
+    elif row[0] < after_seq:
+        c.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'sync_changes'", (after_seq,))
+    c.execute('DELETE FROM sync_changes')
+    for query in _SYNC_BACKFILL:
+        c.execute(f'''INSERT INTO sync_changes (kind, mac, resolution, ref)
+                      {query}''')
+    
+    conn.commit()
+    conn.close()
+
+def get_sync_seq() -> int:
+    """The highest sequence number this node has assigned"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'sync_changes'")
+    row = c.fetchone()
+    conn.close()
+    
+    return row[0] if row else 0
+
+def disable_sync_changes():
+    """Stop logging changes and drop the pending ones"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    for name, _, _, _ in _SYNC_TRIGGERS:
+        c.execute(f'DROP TRIGGER IF EXISTS {name}')
+    c.execute('DELETE FROM sync_changes')
+    
+    conn.commit()
+    conn.close()
+
+def get_sync_batch(after_seq: int = 0, limit: int = 5000) -> Dict:
+    """The current values of up to `limit` rows changed after `after_seq`.
+
+    Returns {'after', 'upto', 'devices', 'rollups', 'events'} with rows as
+    lists in SYNC_COLUMNS order; upto is None when nothing changed.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('''CREATE TEMP TABLE batch AS
+                 SELECT seq, kind, mac, resolution, ref FROM sync_changes
+                 WHERE seq > ? ORDER BY seq LIMIT ?''', (after_seq, limit))
+    c.execute('SELECT MAX(seq) FROM batch')
+    upto = c.fetchone()[0]
+    
+    c.execute('''SELECT d.mac, d.name, d.ipv4, d.vendor, d.model, d.os_version, d.description,
+                        d.interface, d.last_seen, p.state, p.first_seen, p.last_seen
+                 FROM batch b JOIN devices d ON d.mac = b.mac
+                 LEFT JOIN device_presence p ON p.mac = b.mac
+                 WHERE b.kind = 'device' ORDER BY b.seq''')
+    devices = [list(row) for row in c.fetchall()]
+    c.execute('''SELECT r.mac, r.resolution, r.bucket, r.samples, r.total, r.min_rate, r.max_rate
+                 FROM batch b JOIN data_rate_rollups r
+                   ON r.mac = b.mac AND r.resolution = b.resolution AND r.bucket = b.ref
+                 WHERE b.kind = 'rollup' ORDER BY b.seq''')
+    rollups = [list(row) for row in c.fetchall()]
+    c.execute('''SELECT e.id, e.mac, e.timestamp, e.detected_rate, e.action_taken
+                 FROM batch b JOIN ips_events e ON e.id = b.ref
+                 WHERE b.kind = 'event' ORDER BY b.seq''')
+    events = [list(row) for row in c.fetchall()]
+    conn.close()
+    
+    return {'after': after_seq, 'upto': upto, 'devices': devices, 'rollups': rollups, 'events': events}
+
+def prune_sync_changes(upto_seq: int) -> int:
+    """Forget changes the collector has acknowledged; returns entries removed"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('DELETE FROM sync_changes WHERE seq <= ?', (upto_seq,))
+    removed = c.rowcount
+    
+    conn.commit()
+    conn.close()
+    return removed
+
+def get_sync_backlog() -> int:
+    """Changed rows not yet acknowledged by the collector"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute('SELECT COUNT(*) FROM sync_changes')
+    backlog = c.fetchone()[0]
+    conn.close()
+    
+    return backlog
+
+# Cheap change markers for HTTP ETags; each must change whenever the
+# listed rows could have
+TABLE_VERSION_QUERIES = {
+    'devices': '''SELECT COUNT(*), MAX(rowid), MAX(last_seen),
+                         (SELECT MAX(last_seen) FROM device_presence),
+                         (SELECT MAX(changed_at) FROM device_presence)
+                  FROM devices''',
+    'ips_events': 'SELECT MAX(id) FROM ips_events',
+    'firewall_rules': 'SELECT COUNT(*), MAX(id) FROM firewall_rules',
+    'data_rate_rollups': 'SELECT last_id FROM data_rate_rollup_state',
+}
+
+def get_table_version(table: str) -> str:
+    """A string that changes whenever the table's contents do"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute(TABLE_VERSION_QUERIES[table])
+    result = c.fetchone()
+    conn.close()
+    
+    return f"{table}:" + ":".join(str(value) for value in result)
+
+
+def _instrument(function):
+    """Time a database call into the latency histogram and the trace buffer"""
+    name = function.__name__
+    latency = QUERY_SECONDS.labels(name)
+    errors = QUERY_ERRORS.labels(name)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = tracing.now_us()
+        try:
+            return function(*args, **kwargs)
+        except sqlite3.Error:
+            errors.inc()
+            raise
+        finally:
+            end = tracing.now_us()
+            latency.observe((end - start) / 1e6)
+            tracing.add_span(name, "db", start, end)
+    return wrapper
+
+
+QUERY_SECONDS = REGISTRY.histogram("iot_guardian_db_call_seconds",
+                                   "SQLite call latency, connect to close", ["function"])
+QUERY_ERRORS = REGISTRY.counter("iot_guardian_db_errors_total",
+                                "SQLite calls that raised", ["function"])
+
+# Every public function opens, commits and closes its own connection, so
+# wrapping them all measures write latency without touching each body
+for _name, _function in list(globals().items()):
+    if (callable(_function) and not _name.startswith('_')
+            and getattr(_function, '__module__', None) == __name__):
+        globals()[_name] = _instrument(_function)
+del _name, _function
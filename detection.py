@@ -0,0 +1,222 @@
+# detection.py
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from baseline import BaselineModel, DEFAULT_ALPHA, hour_of_week
+
+# Why a device was flagged
+REASON_NONE = 0
+REASON_THRESHOLD = 1
+REASON_BASELINE = 2
+
+# A flagged device is disarmed until its rate falls this far below the cap
+# (and back inside its baseline), and never re-alerts within the cooldown
+HYSTERESIS = 0.2
+COOLDOWN_SECONDS = 300.0
+
+
+class DeviceRateTable:
+    """Per-device detection state held in NumPy arrays indexed by device slot.
+
+    Devices are added and removed incrementally; freed slots are reused so
+    the arrays only grow (by doubling) when every slot is taken. `tick()`
+    scores the rates received since the last tick against the learned
+    baselines and the static thresholds (hard caps) in one vectorized pass.
+    Hysteresis and a per-device cooldown keep a persistently noisy device
+    from being reported on every tick.
+    """
+
+    def __init__(self, capacity: int = 64, alpha: float = DEFAULT_ALPHA,
+                 hysteresis: float = HYSTERESIS, cooldown: float = COOLDOWN_SECONDS):
+        self.hysteresis = hysteresis
+        self.cooldown = cooldown
+        self.index: Dict[str, int] = {}
+        self.macs: List[str] = []
+        self._free: List[int] = []
+        self.baseline = BaselineModel(0, alpha)
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        old = len(self.macs)
+        self.macs.extend([None] * (capacity - old))
+        for name, dtype, fill in (("rates", np.float64, 0.0),
+                                  ("max_rate", np.float64, np.inf),
+                                  ("min_rate", np.float64, 0.0),
+                                  ("zscore", np.float64, 0.0),
+                                  ("reason", np.int8, REASON_NONE),
+                                  ("active", np.bool_, False),
+                                  ("armed", np.bool_, True),
+                                  ("last_alert", np.float64, -np.inf),
+                                  ("fresh", np.bool_, False)):
+            grown = np.full(capacity, fill, dtype=dtype)
+            if old:
+                grown[:old] = getattr(self, name)
+            setattr(self, name, grown)
+        self.baseline.resize(capacity)
+        self._free.extend(range(capacity - 1, old - 1, -1))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, mac: str):
+        return mac in self.index
+
+    @property
+    def ewma(self) -> np.ndarray:
+        return self.baseline.ewma
+
+    @property
+    def ewvar(self) -> np.ndarray:
+        return self.baseline.ewvar
+
+    @property
+    def samples(self) -> np.ndarray:
+        return self.baseline.samples
+
+    def add_device(self, mac: str, max_rate: float, min_rate: float) -> int:
+        """Add a device (or update its thresholds) and return its slot"""
+        slot = self.index.get(mac)
+        if slot is None:
+            if not self._free:
+                self._allocate(len(self.macs) * 2)
+            slot = self._free.pop()
+            self.index[mac] = slot
+            self.macs[slot] = mac
+            self.rates[slot] = 0.0
+            self.zscore[slot] = 0.0
+            self.reason[slot] = REASON_NONE
+            self.fresh[slot] = False
+            self.armed[slot] = True
+            self.last_alert[slot] = -np.inf
+            self.active[slot] = True
+            self.baseline.reset(slot)
+        self.max_rate[slot] = max_rate
+        self.min_rate[slot] = min_rate
+        return slot
+
+    def remove_device(self, mac: str):
+        slot = self.index.pop(mac, None)
+        if slot is None:
+            return
+        self.macs[slot] = None
+        self.active[slot] = False
+        self.fresh[slot] = False
+        self._free.append(slot)
+
+    def sync_thresholds(self, thresholds: Iterable[Dict]) -> List[str]:
+        """Apply a full threshold listing, adding devices incrementally.
+
+        A device missing from the listing keeps its slot and baseline but
+        loses its caps (infinite max, zero min). Returns the MACs that were
+        newly added.
+        """
+        seen = set()
+        added = []
+        for device in thresholds:
+            mac = device['mac']
+            seen.add(mac)
+            slot = self.index.get(mac)
+            if slot is None:
+                added.append(mac)
+            if (slot is None or self.max_rate[slot] != device['max_data_rate']
+                    or self.min_rate[slot] != device['min_data_rate']):
+                self.add_device(mac, device['max_data_rate'], device['min_data_rate'])
+        for mac in [mac for mac in self.index if mac not in seen]:
+            slot = self.index[mac]
+            self.max_rate[slot] = np.inf
+            self.min_rate[slot] = 0.0
+        return added
+
+    def set_rate(self, mac: str, rate: float) -> bool:
+        """Record the latest rate for a device.
+
+        A device without thresholds is tracked from its first rate, with an
+        infinite cap, so it still learns a baseline. Returns True when the
+        device was newly added.
+        """
+        slot = self.index.get(mac)
+        added = slot is None
+        if added:
+            slot = self.add_device(mac, np.inf, 0.0)
+        self.rates[slot] = rate
+        self.fresh[slot] = True
+        return added
+
+    def set_rates(self, slots: np.ndarray, rates: np.ndarray):
+        """Bulk-record rates for known slots"""
+        self.rates[slots] = rates
+        self.fresh[slots] = True
+
+    def _gate(self, slots: np.ndarray, anomalous: np.ndarray, quiet: np.ndarray,
+              now: float) -> np.ndarray:
+        """Apply hysteresis and cooldown; returns the slots to report"""
+        self.armed[slots[quiet]] = True
+        report = anomalous & self.armed[slots] & (now - self.last_alert[slots] >= self.cooldown)
+        reported = slots[report]
+        self.armed[reported] = False
+        self.last_alert[reported] = now
+        return reported
+
+    def tick(self, now: float = None) -> np.ndarray:
+        """Score fresh rates and return the slots that should be reported"""
+        slots = np.flatnonzero(self.fresh & self.active)
+        self.fresh[:] = False
+        if not slots.size:
+            return slots
+
+        now = time.time() if now is None else now
+        rates = self.rates[slots]
+        adaptive, z = self.baseline.evaluate(slots, rates, hour_of_week(now))
+        max_rate = self.max_rate[slots]
+        capped = rates > max_rate
+
+        self.zscore[slots] = z
+        self.reason[slots] = np.where(capped, REASON_THRESHOLD,
+                                      np.where(adaptive, REASON_BASELINE, REASON_NONE))
+        quiet = (rates < max_rate * (1.0 - self.hysteresis)) & ~adaptive
+        return self._gate(slots, capped | adaptive, quiet, now)
+
+    def check_cap(self, mac: str, rate: float, now: float = None) -> Optional[int]:
+        """Check an early (mid-window) estimate against the hard cap only.
+
+        Early estimates do not feed the baselines or `rates`; the closing
+        window's sample does, so an early estimate never replaces a final one
+        arriving in the same batch. Returns the slot if the device should be
+        reported.
+        """
+        slot = self.index.get(mac)
+        if slot is None or rate <= self.max_rate[slot]:
+            return None
+        now = time.time() if now is None else now
+        slots = np.array([slot])
+        self.reason[slot] = REASON_THRESHOLD
+        reported = self._gate(slots, np.array([True]), np.array([False]), now)
+        return slot if reported.size else None
+
+    def describe(self, slot: int) -> Dict:
+        """Snapshot of one slot, in the shape IPSMonitor handlers expect"""
+        return {
+            'mac': self.macs[slot],
+            'max_data_rate': float(self.max_rate[slot]),
+            'min_data_rate': float(self.min_rate[slot]),
+            'current_rate': float(self.rates[slot]),
+            'ewma': float(self.ewma[slot]),
+            'ewstd': float(np.sqrt(self.ewvar[slot])),
+            'zscore': float(self.zscore[slot]),
+            'reason': "threshold" if self.reason[slot] == REASON_THRESHOLD else "baseline",
+        }
+
+    def anomalies(self, now: float = None) -> List[Tuple[Dict, float]]:
+        """Run a tick and return (device, rate) pairs for every anomaly"""
+        return [(self.describe(slot), float(self.rates[slot])) for slot in self.tick(now)]
+
+    def baseline_states(self) -> List[Dict]:
+        """Learned state of every tracked device, for persistence"""
+        return [dict(self.baseline.state(slot), mac=mac) for mac, slot in self.index.items()]
+
+    def load_baselines(self, states: Iterable[Dict]):
+        """Restore learned state for tracked devices"""
+        for state in states:
+            slot = self.index.get(state['mac'])
+            if slot is not None:
+                self.baseline.load(slot, state)
@@ -0,0 +1,238 @@
+# device_index.py
+"""Search index over the device list for the Device Manager filter.
+
+Free-text terms match substrings of name, IPv4, MAC (with or without
+separators) and vendor, using trigram postings so a term only checks the
+devices that contain all of its trigrams. Structured terms narrow further:
+
+    vendor:apple        vendor contains "apple"
+    status:online       status starts with "online"
+    10.0.2.0/24         IPv4 inside the subnet (range lookup on a sorted list)
+
+All terms must match. sync() applies only what changed since the last call,
+and a query that extends the previous one is answered from the previous
+result instead of the whole index.
+"""
+import bisect
+import ipaddress
+import socket
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+NGRAM = 3
+
+# Fields searched by free-text terms
+TEXT_FIELDS = ("name", "ipv4", "mac", "vendor")
+
+
+def normalize(value) -> str:
+    return str(value or "").strip().lower()
+
+
+def ngrams(text: str, n: int) -> Set[str]:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def ipv4_int(value) -> Optional[int]:
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, str(value).strip()), "big")
+    except (OSError, ValueError):
+        return None
+
+
+def source_fields(device: Dict) -> tuple:
+    return tuple(device.get(f) for f in TEXT_FIELDS) + (device.get("status"),)
+
+
+def parse_query(query: str) -> Tuple[List[str], Dict[str, List[str]], List[ipaddress.IPv4Network]]:
+    """Split a query into free-text terms, field:value filters and subnets"""
+    terms, fields, networks = [], {}, []
+    for token in normalize(query).split():
+        field, sep, value = token.partition(":")
+        if sep and field in ("vendor", "status") and value:
+            fields.setdefault(field, []).append(value)
+        elif "/" in token:
+            try:
+                networks.append(ipaddress.IPv4Network(token, strict=False))
+            except ValueError:
+                terms.append(token)
+        else:
+            terms.append(token)
+    return terms, fields, networks
+
+
+class _Entry:
+    __slots__ = ("key", "position", "source", "text", "vendor", "status", "ip")
+
+    def __init__(self, key: str, position: int, device: Dict, source: tuple):
+        mac = normalize(device.get("mac"))
+        self.key = key
+        self.position = position
+        self.source = source
+        # Fields joined with a separator no term can contain
+        self.text = "\x00".join([normalize(device.get(f)) for f in TEXT_FIELDS]
+                                + [mac.replace(":", "").replace("-", "")])
+        self.vendor = normalize(device.get("vendor"))
+        self.status = normalize(device.get("status"))
+        self.ip = ipv4_int(device.get("ipv4"))
+
+
+class DeviceIndex:
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        # trigram -> keys; shorter terms match most devices anyway and are scanned
+        self._postings: Dict[str, Set[str]] = {}
+        self._ips: List[Tuple[int, str]] = []   # sorted (ip, key)
+        self._lock = threading.RLock()
+        self.version = 0
+        self._last: Optional[Tuple[int, str, List[str]]] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # Maintenance
+
+    def _grams(self, entry: _Entry) -> Set[str]:
+        return {g for g in ngrams(entry.text, NGRAM) if "\x00" not in g}
+
+    def _add(self, entry: _Entry):
+        self._entries[entry.key] = entry
+        postings = self._postings
+        for gram in self._grams(entry):
+            keys = postings.get(gram)
+            if keys is None:
+                postings[gram] = {entry.key}
+            else:
+                keys.add(entry.key)
+        if entry.ip is not None:
+            bisect.insort(self._ips, (entry.ip, entry.key))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        postings = self._postings
+        for gram in self._grams(entry):
+            keys = postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del postings[gram]
+        if entry.ip is not None:
+            i = bisect.bisect_left(self._ips, (entry.ip, key))
+            if i < len(self._ips) and self._ips[i] == (entry.ip, key):
+                del self._ips[i]
+
+    def sync(self, devices: Iterable[Dict]) -> int:
+        """Make the index match `devices` (in display order); returns entries re-indexed"""
+        changed = 0
+        with self._lock:
+            seen = set()
+            for position, device in enumerate(devices):
+                key = device.get("mac")
+                if not key:
+                    continue
+                seen.add(key)
+                source = source_fields(device)
+                old = self._entries.get(key)
+                if old is not None:
+                    if old.source == source:
+                        old.position = position
+                        continue
+                    self._remove(key)
+                self._add(_Entry(key, position, device, source))
+                changed += 1
+            for key in [k for k in self._entries if k not in seen]:
+                self._remove(key)
+                changed += 1
+            # Positions may have moved even when nothing was re-indexed
+            self.version += 1
+            self._last = None
+        return changed
+
+    # Queries
+
+    def _candidates(self, term: str) -> Optional[Set[str]]:
+        """Keys that may contain `term`, or None when it is too short to narrow"""
+        postings = self._postings
+        if len(term) < NGRAM:
+            return None
+        grams = sorted(ngrams(term, NGRAM), key=lambda g: len(postings.get(g, ())))
+        result = None
+        for gram in grams:
+            keys = postings.get(gram)
+            if not keys:
+                return set()
+            result = set(keys) if result is None else result & keys
+            if not result:
+                break
+        return result
+
+    def _matches(self, entry: _Entry, terms, fields, networks) -> bool:
+        for term in terms:
+            if term not in entry.text:
+                return False
+        for value in fields.get("vendor", ()):
+            if value not in entry.vendor:
+                return False
+        for value in fields.get("status", ()):
+            if not entry.status.startswith(value):
+                return False
+        for network in networks:
+            if entry.ip is None or not (int(network.network_address) <= entry.ip
+                                        <= int(network.broadcast_address)):
+                return False
+        return True
+
+    def _in_network(self, network: ipaddress.IPv4Network) -> Set[str]:
+        ips = self._ips
+        lo = bisect.bisect_left(ips, (int(network.network_address), ""))
+        hi = bisect.bisect_right(ips, (int(network.broadcast_address), "\uffff"))
+        return {key for _, key in ips[lo:hi]}
+
+    def _full(self, query: str) -> List[str]:
+        terms, fields, networks = parse_query(query)
+        sets = [keys for keys in map(self._candidates, terms) if keys is not None]
+        sets += [self._in_network(network) for network in networks]
+        if sets:
+            sets.sort(key=len)
+            candidates = set(sets[0])
+            for keys in sets[1:]:
+                candidates &= keys
+        else:
+            candidates = self._entries.keys()
+        entries = self._entries
+        keys = [k for k in candidates if self._matches(entries[k], terms, fields, networks)]
+        keys.sort(key=lambda k: entries[k].position)
+        return keys
+
+    @staticmethod
+    def _kind(token: str) -> str:
+        field, sep, value = token.partition(":")
+        if sep and field in ("vendor", "status") and value:
+            return field
+        return "network" if "/" in token else "text"
+
+    def _narrows(self, previous: str, query: str) -> bool:
+        """True if every match of `query` also matches `previous`"""
+        if not query.startswith(previous):
+            return False
+        before, after = previous.split(), query.split()
+        last, extended = before[-1], after[len(before) - 1]
+        kind = self._kind(last)
+        # Typing on past "10.1" into "10.1/8" widens; so does "vendor:" into a filter
+        return kind == self._kind(extended) and (kind != "network" or last == extended)
+
+    def search(self, query: str) -> List[str]:
+        """MACs matching `query`, in the order given to sync()"""
+        query = " ".join(normalize(query).split())
+        with self._lock:
+            entries = self._entries
+            last = self._last
+            if not query:
+                keys = sorted(entries, key=lambda k: entries[k].position)
+            elif last and last[1] and last[0] == self.version and self._narrows(last[1], query):
+                terms, fields, networks = parse_query(query)
+                keys = [k for k in last[2] if self._matches(entries[k], terms, fields, networks)]
+            else:
+                keys = self._full(query)
+            self._last = (self.version, query, keys)
+            return list(keys)
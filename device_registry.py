@@ -0,0 +1,156 @@
+# device_registry.py
+"""In-memory registry of known devices, merged from every discovery source.
+
+Records are keyed by MAC with secondary indexes on IPv4 and name. Each
+contested field remembers which source set it and in which scan:
+
+    name    database > dhcp > dns > arp
+    ipv4    dhcp > arp > database
+    vendor  database > oui
+
+Within a scan the higher-ranked source wins. A value from an earlier scan
+gives way to any source in a newer one, except a database value that
+outranks it (a name the user typed in the Device Manager). The registry is
+loaded from the database once and then only reads rows changed since the
+last sync.
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+FIELDS = ("ipv4", "name", "vendor", "model", "version", "description", "interface")
+
+FIELD_PRECEDENCE = {
+    "name": ("database", "dhcp", "dns", "arp"),
+    "ipv4": ("dhcp", "arp", "database"),
+    "vendor": ("database", "oui"),
+}
+
+# Sources that report what is on the network right now
+SCAN_SOURCES = {"dhcp", "arp", "dns", "oui"}
+
+
+class DeviceRecord:
+    __slots__ = ("mac",) + FIELDS + ("origins",)
+
+    def __init__(self, mac: str):
+        self.mac = mac
+        for field in FIELDS:
+            setattr(self, field, None)
+        self.origins: Dict[str, tuple] = {}   # field -> (source, scan)
+
+    def source(self, field: str) -> Optional[str]:
+        origin = self.origins.get(field)
+        return origin[0] if origin else None
+
+    def as_dict(self) -> Dict:
+        device = {"mac": self.mac}
+        for field in FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                device[field] = value
+        device["source"] = self.source("ipv4") or self.source("name") or "database"
+        return device
+
+
+class DeviceRegistry:
+    def __init__(self):
+        self.by_mac: Dict[str, DeviceRecord] = {}
+        self.by_ip: Dict[str, str] = {}
+        self.by_name: Dict[str, Set[str]] = {}
+        self.scan = 0
+        self.synced_at: Optional[str] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.by_mac)
+
+    def __contains__(self, mac: str) -> bool:
+        return mac in self.by_mac
+
+    def get(self, mac: str) -> Optional[DeviceRecord]:
+        return self.by_mac.get(mac)
+
+    def find_ip(self, ipv4: str) -> Optional[DeviceRecord]:
+        mac = self.by_ip.get(ipv4)
+        return self.by_mac.get(mac) if mac else None
+
+    def find_name(self, name: str) -> List[DeviceRecord]:
+        return [self.by_mac[mac] for mac in self.by_name.get((name or "").lower(), ())]
+
+    def begin_scan(self) -> int:
+        """Start a new scan; values from older scans become replaceable"""
+        with self._lock:
+            self.scan += 1
+            return self.scan
+
+    def _wins(self, record: DeviceRecord, field: str, source: str) -> bool:
+        if getattr(record, field) in (None, ""):
+            return True
+        ranks = FIELD_PRECEDENCE.get(field)
+        current = record.origins.get(field)
+        if ranks is None or current is None:
+            return True
+        current_source, current_scan = current
+        rank = ranks.index(source) if source in ranks else len(ranks)
+        current_rank = ranks.index(current_source) if current_source in ranks else len(ranks)
+        if rank <= current_rank:
+            return True
+        return current_source in SCAN_SOURCES and current_scan < self.scan
+
+    def _set(self, record: DeviceRecord, field: str, value, source: str):
+        old = getattr(record, field)
+        if field == "ipv4" and old != value:
+            if old and self.by_ip.get(old) == record.mac:
+                del self.by_ip[old]
+            if value:
+                self.by_ip[value] = record.mac
+        elif field == "name" and old != value:
+            if old:
+                macs = self.by_name.get(old.lower())
+                if macs:
+                    macs.discard(record.mac)
+                    if not macs:
+                        del self.by_name[old.lower()]
+            if value:
+                self.by_name.setdefault(value.lower(), set()).add(record.mac)
+        setattr(record, field, value)
+        record.origins[field] = (source, self.scan)
+
+    def observe(self, mac: str, source: str, **fields) -> bool:
+        """Merge what `source` reports about `mac`; True if any field changed"""
+        changed = False
+        with self._lock:
+            record = self.by_mac.get(mac)
+            if record is None:
+                record = self.by_mac[mac] = DeviceRecord(mac)
+                changed = True
+            for field, value in fields.items():
+                if value is None or not self._wins(record, field, source):
+                    continue
+                if getattr(record, field) != value:
+                    changed = True
+                self._set(record, field, value, source)
+        return changed
+
+    def load(self, rows: Iterable[Dict], synced_at: str = None):
+        """Merge database rows; a row that repeats what discovery wrote changes nothing"""
+        with self._lock:
+            for row in rows:
+                mac = row.get("mac")
+                if not mac:
+                    continue
+                record = self.by_mac.get(mac)
+                fields = {field: row.get(field) for field in FIELDS
+                          if row.get(field) is not None}
+                if record is not None:
+                    fields = {field: value for field, value in fields.items()
+                              if getattr(record, field) != value}
+                if fields:
+                    self.observe(mac, "database", **fields)
+            if synced_at is not None:
+                self.synced_at = synced_at
+
+    def records(self, macs: Iterable[str] = None) -> List[DeviceRecord]:
+        if macs is None:
+            return list(self.by_mac.values())
+        return [self.by_mac[mac] for mac in macs if mac in self.by_mac]
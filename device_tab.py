@@ -1,200 +1,366 @@
 # device_tab.py
-import time
+import threading
 import flet as ft
-from database import save_device_info, get_device_info
-from device_utils import get_connected_devices
-from typing import List, Dict
+from database import save_device_info, get_device_info, get_present_devices
+from device_index import DeviceIndex
+from events import PresenceChanged, subscribe
+from presence import NEW, ONLINE, IDLE, OFFLINE
+from typing import List, Dict, Optional
 
 def get_current_devices():
     """Return the current list of connected devices"""
     return connected_devices
 
-# Store reference to connected devices and UI list
-connected_devices: List[Dict] = []
-device_list_view = ft.Column()
+# Set by main when discovery runs in this process; a separate collector
+# daemon scans on its own schedule and the tab only reads its results
+discovery_service = None
 
-def update_connected_devices(page: ft.Page, devices: List[Dict]):
-    """Update the UI with the latest connected devices"""
-    global connected_devices
-    connected_devices = devices
-    
-    device_list_view.controls.clear()
-    
-    if not devices:
-        device_list_view.controls.append(
-            ft.Container(
-                content=ft.Column([
-                    ft.Icon(ft.icons.WIFI_OFF, size=50, color=ft.colors.GREY_500),
-                    ft.Text("No devices connected to hotspot", size=18),
-                    ft.FilledButton(
-                        "Try Again",
-                        icon=ft.icons.REFRESH,
-                        on_click=lambda e: refresh_devices(page)
-                    )
-                ], horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=20),
-                padding=40,
-                alignment=ft.alignment.center
+# Presence state -> (icon, color, label) on a device card
+STATUS_STYLES = {
+    NEW: (ft.icons.FIBER_NEW, ft.colors.BLUE, "New"),
+    ONLINE: (ft.icons.CHECK_CIRCLE, ft.colors.GREEN, "Online"),
+    IDLE: (ft.icons.WARNING, ft.colors.ORANGE, "Idle"),
+    OFFLINE: (ft.icons.WIFI_OFF, ft.colors.GREY, "Offline"),
+}
+
+# Cards handed to the list at first, and added each time it is scrolled near the end
+PAGE_SIZE = 30
+LIST_HEIGHT = 640
+
+# How long the save button shows "Saved!"
+SAVED_LABEL_SECONDS = 2
+
+# Keystrokes within this many seconds of each other trigger one search
+SEARCH_DEBOUNCE_SECONDS = 0.15
+
+# Fields shown on a card; a card is only touched when one of these changes
+CARD_FIELDS = ("status", "name", "ipv4", "mac", "vendor", "model", "version", "description")
+
+def card_fingerprint(device: Dict) -> tuple:
+    return tuple(device.get(field) for field in CARD_FIELDS)
+
+class DeviceCard:
+    """One device's card; patch() updates its controls in place"""
+
+    def __init__(self, device: Dict, page: ft.Page):
+        self.device = dict(device)
+        self.page = page
+        self.fingerprint = card_fingerprint(device)
+
+        # Network information section
+        self.status_icon = ft.Icon()
+        self.status_text = ft.Text()
+        self.name_text = ft.Text()
+        self.ipv4_text = ft.Text()
+        self.mac_text = ft.Text(selectable=True)
+        self.vendor_text = ft.Text()
+        self.title = ft.Text(size=20, weight="bold", color="blue900")
+
+        network_info = ft.Column([
+            ft.Row([
+                self.status_icon,
+                ft.Text("Network Information", size=16, weight="bold", color="blue900"),
+                ft.Container(content=self.status_text, margin=ft.margin.only(left=10))
+            ], spacing=5),
+            ft.Divider(height=10, thickness=1),
+            ft.Row([
+                ft.Column([
+                    ft.Text("Hostname:", weight="bold", width=100),
+                    ft.Text("IPv4:", weight="bold", width=100),
+                    ft.Text("MAC:", weight="bold", width=100),
+                    ft.Text("Vendor:", weight="bold", width=100)
+                ]),
+                ft.Column([
+                    self.name_text,
+                    self.ipv4_text,
+                    self.mac_text,
+                    self.vendor_text
+                ])
+            ], spacing=20),
+            ft.Divider(height=20, thickness=2),
+        ], spacing=10)
+
+        # Device details section
+        self.name = ft.TextField(
+            label="Device Name",
+            filled=True,
+            width=300,
+            hint_text="e.g. John's iPhone",
+            border_radius=10
+        )
+
+        self.model = ft.TextField(
+            label="Device Model",
+            filled=True,
+            width=300,
+            hint_text="e.g. iPhone 15 Pro",
+            border_radius=10
+        )
+
+        self.version = ft.TextField(
+            label="OS Version",
+            filled=True,
+            width=300,
+            hint_text="e.g. iOS 17.4.1",
+            border_radius=10
+        )
+
+        self.description = ft.TextField(
+            label="Description",
+            multiline=True,
+            min_lines=2,
+            max_lines=4,
+            filled=True,
+            width=800,
+            hint_text="Additional notes about this device",
+            border_radius=10
+        )
+
+        self.save_button = ft.FilledButton(
+            "Save Device Info",
+            icon=ft.icons.SAVE,
+            on_click=self.save_info,
+            style=ft.ButtonStyle(
+                shape=ft.RoundedRectangleBorder(radius=10),
+                padding=15,
             )
         )
-    else:
-        for device in devices:
-            device_list_view.controls.append(create_device_card(device, page))
-    
-    device_list_view.update()
-
-def create_device_card(device: Dict, page: ft.Page) -> ft.Container:
-    """Create a UI card for a device with enhanced network info"""
-    # Determine connection status icon and color
-    connection_status = device.get("status", "Connected")
-    if connection_status == "Connected":
-        status_icon = ft.Icon(name=ft.icons.CHECK_CIRCLE, color=ft.colors.GREEN)
-        status_text = ft.Text("Connected", color=ft.colors.GREEN)
-    else:
-        status_icon = ft.Icon(name=ft.icons.WARNING, color=ft.colors.ORANGE)
-        status_text = ft.Text("Limited Connection", color=ft.colors.ORANGE)
-    
-    # Network information section
-    network_info = ft.Column([
-        ft.Row([
-            status_icon,
-            ft.Text("Network Information", size=16, weight="bold", color="blue900"),
-            ft.Container(content=status_text, margin=ft.margin.only(left=10))
-        ], spacing=5),
-        ft.Divider(height=10, thickness=1),
-        ft.Row([
-            ft.Column([
-                ft.Text("Hostname:", weight="bold", width=100),
-                ft.Text("IPv4:", weight="bold", width=100),
-                ft.Text("MAC:", weight="bold", width=100),
-                ft.Text("Vendor:", weight="bold", width=100)
-            ]),
-            ft.Column([
-                ft.Text(device.get("name", "Unknown")),
-                ft.Text(device.get("ipv4", "N/A")),
-                ft.Text(device.get("mac", "N/A"), selectable=True),
-                ft.Text(device.get("vendor", "Unknown"))
-            ])
-        ], spacing=20),
-        ft.Divider(height=20, thickness=2),
-    ], spacing=10)
-    
-    # Device details section
-    name = ft.TextField(
-        label="Device Name",
-        value=device.get("name", ""),
-        filled=True,
-        width=300,
-        hint_text="e.g. John's iPhone",
-        border_radius=10
-    )
-    
-    model = ft.TextField(
-        label="Device Model",
-        value=device.get("model", ""),
-        filled=True,
-        width=300,
-        hint_text="e.g. iPhone 15 Pro",
-        border_radius=10
-    )
-    
-    version = ft.TextField(
-        label="OS Version",
-        value=device.get("version", ""),
-        filled=True,
-        width=300,
-        hint_text="e.g. iOS 17.4.1",
-        border_radius=10
-    )
-    
-    description = ft.TextField(
-        label="Description",
-        value=device.get("description", ""),
-        multiline=True,
-        min_lines=2,
-        max_lines=4,
-        filled=True,
-        width=800,
-        hint_text="Additional notes about this device",
-        border_radius=10
-    )
 
-    def save_info(e):
-        device["name"] = name.value
-        device["model"] = model.value
-        device["version"] = version.value
-        device["description"] = description.value
+        self._show(device, {})
+
+        self.container = ft.Container(
+            content=ft.Column([
+                self.title,
+                network_info,
+                ft.ResponsiveRow(
+                    [self.name, self.model, self.version],
+                    alignment="start",
+                    run_spacing=10
+                ),
+                self.description,
+                ft.Container(
+                    content=self.save_button,
+                    alignment=ft.alignment.center_right,
+                    margin=ft.margin.only(top=15)
+                )
+            ], spacing=20),
+            padding=25,
+            margin=10,
+            border_radius=20,
+            bgcolor=ft.colors.BLUE_50,
+            border=ft.border.all(1, ft.colors.BLUE_100),
+            shadow=ft.BoxShadow(
+                spread_radius=1,
+                blur_radius=15,
+                color=ft.colors.GREY_300,
+                offset=ft.Offset(0, 3)
+            ),
+            width=900
+        )
+
+    def _show(self, device: Dict, previous: Dict):
+        # Determine connection status icon and color
+        icon, color, label = STATUS_STYLES.get(device.get("status"), STATUS_STYLES[ONLINE])
+        self.status_icon.name = icon
+        self.status_icon.color = color
+        self.status_text.value = label
+        self.status_text.color = color
+
+        self.title.value = f"{device.get('vendor', 'Device')} Details"
+        self.name_text.value = device.get("name", "Unknown")
+        self.ipv4_text.value = device.get("ipv4", "N/A")
+        self.mac_text.value = device.get("mac", "N/A")
+        self.vendor_text.value = device.get("vendor", "Unknown")
+
+        # Leave a field alone once the user has started editing it
+        for field in ("name", "model", "version", "description"):
+            control = getattr(self, field)
+            if control.value in (None, previous.get(field, "")):
+                control.value = device.get(field, "")
 
-    # Save to database
+    def patch(self, device: Dict) -> bool:
+        """Bring the card up to date with `device`; False if nothing shown changed"""
+        fingerprint = card_fingerprint(device)
+        if fingerprint == self.fingerprint:
+            return False
+        self._show(device, self.device)
+        self.device = dict(device)
+        self.fingerprint = fingerprint
+        return True
+
+    def save_info(self, e):
+        device = self.device
+        device["name"] = self.name.value
+        device["model"] = self.model.value
+        device["version"] = self.version.value
+        device["description"] = self.description.value
+        self.fingerprint = card_fingerprint(device)
+
+        # Save to database
         save_device_info({
-        "mac": device.get("mac"),
-        "name": name.value,
-        "ipv4": device.get("ipv4"),
-        "vendor": device.get("vendor"),
-        "model": model.value,
-        "version": version.value,
-        "description": description.value
-    })
-
-        save_button.text = "✅ Saved!"
-        save_button.icon = ft.icons.CHECK
-        page.update()
-        
-        # Reset button after 2 seconds
-        time.sleep(2)
-        save_button.text = "Save Device Info"
-        save_button.icon = ft.icons.SAVE
-        page.update()
+            "mac": device.get("mac"),
+            "name": self.name.value,
+            "ipv4": device.get("ipv4"),
+            "vendor": device.get("vendor"),
+            "model": self.model.value,
+            "version": self.version.value,
+            "description": self.description.value
+        })
 
-    save_button = ft.FilledButton(
-        "Save Device Info",
-        icon=ft.icons.SAVE,
-        on_click=save_info,
-        style=ft.ButtonStyle(
-            shape=ft.RoundedRectangleBorder(radius=10),
-            padding=15,
+        self.save_button.text = "✅ Saved!"
+        self.save_button.icon = ft.icons.CHECK
+        self.save_button.update()
+
+        # Reset button after 2 seconds without holding the event handler
+        timer = threading.Timer(SAVED_LABEL_SECONDS, self.reset_save_button)
+        timer.daemon = True
+        timer.start()
+
+    def reset_save_button(self):
+        self.save_button.text = "Save Device Info"
+        self.save_button.icon = ft.icons.SAVE
+        self.save_button.update()
+
+class DeviceList:
+    """Device cards in a lazily built ListView, keyed by MAC.
+
+    show() reuses the card of every MAC it already has, patches only cards
+    whose fields changed, and lets Flet send just the inserted and removed
+    cards. Only the first `window` matches are handed to the list; scrolling
+    near the end extends the window by PAGE_SIZE.
+    """
+
+    def __init__(self):
+        self.view = ft.ListView(
+            height=LIST_HEIGHT,
+            spacing=10,
+            on_scroll=self.on_scroll,
+            on_scroll_interval=100
         )
-    )
+        self.cards: Dict[str, DeviceCard] = {}
+        self.devices: List[Dict] = []
+        self.shown: List[str] = []
+        self.window = PAGE_SIZE
+        self.empty_text = ""
+        self.page: Optional[ft.Page] = None
+        self._lock = threading.RLock()
 
-    return ft.Container(
-        content=ft.Column([
-            ft.Text(f"{device.get('vendor', 'Device')} Details", 
-                  size=20, weight="bold", color="blue900"),
-            network_info,
-            ft.ResponsiveRow(
-                [name, model, version], 
-                alignment="start",
-                run_spacing=10
-            ),
-            description,
-            ft.Container(
-                content=save_button,
-                alignment=ft.alignment.center_right,
-                margin=ft.margin.only(top=15)
-            )
-        ], spacing=20),
-        padding=25,
-        margin=10,
-        border_radius=20,
-        bgcolor=ft.colors.BLUE_50,
-        border=ft.border.all(1, ft.colors.BLUE_100),
-        shadow=ft.BoxShadow(
-            spread_radius=1,
-            blur_radius=15,
-            color=ft.colors.GREY_300,
-            offset=ft.Offset(0, 3)
-        ),
-        width=900
-    )
+    def show(self, page: ft.Page, devices: List[Dict], empty_text: str = "No devices connected to hotspot",
+             reset: bool = False):
+        """Display `devices` in order; `reset` starts a new result at the first page"""
+        with self._lock:
+            self.page = page
+            if reset:
+                self.window = PAGE_SIZE
+            self.devices = devices
+            self.empty_text = empty_text
+
+            if not devices:
+                if self.shown or not self.view.controls or self.view.controls[0].data != empty_text:
+                    self.shown = []
+                    self.view.controls = [self.empty_state(page, empty_text)]
+                    self.view.update()
+                return
+
+            visible = devices[:self.window]
+            shown = [d.get("mac") for d in visible]
+            changed = []
+            controls = []
+            for device in visible:
+                mac = device.get("mac")
+                card = self.cards.get(mac)
+                if card is None:
+                    card = self.cards[mac] = DeviceCard(device, page)
+                elif card.patch(device):
+                    changed.append(card.container)
+                controls.append(card.container)
+
+            if shown == self.shown:
+                if changed:
+                    page.update(*changed)
+            else:
+                self.shown = shown
+                self.view.controls = controls
+                self.view.update()
+
+    def forget(self, macs):
+        """Drop cached cards for devices that are gone"""
+        with self._lock:
+            for mac in set(self.cards) - set(macs):
+                del self.cards[mac]
+
+    def on_scroll(self, e: ft.OnScrollEvent):
+        if e.pixels < e.max_scroll_extent - LIST_HEIGHT or len(self.devices) <= self.window:
+            return
+        with self._lock:
+            self.window += PAGE_SIZE
+            self.show(self.page, self.devices, self.empty_text)
+
+    def empty_state(self, page: ft.Page, text: str) -> ft.Container:
+        return ft.Container(
+            content=ft.Column([
+                ft.Icon(ft.icons.WIFI_OFF, size=50, color=ft.colors.GREY_500),
+                ft.Text(text, size=18),
+                ft.FilledButton(
+                    "Try Again",
+                    icon=ft.icons.REFRESH,
+                    on_click=lambda e: refresh_devices(page)
+                )
+            ], horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=20),
+            padding=40,
+            alignment=ft.alignment.center,
+            data=text
+        )
+
+# Store reference to connected devices and UI list
+connected_devices: List[Dict] = []
+devices_by_mac: Dict[str, Dict] = {}
+device_index = DeviceIndex()
+device_list = DeviceList()
+device_list_view = device_list.view
+search_query = ""
+_search_timer: Optional[threading.Timer] = None
+_devices_lock = threading.RLock()
+
+def update_connected_devices(page: ft.Page, devices: List[Dict]):
+    """Update the UI with the latest connected devices"""
+    global connected_devices, devices_by_mac
+    with _devices_lock:
+        connected_devices = devices
+        devices_by_mac = {d.get("mac"): d for d in devices}
+        device_index.sync(devices)
+        device_list.forget(devices_by_mac)
+        apply_filter(page, search_query)
+
+def apply_presence_changes(page: ft.Page, changes: List[PresenceChanged]):
+    """Patch the device list with presence changes from discovery.
+
+    Arrivals are read from the database one by one and go to the top;
+    devices going offline are removed; the rest only change status.
+    """
+    with _devices_lock:
+        devices = dict(devices_by_mac)
+        arrivals = []
+        for change in changes:
+            if change.state == OFFLINE:
+                devices.pop(change.mac, None)
+            elif change.mac in devices:
+                devices[change.mac] = dict(devices[change.mac], status=change.state)
+            else:
+                devices[change.mac] = dict(get_device_info(change.mac), mac=change.mac, status=change.state)
+                arrivals.append(change.mac)
+        order = arrivals + [d["mac"] for d in connected_devices if d["mac"] not in arrivals]
+        update_connected_devices(page, [devices[mac] for mac in order if mac in devices])
 
 def get_device_tab(page: ft.Page) -> ft.Column:
     """Create the device management tab"""
     search_box = ft.TextField(
         label="🔍 Search Devices",
         width=400,
-        hint_text="Search by name, IP, or MAC",
+        hint_text="Name, IP or MAC; vendor:, status:, 10.0.0.0/24",
         border_radius=10,
         filled=True,
-        on_change=lambda e: apply_filter(page, search_box.value)
+        on_change=lambda e: schedule_filter(page, search_box.value)
     )
 
     refresh_btn = ft.FilledButton(
@@ -223,27 +389,41 @@ def get_device_tab(page: ft.Page) -> ft.Column:
     layout = ft.Column(
         controls=[header, device_list_view],
         expand=True,
-        scroll=ft.ScrollMode.AUTO,
         spacing=10
     )
 
+    # Discovery in this process publishes only presence changes; apply them
+    # to the list instead of re-reading every device
+    subscribe(PresenceChanged, callback=lambda batch: apply_presence_changes(page, batch),
+              name="device-tab-events")
+
     return layout
 
+def schedule_filter(page: ft.Page, query: str):
+    """Filter once typing pauses for SEARCH_DEBOUNCE_SECONDS"""
+    global _search_timer
+    if _search_timer is not None:
+        _search_timer.cancel()
+    _search_timer = threading.Timer(SEARCH_DEBOUNCE_SECONDS, apply_filter, args=(page, query))
+    _search_timer.daemon = True
+    _search_timer.start()
+
 def apply_filter(page: ft.Page, query: str):
-    """Filter devices based on search query"""
-    if not query:
-        update_connected_devices(page, connected_devices)
-        return
-        
-    query = query.lower()
-    filtered = [
-        d for d in connected_devices 
-        if (query in d.get("name", "").lower() or 
-            query in d.get("ipv4", "").lower() or 
-            query in d.get("mac", "").lower() or 
-            query in d.get("vendor", "").lower())
-    ]
-    update_connected_devices(page, filtered)
+    """Filter devices based on search query.
+
+    Runs on the debounce timer's thread too, so it holds _devices_lock to
+    see the device list and the search index from the same update.
+    """
+    global search_query
+    with _devices_lock:
+        reset = query != search_query
+        search_query = query or ""
+        if not query:
+            device_list.show(page, connected_devices, reset=reset)
+            return
+            
+        filtered = [devices_by_mac[mac] for mac in device_index.search(query)]
+        device_list.show(page, filtered, "No devices match your search", reset=reset)
 
 def refresh_devices(page: ft.Page):
     """Refresh the list of connected devices"""
@@ -259,7 +439,11 @@ def refresh_devices(page: ft.Page):
     page.update()
     
     try:
-        new_devices = get_connected_devices()
+        # A scan in this process runs in the background; its changes
+        # arrive through apply_presence_changes
+        if discovery_service is not None:
+            discovery_service.trigger()
+        new_devices = get_present_devices()
         update_connected_devices(page, new_devices)
         
         page.snack_bar = ft.SnackBar(
@@ -274,4 +458,4 @@ def refresh_devices(page: ft.Page):
             bgcolor=ft.colors.RED_400
         )
     finally:
-        page.update()
\ No newline at end of file
+        page.update()
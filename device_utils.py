@@ -1,13 +1,47 @@
+import ipaddress
 import subprocess
 import re
 import socket
 import platform
-from typing import List, Dict
-from database import get_device_info, get_all_devices
+from typing import List, Dict, Optional, Tuple
+from database import get_devices_changed_since
+from device_registry import DeviceRegistry
+from firewall_backend import default_interface
+from metrics import REGISTRY
+from tracing import span, traced
 
-def get_connected_devices() -> List[Dict]:
-    """Get devices connected to the hotspot (MacOS + ARP parsing)."""
-    devices = []
+DISCOVERY_SECONDS = REGISTRY.histogram("iot_guardian_discovery_seconds",
+                                       "Duration of a connected-device scan")
+DISCOVERED_DEVICES = REGISTRY.gauge("iot_guardian_discovered_devices",
+                                    "Devices found by the last scan")
+DISCOVERY_ERRORS = REGISTRY.counter("iot_guardian_discovery_errors_total",
+                                    "Failed discovery sources", ["source"])
+
+# Loaded from the database on the first scan, then kept in sync incrementally
+registry = DeviceRegistry()
+
+def sync_registry():
+    """Merge device rows changed since the last sync (all of them the first time)"""
+    rows = get_devices_changed_since(registry.synced_at)
+    if rows:
+        registry.load(rows, max(row['last_seen'] for row in rows))
+
+def scan_interface(interface: str = None, subnet: str = None) -> List[Tuple[str, str, Dict]]:
+    """What DHCP leases and the ARP table report on one interface.
+
+    Returns (source, mac, fields) observations without touching the
+    registry, so a worker process per interface can scan and the collector
+    merges. With a subnet, addresses outside it are skipped.
+    """
+    network = ipaddress.ip_network(subnet, strict=False) if subnet else None
+    extra = {"interface": interface} if interface else {}
+    observations = []
+
+    def wanted(ip: str) -> bool:
+        if network is None:
+            return True
+        address = ipaddress.ip_address(ip)
+        return address in network and address != network.broadcast_address
 
     # Method 1: Parse macOS DHCP leases
     try:
@@ -18,21 +52,20 @@ def get_connected_devices() -> List[Dict]:
                     ip = re.search(r"ip_address=([\d.]+)", entry)
                     mac = re.search(r"hw_address=\d+,?([0-9a-fA-F:]+)", entry)
                     hostname = re.search(r"hostname=([^\s]+)", entry)
-                    print("Parsed DHCP:", ip.group(1), mac.group(1))
-                    if ip and mac:
-                        devices.append({
-                            "ipv4": ip.group(1),
-                            "mac": format_mac(mac.group(1)),
-                            "name": hostname.group(1) if hostname else "DHCP Client",
-                            "source": "dhcp"
-                        })
+                    if ip and mac and wanted(ip.group(1)):
+                        observations.append(("dhcp", format_mac(mac.group(1)), dict(
+                            extra, ipv4=ip.group(1), name=hostname.group(1) if hostname else None)))
     except Exception as e:
+        DISCOVERY_ERRORS.labels("dhcp").inc()
         print(f"DHCP lease error: {e}")
 
     # Method 2: Parse ARP table
     try:
-        arp_command = "arp -a -i bridge100" if platform.system() == "Darwin" else "arp -a"
-        output = subprocess.check_output(arp_command, shell=True, text=True)
+        if interface is None and platform.system() == "Darwin":
+            interface = default_interface()
+        arp_command = ["arp", "-a"] + (["-i", interface] if interface else [])
+        with span("arp", cat="discovery", interface=interface):
+            output = subprocess.check_output(arp_command, text=True)
 
         for line in output.splitlines():
             match = re.search(r"\((\d+\.\d+\.\d+\.\d+)\)\s+at\s+([0-9a-fA-F:]{17})", line)
@@ -42,50 +75,61 @@ def get_connected_devices() -> List[Dict]:
 
                 if ip in ("169.254.255.255", "192.168.2.255", "224.0.0.251", "239.255.255.250"):
                     continue
+                if not wanted(ip):
+                    continue
 
-                # Only add if not already present
-                if not any(d.get("mac") == mac for d in devices):
-                    devices.append({
-                        "ipv4": ip,
-                        "mac": mac,
-                        "name": f"Device-{ip.split('.')[-1]}",
-                        "source": "arp"
-                    })
+                observations.append(("arp", mac, dict(extra, ipv4=ip, name=f"Device-{ip.split('.')[-1]}")))
     except Exception as e:
+        DISCOVERY_ERRORS.labels("arp").inc()
         print(f"ARP scan error: {e}")
 
+    return observations
+
+@traced("discovery")
+@DISCOVERY_SECONDS.time()
+def get_connected_devices(observations: List[Tuple[str, str, Dict]] = None,
+                          interface: str = None, subnet: str = None) -> List[Dict]:
+    """Get devices connected to the hotspot (MacOS + ARP parsing).
+
+    Scans `interface` here unless the observations of one or more
+    interfaces are passed in, then merges them through the registry.
+    """
+    if observations is None:
+        observations = scan_interface(interface, subnet)
+    sync_registry()
+    registry.begin_scan()
+    seen = {}
+    for source, mac, fields in observations:
+        registry.observe(mac, source, **fields)
+        seen[mac] = True
+
     # Method 3: Try hostname resolution
-    for device in devices:
-        if "ipv4" in device and (not device.get("name") or device["name"] in ["DHCP Client", ""]):
+    records = registry.records(seen)
+    for record in records:
+        if record.ipv4 and not record.name:
             try:
-                device["name"] = socket.gethostbyaddr(device["ipv4"])[0].split('.')[0]
-            except:
-                device["name"] = f"Device-{device['ipv4'].split('.')[-1]}"
+                with span("reverse_dns", cat="discovery", ip=record.ipv4):
+                    name = socket.gethostbyaddr(record.ipv4)[0].split('.')[0]
+                registry.observe(record.mac, "dns", name=name)
+            except Exception:
+                registry.observe(record.mac, "arp", name=f"Device-{record.ipv4.split('.')[-1]}")
 
     # Add vendor + status
     final_devices = []
-    seen_macs = set()
-    for device in devices:
-        if device["mac"] not in seen_macs:
-            device["vendor"] = get_vendor_from_mac(device["mac"])
-            device["status"] = "Connected"
-            seen_macs.add(device["mac"])
-            final_devices.append(device)
-
-    # Merge with database info
-    db_devices = {d['mac']: d for d in get_all_devices()}
-    for device in final_devices:
-        if device['mac'] in db_devices:
-            db_info = db_devices[device['mac']]
-            device.update({
-                'name': db_info.get('name', device.get('name')),
-                'model': db_info.get('model', ''),
-                'version': db_info.get('version', ''),
-                'description': db_info.get('description', '')
-            })
+    for record in records:
+        registry.observe(record.mac, "oui", vendor=get_vendor_from_mac(record.mac))
+        device = record.as_dict()
+        device["status"] = "Connected"
+        final_devices.append(device)
 
+    DISCOVERED_DEVICES.set(len(final_devices))
     return final_devices
 
+def device_interface(mac: str) -> Optional[str]:
+    """Interface the device was last discovered on, if known"""
+    record = registry.get(mac)
+    return record.interface if record else None
+
 def format_mac(mac: str) -> str:
     """Format MAC address as aa:bb:cc:dd:ee:ff"""
     mac = mac.lower().replace("-", ":").replace(".", ":").replace(",", ":")
@@ -0,0 +1,213 @@
+# events.py
+"""In-process publish/subscribe between subsystems.
+
+Events are small immutable tuples. Each subscription owns a bounded buffer
+with its own overflow policy, so a slow subscriber never blocks a publisher
+or another subscriber:
+
+    drop_oldest  full buffer discards its oldest event (default)
+    drop_newest  full buffer discards the incoming event
+    coalesce     events with the same key replace the pending one in place;
+                 the buffer bounds the number of distinct keys
+
+    sub = BUS.subscribe(RateSample, policy=COALESCE, key=lambda e: e.mac)
+    for event in sub.drain(timeout=1.0): ...
+
+    BUS.subscribe((IPSEvent, CaptureDone), callback=on_batch)  # own thread, gets lists
+
+The bus is per process. A UI talking to a separate collector daemon still
+reads SQLite.
+"""
+import collections
+import threading
+from typing import Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple, Type, Union
+
+
+class DeviceJoined(NamedTuple):
+    mac: str
+    ipv4: Optional[str] = None
+    name: Optional[str] = None
+    vendor: Optional[str] = None
+
+
+class DeviceLeft(NamedTuple):
+    mac: str
+
+
+class PresenceChanged(NamedTuple):
+    mac: str
+    state: str                      # presence.py: new, online, idle or offline
+    previous: Optional[str] = None  # None the first time a device is seen
+
+
+class RateSample(NamedTuple):
+    mac: str
+    rate: float          # KB/s
+    final: bool = True   # False for an early estimate from a window still open
+
+
+class IPSEvent(NamedTuple):
+    mac: str
+    rate: float
+    action: str
+    timestamp: str
+
+
+class RuleChanged(NamedTuple):
+    kind: str            # "firewall", "blocklist" or "thresholds"
+    count: int = 0
+
+
+class CaptureDone(NamedTuple):
+    mac: str
+    file: str
+    status: str
+    severity: float
+    started_at: float
+    packets: Optional[int] = None
+    size_bytes: Optional[int] = None
+    error: Optional[str] = None
+
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+COALESCE = "coalesce"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+DEFAULT_QUEUE_SIZE = 1024
+
+EventTypes = Union[Type, Iterable[Type]]
+
+
+class Subscription:
+    """A subscriber's bounded buffer; publishers call offer(), the owner drains"""
+
+    def __init__(self, bus: "EventBus", types: Tuple[Type, ...], maxsize: int = DEFAULT_QUEUE_SIZE,
+                 policy: str = DROP_OLDEST, key: Callable[[tuple], Hashable] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy}; expected one of {POLICIES}")
+        if policy == COALESCE and key is None:
+            raise ValueError("The coalesce policy needs a key function")
+        self.bus = bus
+        self.types = types
+        self.maxsize = maxsize
+        self.policy = policy
+        self.key = key
+        self.closed = False
+        self.dropped = 0
+        self.coalesced = 0
+        self._pending: Union[collections.deque, Dict[Hashable, tuple]] = (
+            {} if policy == COALESCE else collections.deque())
+        self._cond = threading.Condition(threading.Lock())
+        self._thread: Optional[threading.Thread] = None
+
+    def offer(self, event: tuple):
+        with self._cond:
+            if self.closed:
+                return
+            pending = self._pending
+            if self.policy == COALESCE:
+                key = self.key(event)
+                if key in pending:
+                    pending[key] = event   # keeps its place in line
+                    self.coalesced += 1
+                    return
+                if len(pending) >= self.maxsize:
+                    del pending[next(iter(pending))]
+                    self.dropped += 1
+                pending[key] = event
+            else:
+                if len(pending) >= self.maxsize:
+                    self.dropped += 1
+                    if self.policy == DROP_NEWEST:
+                        return
+                    pending.popleft()
+                pending.append(event)
+            self._cond.notify()
+
+    def drain(self, timeout: Optional[float] = None) -> List[tuple]:
+        """Everything pending, waiting up to `timeout` for at least one event.
+
+        Returns an empty list on timeout or once the subscription is closed.
+        """
+        with self._cond:
+            if not self._pending and not self.closed and timeout != 0:
+                self._cond.wait_for(lambda: self._pending or self.closed, timeout)
+            if self.policy == COALESCE:
+                events = list(self._pending.values())
+            else:
+                events = list(self._pending)
+            self._pending.clear()
+            return events
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def close(self):
+        """Unsubscribe and wake anyone waiting in drain()"""
+        self.bus.unsubscribe(self)
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _deliver(self, callback: Callable[[List[tuple]], None]):
+        while not self.closed:
+            events = self.drain()
+            if not events:
+                continue
+            try:
+                callback(events)
+            except Exception as e:
+                print(f"Event subscriber {self._thread.name} error: {e}")
+
+    def start(self, callback: Callable[[List[tuple]], None], name: str):
+        self._thread = threading.Thread(target=self._deliver, args=(callback,), name=name, daemon=True)
+        self._thread.start()
+
+
+class EventBus:
+    def __init__(self):
+        # Immutable tuples per type; publish reads them without a lock
+        self._subscribers: Dict[Type, Tuple[Subscription, ...]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, types: EventTypes, maxsize: int = DEFAULT_QUEUE_SIZE,
+                  policy: str = DROP_OLDEST, key: Callable[[tuple], Hashable] = None,
+                  callback: Callable[[List[tuple]], None] = None,
+                  name: str = None) -> Subscription:
+        """Subscribe to one event type or several.
+
+        With a callback, a daemon thread delivers each drained batch as a list;
+        otherwise the caller drains the subscription itself.
+        """
+        types = (types,) if isinstance(types, type) else tuple(types)
+        subscription = Subscription(self, types, maxsize, policy, key)
+        with self._lock:
+            for event_type in types:
+                self._subscribers[event_type] = self._subscribers.get(event_type, ()) + (subscription,)
+        if callback is not None:
+            subscription.start(callback, name or f"events-{getattr(callback, '__name__', 'callback')}")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for event_type in subscription.types:
+                remaining = tuple(s for s in self._subscribers.get(event_type, ()) if s is not subscription)
+                if remaining:
+                    self._subscribers[event_type] = remaining
+                else:
+                    self._subscribers.pop(event_type, None)
+
+    def publish(self, event: tuple):
+        for subscription in self._subscribers.get(type(event), ()):
+            subscription.offer(event)
+
+    def subscriber_count(self, event_type: Type) -> int:
+        return len(self._subscribers.get(event_type, ()))
+
+
+BUS = EventBus()
+publish = BUS.publish
+subscribe = BUS.subscribe
@@ -0,0 +1,377 @@
+# firewall_backend.py
+import ipaddress
+import os
+import platform
+import socket
+import subprocess
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Binaries can be swapped for recording fakes, e.g. IOT_GUARDIAN_NFT=tests/fake_bin.py
+NFT_BIN = os.environ.get("IOT_GUARDIAN_NFT", "nft")
+TC_BIN = os.environ.get("IOT_GUARDIAN_TC", "tc")
+IP_BIN = os.environ.get("IOT_GUARDIAN_IP", "ip")
+PFCTL_BIN = os.environ.get("IOT_GUARDIAN_PFCTL", "pfctl")
+DNCTL_BIN = os.environ.get("IOT_GUARDIAN_DNCTL", "dnctl")
+SUDO = os.environ.get("IOT_GUARDIAN_SUDO", "sudo").split()
+
+NFT_TABLE = "iot_guardian"
+NFT_RULES_FILE = "/tmp/iot_guardian.nft"
+PF_RULES_FILE = "/tmp/pf.rules"
+PF_BLOCKLIST_FILE = "/tmp/pf.blocklist"
+
+
+def default_interface() -> str:
+    """Return the hotspot/LAN interface for this platform"""
+    return "bridge100" if platform.system() == "Darwin" else "br0"
+
+
+def resolve_domain(domain: str) -> List[str]:
+    """Resolve domain to a deduplicated list of plain IP addresses"""
+    try:
+        ips = set()
+        for info in socket.getaddrinfo(domain, None, proto=socket.IPPROTO_TCP):
+            ips.add(info[4][0])
+        return sorted(ips)
+    except (socket.gaierror, IndexError):
+        return []
+
+
+def _run_command(cmd: List[str], input_text: str = None) -> subprocess.CompletedProcess:
+    """Run a command, raising CalledProcessError on failure"""
+    return subprocess.run(cmd, input=input_text, capture_output=True, text=True, check=True)
+
+
+class FirewallBackend:
+    """Base interface for platform firewall and traffic shaping backends.
+
+    `apply_rules` replaces the guardian's blocking rules with `rules` (dicts with
+    type/target/protocol/action as stored in `firewall_rules`) and returns a
+    summary with the blocked IPs and domains. `throttle`/`remove_throttle`
+    shape a single device identified by a numeric slot.
+    """
+    name = "base"
+    rules_file: Optional[str] = None
+
+    def __init__(self, interface: str = None,
+                 runner: Callable[..., subprocess.CompletedProcess] = None):
+        self.interface = interface or default_interface()
+        self.runner = runner or _run_command
+
+    def _run(self, cmd: List[str], input_text: str = None) -> subprocess.CompletedProcess:
+        return self.runner(SUDO + cmd, input_text)
+
+    def apply_rules(self, rules: List[Dict], blocklist: Iterable[str] = ()) -> Dict:
+        raise NotImplementedError
+
+    def reset_rules(self):
+        raise NotImplementedError
+
+    def throttle(self, slot: int, mac: str, rate_kbps: float, ipv4: str = None):
+        raise NotImplementedError
+
+    def remove_throttle(self, slot: int, mac: str, ipv4: str = None):
+        raise NotImplementedError
+
+    @staticmethod
+    def expand_rules(rules: Iterable[Dict], blocklist: Iterable[str] = ()) -> Dict:
+        """Resolve domains and normalise targets into networks and ports.
+
+        Returns a dict with `networks` (list of (proto, network, action)),
+        `ports` (list of (proto, port, action)), `blocked_ips`,
+        `blocked_domains` and `blocklist` (imported CIDRs, dropped for all
+        protocols). Unresolvable domains are skipped.
+        """
+        networks = []
+        ports = []
+        blocked_ips = []
+        blocked_domains = []
+
+        for rule in rules:
+            proto = (rule.get('protocol') or 'all').lower()
+            action = (rule.get('action') or 'DROP').lower()
+            target = rule['target']
+
+            if rule['type'] == "domain":
+                ips = resolve_domain(target)
+                if not ips:
+                    continue
+                blocked_domains.append(f"{target} ({', '.join(ips)})")
+                targets = ips
+            elif rule['type'] == "ip":
+                targets = [target]
+            elif rule['type'] == "port":
+                for port_proto in (("tcp", "udp") if proto == "all" else (proto,)):
+                    if port_proto in ("tcp", "udp"):
+                        ports.append((port_proto, int(target), action))
+                continue
+            else:
+                continue
+
+            for ip in targets:
+                network = ipaddress.ip_network(ip, strict=False)
+                networks.append((proto, network, action))
+                shown = str(network.network_address) if network.num_addresses == 1 else str(network)
+                if shown not in blocked_ips:
+                    blocked_ips.append(shown)
+
+        return {
+            'networks': networks,
+            'ports': ports,
+            'blocked_ips': blocked_ips,
+            'blocked_domains': blocked_domains,
+            'blocklist': [ipaddress.ip_network(cidr) for cidr in blocklist]
+        }
+
+
+class PfBackend(FirewallBackend):
+    """macOS pf + dummynet backend (the original IoT Guardian behaviour)"""
+    name = "pf"
+    rules_file = PF_RULES_FILE
+
+    def apply_rules(self, rules: List[Dict], blocklist: Iterable[str] = ()) -> Dict:
+        expanded = self.expand_rules(rules, blocklist)
+
+        # Minimal ruleset that only adds our blocking rules
+        pf_rules = [
+            "# Minimal PF ruleset that preserves system rules",
+            "",
+            "# Our custom blocking rules only",
+        ]
+        for proto, network, action in expanded['networks']:
+            block = "block return" if action == "reject" else "block drop"
+            proto = "" if proto == "all" else f" proto {proto}"
+            target = f"{{{network}}}" if network.version == 6 else str(network)
+            pf_rules.append(f"{block} in quick{proto} from any to {target}")
+            pf_rules.append(f"{block} in quick{proto} from {target} to any")
+        for proto, port, action in expanded['ports']:
+            block = "block return" if action == "reject" else "block drop"
+            pf_rules.append(f"{block} in quick proto {proto} from any to any port {port}")
+
+        # Imported blocklists go into a pf table, loaded from a file
+        if expanded['blocklist']:
+            with open(PF_BLOCKLIST_FILE, "w") as f:
+                f.write("\n".join(str(net) for net in expanded['blocklist']) + "\n")
+            # pf wants tables declared ahead of the rules that use them
+            pf_rules.insert(3, f'table <iot_guardian_blocklist> persist file "{PF_BLOCKLIST_FILE}"')
+            pf_rules.append("block drop in quick from <iot_guardian_blocklist> to any")
+            pf_rules.append("block drop in quick from any to <iot_guardian_blocklist>")
+
+        with open(self.rules_file, "w") as f:
+            f.write("\n".join(pf_rules) + "\n")
+
+        # Test rules before applying, then apply without flushing (-F none)
+        self._run([PFCTL_BIN, "-nf", self.rules_file])
+        self._run([PFCTL_BIN, "-F", "none", "-f", self.rules_file])
+        return expanded
+
+    def reset_rules(self):
+        self._run([PFCTL_BIN, "-F", "rules"])
+
+    def throttle(self, slot: int, mac: str, rate_kbps: float, ipv4: str = None):
+        self._run([DNCTL_BIN, "pipe", "config", str(slot), f"bw={rate_kbps}KByte/s"])
+        if ipv4:
+            # pf cannot match on MAC, so steer the device's IP into its pipe
+            anchor_rules = (
+                f"dummynet in quick on {self.interface} from {ipv4} to any pipe {slot}\n"
+                f"dummynet out quick on {self.interface} from any to {ipv4} pipe {slot}\n"
+            )
+            self._run([PFCTL_BIN, "-a", f"iot_guardian/throttle_{slot}", "-f", "-"], anchor_rules)
+
+    def remove_throttle(self, slot: int, mac: str, ipv4: str = None):
+        self._run([PFCTL_BIN, "-a", f"iot_guardian/throttle_{slot}", "-F", "rules"])
+        self._run([DNCTL_BIN, "-q", "pipe", "delete", str(slot)])
+
+
+class NftablesBackend(FirewallBackend):
+    """Linux nftables backend with tc/HTB per-device shaping.
+
+    Blocked addresses live in interval verdict maps (one per address family,
+    plus `inet_proto . addr` concatenations for protocol-specific rules) and
+    ports in an `inet_proto . inet_service` map, so matching cost does not
+    grow with the number of rules. The whole table is replaced atomically
+    with a single `nft -f` transaction.
+    """
+    name = "nftables"
+    rules_file = NFT_RULES_FILE
+
+    def __init__(self, interface: str = None, runner=None):
+        super().__init__(interface, runner)
+        # Ingress is shaped as egress of an IFB device (interface names max 15 chars)
+        self.ifb = f"ifb-{self.interface}"[:15]
+        self._shaping_ready = False
+
+    @staticmethod
+    def _verdict(action: str) -> str:
+        return "jump reject_traffic" if action == "reject" else "drop"
+
+    @staticmethod
+    def _collapse(entries: Dict[str, List]) -> Dict[str, List]:
+        """Collapse networks per verdict; drop wins where CIDRs overlap"""
+        drop = list(ipaddress.collapse_addresses(entries.get("drop", [])))
+        reject = []
+        for net in ipaddress.collapse_addresses(entries.get("reject", [])):
+            pieces = [net]
+            for blocked in drop:
+                next_pieces = []
+                for piece in pieces:
+                    if piece.subnet_of(blocked):
+                        continue
+                    if blocked.subnet_of(piece):
+                        next_pieces.extend(piece.address_exclude(blocked))
+                    else:
+                        next_pieces.append(piece)
+                pieces = next_pieces
+            reject.extend(pieces)
+        return {"drop": drop, "reject": list(ipaddress.collapse_addresses(reject))}
+
+    def _map(self, name: str, key_type: str, elements: List[str], interval: bool = True) -> List[str]:
+        lines = [f"    map {name} {{", f"        type {key_type} : verdict"]
+        if interval:
+            lines.append("        flags interval")
+        if elements:
+            lines.append("        elements = { " + ",\n                     ".join(elements) + " }")
+        lines.append("    }")
+        return lines
+
+    def build_ruleset(self, expanded: Dict) -> str:
+        """Render the nft script for an expanded rule set"""
+        # Group networks by (proto, family) then verdict
+        grouped: Dict[tuple, Dict[str, List]] = {}
+        for proto, network, action in expanded['networks']:
+            key = (proto, network.version)
+            grouped.setdefault(key, {}).setdefault(
+                "reject" if action == "reject" else "drop", []
+            ).append(network)
+        for network in expanded['blocklist']:
+            grouped.setdefault(("all", network.version), {}).setdefault("drop", []).append(network)
+
+        addr_elements = {4: [], 6: []}
+        proto_elements = {4: [], 6: []}
+        for (proto, version), by_action in sorted(grouped.items()):
+            for action, nets in self._collapse(by_action).items():
+                verdict = self._verdict(action)
+                for net in nets:
+                    if proto == "all":
+                        addr_elements[version].append(f"{net} : {verdict}")
+                    else:
+                        proto_elements[version].append(f"{proto} . {net} : {verdict}")
+
+        port_elements = []
+        seen_ports = set()
+        for proto, port, action in expanded['ports']:
+            if (proto, port) in seen_ports:
+                continue
+            seen_ports.add((proto, port))
+            port_elements.append(f"{proto} . {port} : {self._verdict(action)}")
+
+        lines = [
+            # Declaring then deleting makes the replacement atomic and idempotent
+            f"table inet {NFT_TABLE} {{}}",
+            f"delete table inet {NFT_TABLE}",
+            f"table inet {NFT_TABLE} {{",
+        ]
+        lines += self._map("addr_v4", "ipv4_addr", addr_elements[4])
+        lines += self._map("addr_v6", "ipv6_addr", addr_elements[6])
+        lines += self._map("proto_addr_v4", "inet_proto . ipv4_addr", proto_elements[4])
+        lines += self._map("proto_addr_v6", "inet_proto . ipv6_addr", proto_elements[6])
+        lines += self._map("proto_port", "inet_proto . inet_service", port_elements, interval=False)
+        lines += [
+            "    chain reject_traffic {",
+            "        reject",
+            "    }",
+            "    chain blocklist {",
+            "        ip saddr vmap @addr_v4",
+            "        ip daddr vmap @addr_v4",
+            "        ip6 saddr vmap @addr_v6",
+            "        ip6 daddr vmap @addr_v6",
+            "        meta l4proto . ip saddr vmap @proto_addr_v4",
+            "        meta l4proto . ip daddr vmap @proto_addr_v4",
+            "        meta l4proto . ip6 saddr vmap @proto_addr_v6",
+            "        meta l4proto . ip6 daddr vmap @proto_addr_v6",
+            "        meta l4proto { tcp, udp } meta l4proto . th dport vmap @proto_port",
+            "    }",
+            "    chain input {",
+            "        type filter hook input priority filter; policy accept;",
+            "        jump blocklist",
+            "    }",
+            "    chain forward {",
+            "        type filter hook forward priority filter; policy accept;",
+            "        jump blocklist",
+            "    }",
+            "}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def apply_rules(self, rules: List[Dict], blocklist: Iterable[str] = ()) -> Dict:
+        expanded = self.expand_rules(rules, blocklist)
+        with open(self.rules_file, "w") as f:
+            f.write(self.build_ruleset(expanded))
+
+        # Check then apply the whole table in one transaction
+        self._run([NFT_BIN, "-c", "-f", self.rules_file])
+        self._run([NFT_BIN, "-f", self.rules_file])
+        return expanded
+
+    def reset_rules(self):
+        with open(self.rules_file, "w") as f:
+            f.write(f"table inet {NFT_TABLE} {{}}\ndelete table inet {NFT_TABLE}\n")
+        self._run([NFT_BIN, "-f", self.rules_file])
+
+    def _ensure_shaping_root(self):
+        """Install the HTB roots and the ingress redirect; unclassified
+        traffic stays unshaped"""
+        if self._shaping_ready:
+            return
+        self._run([TC_BIN, "qdisc", "replace", "dev", self.interface,
+                   "root", "handle", "1:", "htb"])
+        try:
+            self._run([IP_BIN, "link", "add", "name", self.ifb, "type", "ifb"])
+        except subprocess.CalledProcessError:
+            pass  # Left over from an earlier run
+        self._run([IP_BIN, "link", "set", "dev", self.ifb, "up"])
+        self._run([TC_BIN, "qdisc", "replace", "dev", self.ifb,
+                   "root", "handle", "1:", "htb"])
+        self._run([TC_BIN, "qdisc", "replace", "dev", self.interface,
+                   "handle", "ffff:", "ingress"])
+        self._run([TC_BIN, "filter", "replace", "dev", self.interface, "parent", "ffff:",
+                   "protocol", "all", "prio", "1", "matchall",
+                   "action", "mirred", "egress", "redirect", "dev", self.ifb])
+        self._shaping_ready = True
+
+    def throttle(self, slot: int, mac: str, rate_kbps: float, ipv4: str = None):
+        self._ensure_shaping_root()
+        classid = f"1:{slot:x}"
+        # tc "kbps" is kilobytes per second, matching our KB/s thresholds
+        rate = f"{max(rate_kbps, 1):g}kbps"
+        # Traffic to the device leaves the interface; traffic from it leaves the IFB
+        for device, match in ((self.interface, "dst_mac"), (self.ifb, "src_mac")):
+            self._run([TC_BIN, "class", "replace", "dev", device, "parent", "1:",
+                       "classid", classid, "htb", "rate", rate, "ceil", rate])
+            self._run([TC_BIN, "filter", "replace", "dev", device, "parent", "1:",
+                       "protocol", "all", "prio", str(slot), "flower",
+                       match, mac, "classid", classid])
+
+    def remove_throttle(self, slot: int, mac: str, ipv4: str = None):
+        for device in (self.interface, self.ifb):
+            self._run([TC_BIN, "filter", "del", "dev", device, "parent", "1:",
+                       "protocol", "all", "prio", str(slot)])
+            self._run([TC_BIN, "class", "del", "dev", device, "classid", f"1:{slot:x}"])
+
+BACKENDS = {
+    PfBackend.name: PfBackend,
+    NftablesBackend.name: NftablesBackend,
+}
+
+
+def get_firewall_backend(interface: str = None, name: str = None) -> FirewallBackend:
+    """Return the firewall backend for this platform.
+
+    The choice can be forced with `name` or the IOT_GUARDIAN_FIREWALL
+    environment variable ("pf" or "nftables").
+    """
+    name = name or os.environ.get("IOT_GUARDIAN_FIREWALL")
+    if not name:
+        name = PfBackend.name if platform.system() == "Darwin" else NftablesBackend.name
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown firewall backend: {name}")
+    return BACKENDS[name](interface)
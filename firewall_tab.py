@@ -1,26 +1,17 @@
 import flet as ft
 import subprocess
-import socket
+import threading
 import re
-from typing import List, Dict
-from database import save_firewall_rules, load_firewall_rules
+from database import save_firewall_rules, load_firewall_rules, get_blocklist_sources, get_blocklist_networks
+from blocklist import import_blocklist, export_dnsmasq, remove_blocklist, DNSMASQ_FILE
+from firewall_backend import get_firewall_backend, resolve_domain
+from events import RuleChanged, publish
+from tracing import span, traced
 
 def get_firewall_tab(page: ft.Page) -> ft.Column:
-    """Firewall management tab that works without editing /etc/pf.conf"""
+    """Firewall management tab that works without editing /etc/pf.conf or nftables.conf"""
     firewall_rules = load_firewall_rules()
-
-    def resolve_domain(domain: str) -> List[str]:
-        """Resolve domain to IP addresses with proper IPv6 formatting"""
-        try:
-            ips = []
-            for info in socket.getaddrinfo(domain, None, proto=socket.IPPROTO_TCP):
-                ip = info[4][0]
-                if ':' in ip:  # IPv6
-                    ip = f"{{{ip}}}"  # Wrap IPv6 in curly braces
-                ips.append(ip)
-            return list(set(ips))
-        except (socket.gaierror, IndexError):
-            return []
+    backend = get_firewall_backend()
 
     def validate_ipv6(ip: str) -> bool:
         """Validate IPv6 address format"""
@@ -95,86 +86,40 @@ def get_firewall_tab(page: ft.Page) -> ft.Column:
 
     status_text = ft.Text("", color=ft.colors.GREEN)
 
-    def apply_firewall_rules():
-        """Apply rules without flushing system rules"""
-        try:
-            # Create minimal ruleset that only adds our blocking rules
-            pf_rules = [
-                "# Minimal PF ruleset that preserves system rules",
-                "",
-                "# Our custom blocking rules only",
-                "block in quick"  # This will be combined with our specific rules
-            ]
+    blocklist_name_field = ft.TextField(
+        label="List Name",
+        hint_text="e.g. stevenblack",
+        width=200
+    )
 
-            # Add our custom blocking rules
-            blocked_ips = set()
-            blocked_domains = []
-            
-            for rule in firewall_rules:
-                target = rule['target']
-                proto = rule['protocol']
-                action = rule['action'].lower()
-                
-                # Handle domain resolution
-                if rule['type'] == "domain":
-                    ips = resolve_domain(target)
-                    if not ips:
-                        continue
-                    blocked_domains.append(f"{target} ({', '.join(ips)})")
-                    for ip in ips:
-                        blocked_ips.add(ip)
-                        if ':' in ip:  # IPv6
-                            pf_rules.append(f"block in quick proto {proto} from any to {{{ip}}} {action}")
-                            pf_rules.append(f"block in quick proto {proto} from {{{ip}}} to any {action}")
-                        else:  # IPv4
-                            pf_rules.append(f"block in quick proto {proto} from any to {ip} {action}")
-                            pf_rules.append(f"block in quick proto {proto} from {ip} to any {action}")
-                
-                # Handle IP rules
-                elif rule['type'] == "ip":
-                    if ':' in target and not validate_ipv6(target):
-                        raise ValueError(f"Invalid IPv6 address format: {target}")
-                    blocked_ips.add(target)
-                    if ':' in target:  # IPv6
-                        pf_rules.append(f"block in quick proto {proto} from any to {{{target}}} {action}")
-                        pf_rules.append(f"block in quick proto {proto} from {{{target}}} to any {action}")
-                    else:  # IPv4
-                        pf_rules.append(f"block in quick proto {proto} from any to {target} {action}")
-                        pf_rules.append(f"block in quick proto {proto} from {target} to any {action}")
-                
-                # Handle port rules
-                elif rule['type'] == "port":
-                    proto = proto if proto != "all" else "{tcp,udp}"
-                    pf_rules.append(f"block in quick proto {proto} from any to any port {target} {action}")
+    blocklist_path_field = ft.TextField(
+        label="List File",
+        hint_text="e.g. /path/to/hosts.txt (hosts, domains, CIDRs; .gz ok)",
+        width=400
+    )
 
-            # Write rules to temp file
-            with open("/tmp/pf.rules", "w") as f:
-                f.write("\n".join(pf_rules))
+    blocklist_sources_list = ft.Column(spacing=0)
 
-            # Test rules before applying
-            test_result = subprocess.run(
-                ["sudo", "pfctl", "-nf", "/tmp/pf.rules"],
-                capture_output=True,
-                text=True
-            )
-            
-            if test_result.returncode != 0:
-                raise subprocess.CalledProcessError(
-                    test_result.returncode,
-                    test_result.args,
-                    test_result.stdout,
-                    test_result.stderr
-                )
+    @traced("firewall")
+    def apply_firewall_rules():
+        """Apply rules without flushing system rules"""
+        try:
+            with span("backend.apply_rules", cat="firewall", backend=backend.name):
+                summary = backend.apply_rules(firewall_rules, get_blocklist_networks())
 
-            # Apply rules without flushing (-F none)
-            subprocess.run(["sudo", "pfctl", "-F", "none", "-f", "/tmp/pf.rules"], check=True)
-            
             # Update status
             status_msg = [
                 "✅ Firewall rules applied successfully",
-                f"Blocked IPs: {', '.join(blocked_ips) or 'None'}",
-                f"Blocked domains: {', '.join(blocked_domains) or 'None'}"
+                f"Blocked IPs: {', '.join(summary['blocked_ips']) or 'None'}",
+                f"Blocked domains: {', '.join(summary['blocked_domains']) or 'None'}",
+                f"Blocklist networks: {len(summary['blocklist'])}"
             ]
+            try:
+                with span("blocklist.export_dnsmasq", cat="firewall"):
+                    domains = export_dnsmasq()
+                status_msg.append(f"Blocklist domains: {domains} (written to {DNSMASQ_FILE})")
+            except Exception as e:
+                status_msg.append(f"⚠️ Blocklist domains not exported: {str(e)}")
             status_text.value = "\n".join(status_msg)
             status_text.color = ft.colors.GREEN
             page.update()
@@ -187,7 +132,7 @@ def get_firewall_tab(page: ft.Page) -> ft.Column:
                 "Temporary rules file contents:"
             ]
             try:
-                with open("/tmp/pf.rules", "r") as f:
+                with open(backend.rules_file, "r") as f:
                     error_msg.extend(f.read().splitlines())
             except Exception:
                 error_msg.append("Could not read rules file")
@@ -200,6 +145,10 @@ def get_firewall_tab(page: ft.Page) -> ft.Column:
             status_text.color = ft.colors.RED
             page.update()
 
+    def save_rules():
+        save_firewall_rules(firewall_rules)
+        publish(RuleChanged("firewall", len(firewall_rules)))
+
     def update_rules_table():
         rules_table.rows.clear()
         for i, rule in enumerate(firewall_rules):
@@ -257,19 +206,74 @@ def get_firewall_tab(page: ft.Page) -> ft.Column:
             status_text.color = ft.colors.BLUE
         
         firewall_rules.append(new_rule)
-        save_firewall_rules(firewall_rules)
+        save_rules()
         update_rules_table()
         target_field.value = ""
         page.update()
 
     def delete_rule(index: int):
         firewall_rules.pop(index)
-        save_firewall_rules(firewall_rules)
+        save_rules()
         update_rules_table()
         status_text.value = "Rule deleted (click Apply to update firewall)"
         status_text.color = ft.colors.BLUE
         page.update()
 
+    def update_blocklist_sources():
+        sources = get_blocklist_sources()
+        blocklist_sources_list.controls = [
+            ft.Row([
+                ft.Text(f"{s['name']} v{s['version']}: {s['entry_count']} entries ({s['imported_at']})",
+                        color=ft.colors.GREY_600),
+                ft.IconButton(
+                    icon=ft.icons.DELETE,
+                    on_click=lambda e, name=s['name']: delete_blocklist(name),
+                    tooltip="Remove list"
+                ),
+            ])
+            for s in sources
+        ] or [ft.Text("No blocklists imported", color=ft.colors.GREY_600)]
+
+    def delete_blocklist(name: str):
+        remove_blocklist(name)
+        update_blocklist_sources()
+        status_text.value = f"Blocklist '{name}' removed (click Apply to update firewall and DNS)"
+        status_text.color = ft.colors.BLUE
+        page.update()
+
+    def import_blocklist_file(e):
+        name = blocklist_name_field.value.strip()
+        path = blocklist_path_field.value.strip()
+        if not name or not path:
+            status_text.value = "⚠️ Please enter a list name and file"
+            status_text.color = ft.colors.ORANGE
+            page.update()
+            return
+
+        def run_import():
+            try:
+                result = import_blocklist(name, path)
+                if result['unchanged']:
+                    status_text.value = f"Blocklist '{name}' unchanged (v{result['version']})"
+                else:
+                    status_text.value = (
+                        f"✅ Imported '{name}' v{result['version']}: "
+                        f"+{result['added']} / -{result['removed']} entries, "
+                        f"{result['total']} total from {result['lines']} lines "
+                        f"(click Apply to block its CIDRs and export its domains to dnsmasq)"
+                    )
+                status_text.color = ft.colors.GREEN
+                update_blocklist_sources()
+            except Exception as ex:
+                status_text.value = f"❌ Blocklist import failed: {str(ex)}"
+                status_text.color = ft.colors.RED
+            page.update()
+
+        status_text.value = f"Importing blocklist '{name}'..."
+        status_text.color = ft.colors.BLUE
+        page.update()
+        threading.Thread(target=run_import, daemon=True).start()
+
     def validate_target(rule_type: str, target: str) -> bool:
         if rule_type == "ip":
             if ':' in target:  # IPv6
@@ -286,6 +290,7 @@ def get_firewall_tab(page: ft.Page) -> ft.Column:
 
     # Initialize UI
     update_rules_table()
+    update_blocklist_sources()
 
     return ft.Column(
         controls=[
@@ -312,6 +317,25 @@ def get_firewall_tab(page: ft.Page) -> ft.Column:
                 ),
                 elevation=5
             ),
+            ft.Card(
+                content=ft.Container(
+                    content=ft.Column([
+                        ft.Text("Import Blocklist", weight="bold"),
+                        ft.Row([
+                            blocklist_name_field,
+                            blocklist_path_field,
+                            ft.ElevatedButton(
+                                "Import",
+                                icon=ft.icons.UPLOAD_FILE,
+                                on_click=import_blocklist_file
+                            ),
+                        ], spacing=10),
+                        blocklist_sources_list,
+                    ], spacing=10),
+                    padding=15
+                ),
+                elevation=5
+            ),
             ft.Divider(),
             ft.Text("Current Firewall Rules:", weight="bold"),
             ft.Container(
@@ -338,9 +362,9 @@ def get_firewall_tab(page: ft.Page) -> ft.Column:
                     icon=ft.icons.RESTART_ALT,
                     on_click=lambda e: [
                         firewall_rules.clear(),
-                        save_firewall_rules(firewall_rules),
+                        save_rules(),
                         update_rules_table(),
-                        subprocess.run(["sudo", "pfctl", "-F", "rules"], check=True),
+                        backend.reset_rules(),
                         setattr(status_text, "value", "All rules cleared - system rules remain"),
                         setattr(status_text, "color", ft.colors.GREEN),
                         page.update()
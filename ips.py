@@ -1,16 +1,58 @@
 # ips.py
 import threading
 import time
-import smtplib
-from email.mime.text import MIMEText
-import subprocess
-from database import get_device_thresholds, record_ips_event, get_ips_config
-from packet_capture_tab import PacketCapture
+from baseline import Z_THRESHOLD
+from capture import EvidenceCapturePool
+from accounting import TrafficAccountant, set_watch_levels
+from database import (get_device_thresholds, record_ips_event, get_ips_config,
+                      get_device_baselines, save_device_baselines)
+from detection import DeviceRateTable
+from device_utils import device_interface
+from events import BUS, COALESCE, IPSEvent, RateSample, RuleChanged, publish
+from firewall_backend import get_firewall_backend
+from metrics import REGISTRY
+from tracing import span
+from notify import NotificationDispatcher, WEBHOOK_URL
+from throttle import ThrottleManager
+
+# How often learned baselines are written back to SQLite
+BASELINE_PERSIST_SECONDS = 300
+
+# How stale the cached device thresholds may get before they are re-read
+THRESHOLD_REFRESH_SECONDS = 30
+
+# Distinct (mac, final) rate samples buffered while the monitor is busy; a
+# newer sample for the same device replaces the pending one
+RATE_QUEUE_SIZE = 16384
+
+TICK_SECONDS = REGISTRY.histogram("iot_guardian_ips_tick_seconds",
+                                  "Time to evaluate one batch of rate events")
+QUEUE_DEPTH = REGISTRY.gauge("iot_guardian_ips_queue_depth",
+                             "Rate events waiting for the IPS")
+TRACKED_DEVICES = REGISTRY.gauge("iot_guardian_ips_tracked_devices",
+                                 "Devices in the IPS rate table")
+ANOMALIES = REGISTRY.counter("iot_guardian_ips_anomalies_total",
+                             "Anomalies acted on", ["reason"])
 
 class IPSMonitor:
-    def __init__(self, page):
+    # With accountant=False, traffic accounting is left to another service and
+    # the monitor only evaluates the rates published to it. `backends` maps
+    # further monitored interfaces to their own backends for shaping
+    def __init__(self, page=None, backend=None, clock=time.time, accountant=True,
+                 backends=None):
         self.page = page
-        self.packet_capture = PacketCapture()
+        self.clock = clock
+        self.backend = backend or get_firewall_backend()
+        self.throttles = ThrottleManager(self.backend, wall_clock=clock, backends=backends,
+                                         interface_for=device_interface)
+        self.accountant = TrafficAccountant(self.backend.interface) if accountant else None
+        self.notifier = NotificationDispatcher()
+        self.captures = EvidenceCapturePool(self.backend.interface, interface_for=device_interface)
+        self.rate_table = DeviceRateTable()
+        self.rate_events = None
+        self.rule_changes = None
+        self.last_threshold_sync = 0.0
+        self.last_baseline_save = clock()
         self.running = False
         self.monitor_thread = None
 
@@ -19,155 +61,182 @@ class IPSMonitor:
             return
         
         self.running = True
+        self.subscribe()
+        QUEUE_DEPTH.set_function(lambda: len(self.rate_events))
+        TRACKED_DEVICES.set_function(lambda: len(self.rate_table))
+        self.throttles.start()
+        self.notifier.start()
+        self.captures.start()
         self.monitor_thread = threading.Thread(
             target=self._monitor_devices,
             daemon=True
         )
         self.monitor_thread.start()
+        if self.accountant:
+            try:
+                self.accountant.start()
+            except Exception as e:
+                print(f"Traffic accounting unavailable: {e}")
 
     def stop_monitoring(self):
         self.running = False
+        if self.accountant:
+            self.accountant.stop()
+        self.unsubscribe()  # wakes the monitor thread
         if self.monitor_thread:
             self.monitor_thread.join()
+        self.throttles.stop()
+        self.notifier.stop()
+        self.captures.stop()
+        self._persist_baselines()
+
+    def subscribe(self):
+        """Start buffering published rate samples and rule changes"""
+        self.rate_events = BUS.subscribe(RateSample, maxsize=RATE_QUEUE_SIZE, policy=COALESCE,
+                                         key=lambda e: (e.mac, e.final))
+        self.rule_changes = BUS.subscribe(RuleChanged, maxsize=16)
+
+    def unsubscribe(self):
+        for subscription in (self.rate_events, self.rule_changes):
+            if subscription is not None:
+                subscription.close()
 
     def _monitor_devices(self):
         while self.running:
+            # Block until a rate arrives; nothing runs while the network is idle
+            events = self.rate_events.drain()
+            if not self.running or not events:
+                continue
+
             try:
-                config = get_ips_config()
-                if not config or not config['enabled']:
-                    time.sleep(5)
-                    continue
-
-                # Check each device's data rate
-                devices = get_device_thresholds()
-                for device in devices:
-                    current_rate = self._get_current_data_rate(device['mac'])
-                    if current_rate > device['max_data_rate']:
-                        self._handle_anomaly(device, current_rate, config)
-
-                time.sleep(5)  # Check every 5 seconds
+                with TICK_SECONDS.time(), span("ips.process", cat="ips", events=len(events)):
+                    self._process(events)
             except Exception as e:
                 print(f"IPS monitoring error: {e}")
-                time.sleep(10)
 
-    def _get_current_data_rate(self, mac):
-        # Implement actual data rate measurement here
-        # This is a placeholder - you'd need to implement real measurement
-        return 0.0  # Replace with actual measurement
+    def _process(self, events):
+        """Evaluate a batch of rate events and act on any anomalies"""
+        config = get_ips_config()
+        if not config or not config['enabled']:
+            return
+
+        for device, current_rate in self._evaluate(events):
+            self._handle_anomaly(device, current_rate, config)
+
+    def _sync_thresholds(self):
+        added = self.rate_table.sync_thresholds(get_device_thresholds())
+        if added:
+            self.rate_table.load_baselines(get_device_baselines(added))
+        # Let the accountant publish as soon as a device passes its cap
+        table = self.rate_table
+        set_watch_levels({mac: float(table.max_rate[slot]) for mac, slot in table.index.items()
+                          if table.max_rate[slot] != float('inf')})
+        self.last_threshold_sync = self.clock()
+
+    def _evaluate(self, events):
+        """Feed a batch of rate events into the rate table and return anomalies"""
+        now = self.clock()
+        # Threshold edits in this process apply at once; the periodic re-read
+        # catches edits made by another process
+        changed = any(e.kind == "thresholds" for e in self.rule_changes.drain(timeout=0))
+        if changed or now - self.last_threshold_sync >= THRESHOLD_REFRESH_SECONDS:
+            self._sync_thresholds()
+
+        anomalies = []
+        for mac, rate, final in events:
+            if final:
+                if self.rate_table.set_rate(mac, rate):
+                    # First rate of a device without thresholds
+                    self.rate_table.load_baselines(get_device_baselines([mac]))
+                continue
+            # Early estimate from a window still open: hard cap only
+            slot = self.rate_table.check_cap(mac, rate, now)
+            if slot is not None:
+                anomalies.append((dict(self.rate_table.describe(slot), current_rate=rate), rate))
+        anomalies.extend(self.rate_table.anomalies(now))
+
+        if now - self.last_baseline_save >= BASELINE_PERSIST_SECONDS:
+            self._persist_baselines()
+        return anomalies
+
+    def _persist_baselines(self):
+        try:
+            save_device_baselines(self.rate_table.baseline_states())
+        except Exception as e:
+            print(f"Failed to save baselines: {e}")
+        self.last_baseline_save = self.clock()
 
     def _handle_anomaly(self, device, current_rate, config):
+        ANOMALIES.labels(device.get('reason', 'threshold')).inc()
+
         # Log the event
-        record_ips_event(
-            device['mac'],
-            current_rate,
-            f"Data rate exceeded threshold ({device['max_data_rate']} KB/s)"
-        )
+        if device.get('reason') == "baseline":
+            description = (f"Data rate far above learned baseline "
+                           f"(mean {device['ewma']:.2f} KB/s, z={device['zscore']:.1f})")
+        else:
+            description = f"Data rate exceeded threshold ({device['max_data_rate']} KB/s)"
+        self._record_event(device['mac'], current_rate, description)
 
-        # Capture traffic for 10 seconds
-        capture_thread = threading.Thread(
-            target=self._capture_abnormal_traffic,
-            args=(device['mac'],),
-            daemon=True
-        )
-        capture_thread.start()
+        # Queue an evidence capture, most severe anomalies first
+        self.captures.submit(device['mac'], self._severity(device, current_rate), device.get('reason'))
 
-        # Throttle the device
-        self._throttle_device(device['mac'], device['min_data_rate'], config['throttle_minutes'])
+        # Throttle the device; one with no thresholds configured has no
+        # throttle rate, so it is only reported
+        if device['max_data_rate'] != float('inf'):
+            self._throttle_device(device['mac'], device['min_data_rate'], config['throttle_minutes'])
 
         # Send notification
         self._send_notification(device, current_rate, config)
 
-    def _capture_abnormal_traffic(self, mac):
-        # Capture traffic for 10 seconds
-        filename = f"abnormal_{mac}_{int(time.time())}.pcap"
-        cmd = [
-            "tshark",
-            "-i", "bridge100",
-            "-a", "duration:10",
-            "-w", filename,
-            "ether", f"host {mac}"
-        ]
-        
-        try:
-            subprocess.run(cmd, check=True)
-            record_ips_event(
-                mac,
-                0,
-                f"Traffic capture saved to {filename}"
-            )
-        except Exception as e:
-            record_ips_event(
-                mac,
-                0,
-                f"Failed to capture traffic: {str(e)}"
-            )
+    def _severity(self, device, current_rate):
+        """How far past its limit a device is; 1.0 is just over"""
+        if device.get('reason') == "baseline":
+            return device['zscore'] / Z_THRESHOLD
+        return current_rate / max(device['max_data_rate'], 1e-6)
 
     def _throttle_device(self, mac, min_rate, throttle_minutes):
-        # Implement actual throttling here
-        # This is platform-specific - example for macOS:
         try:
-            # This is just an example - you'd need real traffic shaping commands
-            subprocess.run([
-                "sudo", "dnctl", "pipe", "config", "1", 
-                f"bw={min_rate}KB/s"
-            ], check=True)
-            
-            record_ips_event(
+            throttle = self.throttles.throttle(mac, min_rate, throttle_minutes)
+            self._record_event(
                 mac,
                 min_rate,
-                f"Throttled to {min_rate} KB/s for {throttle_minutes} minutes"
+                f"Throttled to {min_rate} KB/s for {throttle_minutes} minutes "
+                f"(slot {throttle['slot']})"
             )
-            
-            # Schedule removal of throttle
-            threading.Timer(
-                throttle_minutes * 60,
-                self._remove_throttle,
-                args=(mac,)
-            ).start()
         except Exception as e:
-            record_ips_event(
+            self._record_event(
                 mac,
                 min_rate,
                 f"Failed to throttle: {str(e)}"
             )
 
+    def _record_event(self, mac, rate, action):
+        record_ips_event(mac, rate, action)
+        publish(IPSEvent(mac, rate, action, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(self.clock()))))
+
     def _remove_throttle(self, mac):
-        try:
-            subprocess.run(["sudo", "dnctl", "-q", "flush"], check=True)
-            record_ips_event(
-                mac,
-                0,
-                "Throttle removed"
-            )
-        except Exception as e:
-            record_ips_event(
-                mac,
-                0,
-                f"Failed to remove throttle: {str(e)}"
-            )
+        self.throttles.release(mac)
 
     def _send_notification(self, device, current_rate, config):
+        if device['max_data_rate'] != float('inf'):
+            limits = (f"Threshold: {device['max_data_rate']} KB/s\n"
+                      f"Action taken: Throttled to {device['min_data_rate']} KB/s "
+                      f"for {config['throttle_minutes']} minutes.")
+        else:
+            limits = "No thresholds configured; the device was not throttled."
         message = (
             f"IoT Guardian Alert!\n\n"
             f"Device {device.get('name', 'Unknown')} ({device['mac']}) "
-            f"exceeded data rate threshold.\n"
+            f"{'deviated from its learned traffic baseline' if device.get('reason') == 'baseline' else 'exceeded data rate threshold'}.\n"
             f"Current rate: {current_rate:.2f} KB/s\n"
-            f"Threshold: {device['max_data_rate']} KB/s\n"
-            f"Action taken: Throttled to {device['min_data_rate']} KB/s "
-            f"for {config['throttle_minutes']} minutes."
+            f"{limits}"
         )
         
-        # Email notification
-        if config.get('notification_email'):
-            try:
-                msg = MIMEText(message)
-                msg['Subject'] = "IoT Guardian IPS Alert"
-                msg['From'] = "iot-guardian@yourdomain.com"
-                msg['To'] = config['notification_email']
-                
-                with smtplib.SMTP('localhost') as server:
-                    server.send_message(msg)
-            except Exception as e:
-                print(f"Failed to send email: {e}")
-
-        # TODO: Add phone/SMS notification here
\ No newline at end of file
+        # Queued for the dispatcher thread; repeats for the same device and
+        # reason are merged until delivered
+        subject = "IoT Guardian IPS Alert"
+        dedup_key = f"{device['mac']}:{device.get('reason', 'threshold')}"
+        self.notifier.notify("email", config.get('notification_email'), subject, message, dedup_key)
+        self.notifier.notify("sms", config.get('notification_phone'), subject, message, dedup_key)
+        if WEBHOOK_URL:
+            self.notifier.notify("webhook", WEBHOOK_URL, subject, message, dedup_key)
@@ -1,6 +1,12 @@
 # ips_tab.py
 import flet as ft
-from database import get_ips_config, update_ips_config, get_device_thresholds, set_device_thresholds, get_ips_events, get_all_devices
+import time
+from database import get_ips_config, update_ips_config, get_device_thresholds, set_device_thresholds, get_all_devices, get_evidence_captures
+from archive import get_ips_events
+from events import CaptureDone, IPSEvent, RuleChanged, publish, subscribe
+
+# Rows kept in the events and captures tables
+TABLE_ROWS = 50
 
 def get_ips_tab(page: ft.Page) -> ft.Column:
     """Create the IPS configuration tab with improved UI"""
@@ -65,7 +71,7 @@ def get_ips_tab(page: ft.Page) -> ft.Column:
     )
     
     max_rate_field = ft.TextField(
-        label="Max Data Rate (KB/s)",
+        label="Max Data Rate (KB/s, hard cap)",
         keyboard_type=ft.KeyboardType.NUMBER,
         width=200,
         border_radius=10,
@@ -102,6 +108,21 @@ def get_ips_tab(page: ft.Page) -> ft.Column:
         border_radius=5
     )
     
+    captures_table = ft.DataTable(
+        columns=[
+            ft.DataColumn(ft.Text("Device", weight="bold")),
+            ft.DataColumn(ft.Text("Started", weight="bold")),
+            ft.DataColumn(ft.Text("Severity", weight="bold")),
+            ft.DataColumn(ft.Text("Packets", weight="bold")),
+            ft.DataColumn(ft.Text("Size (KB)", weight="bold")),
+            ft.DataColumn(ft.Text("File / Error", weight="bold"))
+        ],
+        rows=[],
+        expand=True,
+        border=ft.border.all(1, ft.colors.GREY_300),
+        border_radius=5
+    )
+    
     status_text = ft.Text("", color=ft.colors.GREY_600)
     
     # Load devices
@@ -162,6 +183,7 @@ def get_ips_tab(page: ft.Page) -> ft.Column:
                 float(max_rate_field.value),
                 float(min_rate_field.value)
             )
+            publish(RuleChanged("thresholds", 1))
             status_text.value = "✅ Thresholds saved"
             status_text.color = ft.colors.GREEN
         except Exception as e:
@@ -169,27 +191,56 @@ def get_ips_tab(page: ft.Page) -> ft.Column:
             status_text.color = ft.colors.RED
         page.update()
     
+    def event_row(event) -> ft.DataRow:
+        return ft.DataRow(
+            cells=[
+                ft.DataCell(ft.Text(event['mac'])),
+                ft.DataCell(ft.Text(event['timestamp'])),
+                ft.DataCell(ft.Text(f"{event['detected_rate']:.2f}")),
+                ft.DataCell(ft.Text(event['action_taken']))
+            ]
+        )
+    
+    def capture_row(capture) -> ft.DataRow:
+        completed = capture['status'] == "completed"
+        return ft.DataRow(
+            cells=[
+                ft.DataCell(ft.Text(capture['mac'])),
+                ft.DataCell(ft.Text(time.strftime("%Y-%m-%d %H:%M:%S",
+                                                  time.localtime(capture['started_at'])))),
+                ft.DataCell(ft.Text(f"{capture['severity']:.1f}")),
+                ft.DataCell(ft.Text(str(capture['packets']) if completed else "-")),
+                ft.DataCell(ft.Text(f"{capture['size_bytes'] / 1024:.1f}" if completed else "-")),
+                ft.DataCell(ft.Text(capture['file'] if completed else capture['error'],
+                                    color=None if completed else ft.colors.RED))
+            ]
+        )
+    
     # Load events
     def load_events():
-        events = get_ips_events()
-        events_table.rows.clear()
-        
-        for event in events:
-            events_table.rows.append(
-                ft.DataRow(
-                    cells=[
-                        ft.DataCell(ft.Text(event['mac'])),
-                        ft.DataCell(ft.Text(event['timestamp'])),
-                        ft.DataCell(ft.Text(f"{event['detected_rate']:.2f}")),
-                        ft.DataCell(ft.Text(event['action_taken']))
-                    ]
-                )
-            )
+        events_table.rows = [event_row(event) for event in get_ips_events(TABLE_ROWS)]
+        captures_table.rows = [capture_row(capture) for capture in get_evidence_captures(TABLE_ROWS)]
+        page.update()
+    
+    # New IPS events and finished captures arrive from the event bus;
+    # prepend them instead of re-reading the tables
+    def on_ips_activity(batch):
+        for event in batch:
+            if isinstance(event, IPSEvent):
+                events_table.rows.insert(0, event_row({
+                    'mac': event.mac, 'timestamp': event.timestamp,
+                    'detected_rate': event.rate, 'action_taken': event.action}))
+            else:
+                captures_table.rows.insert(0, capture_row(event._asdict()))
+        del events_table.rows[TABLE_ROWS:]
+        del captures_table.rows[TABLE_ROWS:]
         page.update()
     
     # Initialize UI
     load_devices()
     load_events()
+    subscribe((IPSEvent, CaptureDone), maxsize=TABLE_ROWS * 2, callback=on_ips_activity,
+              name="ips-tab-events")
     device_dropdown.on_change = lambda e: update_threshold_fields(device_dropdown.value)
     
     return ft.Column(
@@ -292,6 +343,18 @@ def get_ips_tab(page: ft.Page) -> ft.Column:
                 border=ft.border.all(1, ft.colors.GREY_300),
                 margin=ft.margin.only(top=10)
             ),
+            
+            # Evidence Section
+            ft.Text("Evidence Captures", 
+                   size=18, 
+                   weight="bold",
+                   color=ft.colors.BLUE_800),
+            ft.Container(
+                content=captures_table,
+                padding=10,
+                border_radius=10,
+                border=ft.border.all(1, ft.colors.GREY_300)
+            ),
             status_text
         ],
         spacing=10,
@@ -1,12 +1,25 @@
+import importlib
+import threading
 import flet as ft
-from device_tab import get_device_tab, refresh_devices
-from packet_capture_tab import get_packet_capture_tab
-from firewall_tab import get_firewall_tab
-from database import get_database_tables, get_table_data
-from data_rate_tab import get_data_rate_tab
-import database  # This will initialize the database
-from ips_tab import get_ips_tab
-from ips import IPSMonitor
+import device_tab
+from device_tab import refresh_devices
+from database import init_db, get_database_tables, get_table_data
+from daemon import build_collector, running_collector
+from tracing import install_signal_handlers
+
+# Rows shown per table in the database viewer
+VIEWER_ROW_LIMIT = 1000
+
+# (label, module, builder); modules are imported when the tab is first opened,
+# a module of None means the builder lives in this file
+TABS = [
+    ("📋 Device Manager", "device_tab", "get_device_tab"),
+    ("📊 Usage History", "data_rate_tab", "get_data_rate_tab"),
+    ("🛰 Packet Capture", "packet_capture_tab", "get_packet_capture_tab"),
+    ("🛡️ Firewall", "firewall_tab", "get_firewall_tab"),
+    ("🚨 IPS", "ips_tab", "get_ips_tab"),
+    ("🗃️ Database Viewer", None, "get_database_viewer_tab"),
+]
 
 def get_database_viewer_tab(page: ft.Page) -> ft.Column:
     """Create the database viewer tab content"""
@@ -46,7 +59,7 @@ def get_database_viewer_tab(page: ft.Page) -> ft.Column:
     def load_table_data(e):
         if table_dropdown.value:
             try:
-                data = get_table_data(table_dropdown.value)
+                data = get_table_data(table_dropdown.value, VIEWER_ROW_LIMIT)
                 
                 # Create columns
                 if data and len(data) > 0:
@@ -68,6 +81,8 @@ def get_database_viewer_tab(page: ft.Page) -> ft.Column:
                     ]
                     
                     status_text.value = f"Showing {len(data)} rows from '{table_dropdown.value}'"
+                    if len(data) >= VIEWER_ROW_LIMIT:
+                        status_text.value += f" (first {VIEWER_ROW_LIMIT})"
                     status_text.color = ft.colors.GREEN
                 else:
                     data_table.columns = []
@@ -115,9 +130,6 @@ def get_database_viewer_tab(page: ft.Page) -> ft.Column:
     )
 
 def main(page: ft.Page):
-    # Cleanup old records on startup
-    database.cleanup_old_records()
-
     # App configuration
     page.title = "🔧 IoT Guardian"
     page.window_width = 1280
@@ -146,28 +158,53 @@ def main(page: ft.Page):
         ]
     )
 
-    # Create tabs
+    # Create tabs; only the first is built now, the rest on first selection
+    built = set()
+
+    def build_tab(index: int):
+        if index in built:
+            return
+        label, module_name, builder = TABS[index]
+        if module_name:
+            factory = getattr(importlib.import_module(module_name), builder)
+        else:
+            factory = globals()[builder]
+        tabs.tabs[index].content = factory(page)
+        built.add(index)
+
+    def on_tab_change(e):
+        build_tab(tabs.selected_index)
+        page.update()
+
     tabs = ft.Tabs(
         selected_index=0,
-        tabs=[
-            ft.Tab(text="📋 Device Manager", content=get_device_tab(page)),
-            ft.Tab(text="📊 Usage History", content=get_data_rate_tab(page)),
-            ft.Tab(text="🛰 Packet Capture", content=get_packet_capture_tab(page)),
-            ft.Tab(text="🛡️ Firewall", content=get_firewall_tab(page)),
-            ft.Tab(text="🚨 IPS", content=get_ips_tab(page)),
-            ft.Tab(text="🗃️ Database Viewer", content=get_database_viewer_tab(page)),
-        ],
+        tabs=[ft.Tab(text=label, content=ft.Container()) for label, _, _ in TABS],
+        on_change=on_tab_change,
         expand=True
     )
+    build_tab(0)
 
     # Add tabs to page
     page.add(tabs)
 
-    # Initialize and start IPS monitor
-    ips_monitor = IPSMonitor(page)
-    ips_monitor.start_monitoring()
+    # Start collection after the first frame is on screen
+    threading.Thread(target=start_collection, args=(page,), daemon=True).start()
+
+def start_collection(page: ft.Page):
+    """Use the collector daemon if one is alive, otherwise run the services in-app"""
+    other = running_collector()
+    if other:
+        print(f"Using collector daemon (pid {other['pid']} on {other['host']})")
+    else:
+        collector = build_collector()
+        collector.start()
+        device_tab.discovery_service = collector.get("discovery")
+        page.on_disconnect = lambda e: collector.stop()
 
-    # Initial device scan
+    # Initial device list
     refresh_devices(page)
 
-ft.app(target=main)
\ No newline at end of file
+if __name__ == "__main__":
+    init_db()
+    install_signal_handlers()
+    ft.app(target=main)
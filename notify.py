@@ -0,0 +1,317 @@
+# notify.py
+import json
+import os
+import random
+import smtplib
+import threading
+import time
+import urllib.request
+from collections import defaultdict, deque
+from email.mime.text import MIMEText
+from typing import Callable, Dict, List, Optional
+from database import (enqueue_notification, get_due_notifications, get_next_notification_time,
+                      mark_notifications_sent, retry_notifications, postpone_notifications,
+                      cleanup_notifications)
+
+SMTP_HOST = os.environ.get("IOT_GUARDIAN_SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("IOT_GUARDIAN_SMTP_PORT", "25"))
+SMTP_USER = os.environ.get("IOT_GUARDIAN_SMTP_USER")
+SMTP_PASSWORD = os.environ.get("IOT_GUARDIAN_SMTP_PASSWORD")
+SMTP_STARTTLS = os.environ.get("IOT_GUARDIAN_SMTP_STARTTLS", "") == "1"
+SMTP_FROM = os.environ.get("IOT_GUARDIAN_SMTP_FROM", "iot-guardian@yourdomain.com")
+WEBHOOK_URL = os.environ.get("IOT_GUARDIAN_WEBHOOK_URL")
+SMS_WEBHOOK_URL = os.environ.get("IOT_GUARDIAN_SMS_WEBHOOK_URL")
+
+# Alerts to one recipient within this window are coalesced into one digest
+DIGEST_SECONDS = 60.0
+
+# Per-channel cap on deliveries (each digest counts once)
+RATE_LIMIT_PER_HOUR = 30
+
+# Retry with exponential backoff and jitter, then give up
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = 900.0
+MAX_ATTEMPTS = 8
+
+# Idle SMTP connections are closed after this long
+SMTP_IDLE_SECONDS = 60.0
+
+# Delivered/failed rows are kept this long for inspection
+OUTBOX_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+class Channel:
+    """A delivery channel; `send` raises on failure so the message is retried"""
+
+    name = ""
+
+    def send(self, recipient: str, subject: str, body: str):
+        raise NotImplementedError
+
+    def configured(self, recipient: str) -> bool:
+        """Whether a message to `recipient` could be sent at all"""
+        return True
+
+    def close(self):
+        pass
+
+    def close_if_idle(self, now: float):
+        pass
+
+
+class EmailChannel(Channel):
+    """SMTP delivery over a single connection reused across messages"""
+
+    name = "email"
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, sender: str = SMTP_FROM,
+                 user: str = SMTP_USER, password: str = SMTP_PASSWORD,
+                 starttls: bool = SMTP_STARTTLS, clock: Callable[[], float] = time.monotonic):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.clock = clock
+        self.server: Optional[smtplib.SMTP] = None
+        self.last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.starttls:
+            server.starttls()
+        if self.user:
+            server.login(self.user, self.password or "")
+        return server
+
+    def send(self, recipient: str, subject: str, body: str):
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = recipient
+
+        if self.server is None:
+            self.server = self._connect()
+        try:
+            self.server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped our idle connection; reconnect once
+            self.server = self._connect()
+            self.server.send_message(msg)
+        except (smtplib.SMTPException, OSError):
+            self.close()
+            raise
+        self.last_used = self.clock()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+    def close_if_idle(self, now: float = None):
+        if self.server is not None and self.clock() - self.last_used >= SMTP_IDLE_SECONDS:
+            self.close()
+
+
+class WebhookChannel(Channel):
+    """JSON POST of {subject, body, recipient} to a URL"""
+
+    name = "webhook"
+
+    def __init__(self, url: str = WEBHOOK_URL, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+
+    def payload(self, recipient: str, subject: str, body: str) -> Dict:
+        return {'recipient': recipient, 'subject': subject, 'body': body}
+
+    def configured(self, recipient: str) -> bool:
+        return bool(self.url) or recipient.startswith(("http://", "https://"))
+
+    def send(self, recipient: str, subject: str, body: str):
+        url = recipient if recipient.startswith(("http://", "https://")) else self.url
+        if not url:
+            raise RuntimeError(f"No URL configured for the {self.name} channel")
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(self.payload(recipient, subject, body)).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise RuntimeError(f"Webhook returned HTTP {response.status}")
+
+
+class SmsChannel(WebhookChannel):
+    """SMS through an HTTP gateway that accepts {to, message} JSON"""
+
+    name = "sms"
+
+    # Keep digests within a few SMS segments
+    MAX_LENGTH = 480
+
+    def __init__(self, url: str = SMS_WEBHOOK_URL, timeout: float = 10.0):
+        super().__init__(url, timeout)
+
+    def payload(self, recipient: str, subject: str, body: str) -> Dict:
+        message = f"{subject}: {body}"
+        if len(message) > self.MAX_LENGTH:
+            message = message[:self.MAX_LENGTH - 3] + "..."
+        return {'to': recipient, 'message': message}
+
+
+CHANNELS = {
+    "email": EmailChannel,
+    "webhook": WebhookChannel,
+    "sms": SmsChannel,
+}
+
+
+def compose_digest(items: List[Dict]) -> tuple:
+    """Build (subject, body) for one or more queued notifications"""
+    def entry(item):
+        body = item['body']
+        if item['occurrences'] > 1:
+            body += f"\n(repeated {item['occurrences']} times)"
+        return body
+
+    if len(items) == 1:
+        return items[0]['subject'], entry(items[0])
+    subject = f"IoT Guardian: {len(items)} alerts"
+    separator = "\n\n" + "-" * 40 + "\n\n"
+    return subject, separator.join(entry(item) for item in items)
+
+
+class NotificationDispatcher:
+    """Delivers queued notifications from the SQLite outbox on its own thread.
+
+    `notify()` only writes to the outbox, so a slow or unreachable mail
+    server never blocks the caller. The worker sleeps until the next row is
+    due, groups due rows by (channel, recipient) into one digest, and sends
+    at most one digest per recipient every DIGEST_SECONDS, within a
+    per-channel hourly limit. Failed deliveries are retried with
+    exponential backoff up to MAX_ATTEMPTS.
+    """
+
+    def __init__(self, channels: Dict[str, Channel] = None,
+                 clock: Callable[[], float] = time.time,
+                 digest_seconds: float = DIGEST_SECONDS,
+                 rate_limit_per_hour: int = RATE_LIMIT_PER_HOUR):
+        self.channels = channels if channels is not None else {
+            name: cls() for name, cls in CHANNELS.items()}
+        self.clock = clock
+        self.digest_seconds = digest_seconds
+        self.rate_limit_per_hour = rate_limit_per_hour
+        self._last_sent: Dict[tuple, float] = {}
+        self._sent_times: Dict[str, deque] = defaultdict(deque)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_cleanup = 0.0
+
+    def notify(self, channel: str, recipient: str, subject: str, body: str,
+               dedup_key: str = None):
+        """Queue a notification; alerts sharing a pending dedup key are merged.
+
+        Channels that cannot deliver to the recipient (an SMS number without
+        IOT_GUARDIAN_SMS_WEBHOOK_URL) are skipped rather than retried.
+        """
+        if not recipient or channel not in self.channels or not self.channels[channel].configured(recipient):
+            return
+        enqueue_notification(channel, recipient, dedup_key or subject, subject, body, self.clock())
+        self._wakeup.set()
+
+    def _rate_limited_until(self, channel: str, now: float) -> float:
+        sent = self._sent_times[channel]
+        while sent and sent[0] <= now - 3600:
+            sent.popleft()
+        if len(sent) >= self.rate_limit_per_hour:
+            return sent[0] + 3600
+        return 0.0
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(RETRY_BASE_SECONDS * 2 ** attempts, RETRY_MAX_SECONDS)
+        return delay * random.uniform(0.8, 1.2)
+
+    def dispatch(self) -> int:
+        """Send everything currently due; returns the number of digests sent"""
+        now = self.clock()
+        groups = defaultdict(list)
+        for item in get_due_notifications(now):
+            groups[(item['channel'], item['recipient'])].append(item)
+
+        sent = 0
+        for (channel_name, recipient), items in groups.items():
+            ids = [item['id'] for item in items]
+            channel = self.channels.get(channel_name)
+            if channel is None:
+                retry_notifications(ids, None, f"Unknown channel {channel_name}")
+                continue
+
+            # Hold further alerts for the rest of the digest window
+            hold_until = max(self._last_sent.get((channel_name, recipient), float('-inf'))
+                             + self.digest_seconds,
+                             self._rate_limited_until(channel_name, now))
+            if hold_until > now:
+                postpone_notifications(ids, hold_until)
+                continue
+
+            subject, body = compose_digest(items)
+            try:
+                channel.send(recipient, subject, body)
+            except Exception as e:
+                attempts = max(item['attempts'] for item in items) + 1
+                next_attempt = now + self._backoff(attempts) if attempts < MAX_ATTEMPTS else None
+                retry_notifications(ids, next_attempt, str(e))
+                print(f"Failed to send {channel_name} notification to {recipient}: {e}")
+                continue
+
+            mark_notifications_sent(ids, now)
+            self._last_sent[(channel_name, recipient)] = now
+            self._sent_times[channel_name].append(now)
+            sent += 1
+
+        if now - self._last_cleanup >= 3600:
+            cleanup_notifications(now - OUTBOX_RETENTION_SECONDS)
+            self._last_cleanup = now
+        return sent
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                self.dispatch()
+            except Exception as e:
+                print(f"Notification dispatch error: {e}")
+                self._stop.wait(RETRY_BASE_SECONDS)
+                continue
+            for channel in self.channels.values():
+                channel.close_if_idle(self.clock())
+
+            next_at = get_next_notification_time()
+            timeout = None if next_at is None else max(0.0, next_at - self.clock())
+            # With open SMTP connections, wake up in time to close them
+            if any(getattr(c, 'server', None) is not None for c in self.channels.values()):
+                timeout = SMTP_IDLE_SECONDS if timeout is None else min(timeout, SMTP_IDLE_SECONDS)
+            self._wakeup.wait(timeout)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="notifications", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        for channel in self.channels.values():
+            channel.close()
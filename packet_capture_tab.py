@@ -5,7 +5,10 @@ import threading
 import os
 from typing import Dict, List
 from device_tab import get_current_devices
-from database import record_data_rate
+from accounting import record_rate
+from firewall_backend import default_interface
+from metrics import TSHARK_PROCESSES
+from tracing import span
 
 class PacketCapture:
     def __init__(self):
@@ -99,7 +102,7 @@ def get_packet_capture_tab(page: ft.Page) -> ft.Column:
         
         cmd = [
             "tshark",
-            "-i", "bridge100",
+            "-i", device.get("interface") or default_interface(),
             *(["-a", f"duration:{duration}"] if duration > 0 else []),
             "-w", filename,
             "ether", f"host {mac}"
@@ -120,22 +123,25 @@ def get_packet_capture_tab(page: ft.Page) -> ft.Column:
             )
             
             pc.active_captures[mac] = process
+            TSHARK_PROCESSES.labels("manual").inc()
             update_ui_state("Capture started")
             
             # Read output in real-time
-            while process.poll() is None:
-                output = process.stdout.readline()
-                if output:
-                    output_text.value += output
-                    page.update()
-                time.sleep(0.1)
+            with span("run_tshark", cat="capture", mac=mac):
+                while process.poll() is None:
+                    output = process.stdout.readline()
+                    if output:
+                        output_text.value += output
+                        with span("page.update", cat="ui"):
+                            page.update()
+                    time.sleep(0.1)
             
             # Calculate data rate if completed normally
             if process.returncode == 0 and os.path.exists(filename):
                 file_size_kb = os.path.getsize(filename) / 1024
                 actual_duration = duration if duration > 0 else (time.time() - pc.start_times[mac])
                 data_rate = file_size_kb / actual_duration
-                record_data_rate(mac, data_rate)
+                record_rate(mac, data_rate)
                 output_text.value += f"\n✅ Capture completed for {name}\n"
                 output_text.value += f"💾 Saved to: {filename}\n"
                 output_text.value += f"📊 Data rate: {data_rate:.2f} KB/s\n"
@@ -146,6 +152,7 @@ def get_packet_capture_tab(page: ft.Page) -> ft.Column:
         finally:
             if mac in pc.active_captures:
                 pc.active_captures.pop(mac)
+                TSHARK_PROCESSES.labels("manual").dec()
             if mac in pc.start_times:
                 pc.start_times.pop(mac)
             update_ui_state("Ready")
@@ -203,7 +210,7 @@ def get_packet_capture_tab(page: ft.Page) -> ft.Column:
                         file_size_kb = os.path.getsize(filename) / 1024
                         actual_duration = time.time() - pc.start_times[mac]
                         data_rate = file_size_kb / actual_duration
-                        record_data_rate(mac, data_rate)
+                        record_rate(mac, data_rate)
                         output_text.value += f"📊 Partial data rate: {data_rate:.2f} KB/s\n"
                         output_text.value += f"⏱️ Duration: {actual_duration:.1f} seconds\n"
                 
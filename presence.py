@@ -0,0 +1,117 @@
+# presence.py
+"""Per-device presence state machine driven by discovery scans.
+
+    new      first seen less than NEW_SECONDS ago
+    online   seen in the latest scans
+    idle     not seen for IDLE_SECONDS
+    offline  not seen for OFFLINE_SECONDS
+
+A device seen again goes back to online (or stays new). Scans only report
+who is there, so absence is judged from last_seen rather than from a single
+missed scan: one dropped ARP entry does not flap a device.
+"""
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+NEW = "new"
+ONLINE = "online"
+IDLE = "idle"
+OFFLINE = "offline"
+STATES = (NEW, ONLINE, IDLE, OFFLINE)
+
+NEW_SECONDS = 600
+IDLE_SECONDS = 90
+OFFLINE_SECONDS = 300
+
+# A device seen with no state change has its stored last_seen refreshed at
+# most this often; state changes are always written
+LAST_SEEN_FLUSH_SECONDS = 60
+
+
+class Presence:
+    __slots__ = ("mac", "state", "first_seen", "last_seen", "changed_at", "saved_seen")
+
+    def __init__(self, mac: str, state: str, first_seen: float, last_seen: float, changed_at: float,
+                 saved_seen: float = None):
+        self.mac = mac
+        self.state = state
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.changed_at = changed_at
+        self.saved_seen = saved_seen   # last_seen as stored, None if never stored
+
+    def as_dict(self) -> Dict:
+        return {'mac': self.mac, 'state': self.state, 'first_seen': self.first_seen,
+                'last_seen': self.last_seen, 'changed_at': self.changed_at}
+
+
+class Transition(NamedTuple):
+    mac: str
+    previous: Optional[str]   # None for a device never seen before
+    state: str
+
+
+class PresenceTracker:
+    def __init__(self, rows: Iterable[Dict] = (), clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.devices: Dict[str, Presence] = {
+            row['mac']: Presence(row['mac'], row['state'], row['first_seen'],
+                                 row['last_seen'], row['changed_at'], row['last_seen'])
+            for row in rows
+        }
+
+    def _set(self, presence: Presence, state: str, now: float, transitions: List[Transition]):
+        if presence.state != state:
+            transitions.append(Transition(presence.mac, presence.state, state))
+            presence.state = state
+            presence.changed_at = now
+
+    def update(self, seen: Iterable[str], now: float = None) -> List[Transition]:
+        """Apply one scan's MACs; returns the state changes it caused"""
+        now = self.clock() if now is None else now
+        transitions: List[Transition] = []
+        seen = set(seen)
+        for mac in seen:
+            presence = self.devices.get(mac)
+            if presence is None:
+                self.devices[mac] = Presence(mac, NEW, now, now, now)
+                transitions.append(Transition(mac, None, NEW))
+                continue
+            presence.last_seen = now
+            if presence.state == NEW and now - presence.first_seen < NEW_SECONDS:
+                continue
+            self._set(presence, ONLINE, now, transitions)
+
+        for mac, presence in self.devices.items():
+            if mac in seen or presence.state == OFFLINE:
+                continue
+            absent = now - presence.last_seen
+            if absent >= OFFLINE_SECONDS:
+                self._set(presence, OFFLINE, now, transitions)
+            elif absent >= IDLE_SECONDS:
+                self._set(presence, IDLE, now, transitions)
+        return transitions
+
+    def state(self, mac: str) -> Optional[str]:
+        presence = self.devices.get(mac)
+        return presence.state if presence else None
+
+    def rows(self, macs: Iterable[str]) -> List[Dict]:
+        return [self.devices[mac].as_dict() for mac in macs if mac in self.devices]
+
+    def unsaved(self, transitions: Iterable[Transition], seen: Iterable[str]) -> List[Dict]:
+        """Rows to store after a scan, marked as stored.
+
+        Every device whose state changed, plus seen devices whose stored
+        last_seen is more than LAST_SEEN_FLUSH_SECONDS behind.
+        """
+        macs = {t.mac for t in transitions}
+        for mac in seen:
+            presence = self.devices.get(mac)
+            if presence and (presence.saved_seen is None
+                             or presence.last_seen - presence.saved_seen >= LAST_SEEN_FLUSH_SECONDS):
+                macs.add(mac)
+        rows = self.rows(macs)
+        for row in rows:
+            self.devices[row['mac']].saved_seen = row['last_seen']
+        return rows
@@ -0,0 +1,315 @@
+# rate_series.py
+"""Chart-ready rate series for the Usage History tab.
+
+A device's samples (archived segments plus hot rows) are loaded once into
+NumPy arrays. Both the chart and the records table read from them. The
+chart gets a Largest-Triangle-Three-Buckets selection of about one point
+per pixel. LTTB keeps the shape of the series, spikes included, and the
+global maximum is always kept, so a throttling-level burst never
+disappears from the chart. Series are cached per (mac, days, newest sample
+id), so re-opening a device or moving between table pages does no query
+until a new sample arrives.
+
+In live mode a LiveSeries keeps the selected series current. Each frame it
+reads only the rows newer than the last one it saw, appends them to the
+series' buffers, and drops samples that slid out of the window. Drawn points
+are fixed-width time buckets: a bucket's point is chosen once, when the
+bucket closes, so a frame changes only the newest points and the oldest.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from archive import load_rate_series
+from database import get_data_rate_rows, get_last_data_rate_id
+
+# Points drawn; about the chart's width in pixels
+CHART_POINTS = 800
+CACHE_SIZE = 16
+PAGE_ROWS = 50
+# Live chart frames per second; samples arriving between frames are drawn together
+LIVE_FPS = 4
+# Seconds between reads when no RateSample says a row was written (a UI
+# attached to a separate collector gets no bus events)
+LIVE_POLL_SECONDS = 2
+DAY = 86400
+# Axis tick spacings, in seconds
+TICK_STEPS = (60, 300, 900, 1800, 3600, 2 * 3600, 3 * 3600, 6 * 3600, 12 * 3600,
+              DAY, 2 * DAY, 7 * DAY, 14 * DAY, 30 * DAY, 61 * DAY)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of `threshold` points chosen by Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept. Between them, each bucket keeps the
+    point forming the largest triangle with the previous pick and the mean
+    of the next bucket. Bucket means come from prefix sums, and each bucket
+    is one vectorised area computation, so the cost is O(n) with a Python
+    loop over buckets only. The global maximum of y is always kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    counts = np.maximum(ends - starts, 1)
+    mean_x = (sum_x[ends] - sum_x[starts]) / counts
+    mean_y = (sum_y[ends] - sum_y[starts]) / counts
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = starts[i], ends[i]
+        if end <= start:
+            selected[i + 1] = a = start
+            continue
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - next_x[i]) * (y[start:end] - ay) - (ax - x[start:end]) * (next_y[i] - ay))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+
+    peak = int(y.argmax())
+    if 0 < peak < n - 1:
+        bucket = int(np.searchsorted(starts, peak, "right")) - 1
+        selected[bucket + 1] = peak
+    return selected
+
+
+def tick_step(span: float, count: int = 6) -> int:
+    """The smallest tick spacing giving at most `count` intervals over `span` seconds"""
+    for step in TICK_STEPS:
+        if step * count >= span:
+            return step
+    return TICK_STEPS[-1]
+
+
+def time_ticks(first: float, last: float, step: int) -> List[int]:
+    """Multiples of `step` between first and last"""
+    return list(range(math.ceil(first / step) * step, int(last) + 1, step))
+
+
+class RateSeries:
+    __slots__ = ("mac", "days", "last_id", "_times", "_rates", "_start", "_end", "width", "points")
+
+    def __init__(self, mac: str, days: int, last_id: int, times: np.ndarray, rates: np.ndarray):
+        self.mac = mac
+        self.days = days
+        self.last_id = last_id
+        self._times = times
+        self._rates = rates
+        self._start = 0
+        self._end = len(times)
+        self.width = None
+        self.points: Optional[np.ndarray] = None
+
+    @property
+    def times(self) -> np.ndarray:
+        return self._times[self._start:self._end]
+
+    @property
+    def rates(self) -> np.ndarray:
+        return self._rates[self._start:self._end]
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def append(self, times: List[int], rates: List[float], last_id: int):
+        """Add newer samples. The buffers grow by doubling, so this is
+        amortised O(len(times))."""
+        count = len(times)
+        if self._end + count > len(self._times):
+            size = len(self)
+            capacity = max(2 * (size + count), 64)
+            grown_times, grown_rates = np.empty(capacity, np.int64), np.empty(capacity, np.float64)
+            grown_times[:size], grown_rates[:size] = self.times, self.rates
+            self._times, self._rates = grown_times, grown_rates
+            self._start, self._end = 0, size
+        self._times[self._end:self._end + count] = times
+        self._rates[self._end:self._end + count] = rates
+        self._end += count
+        self.last_id = last_id
+        self.points = None
+
+    def evict(self, before: float) -> np.ndarray:
+        """Drop samples older than `before`; returns their rates"""
+        count = int(np.searchsorted(self.times, before, "left"))
+        evicted = self.rates[:count]
+        if count:
+            self._start += count
+            self.points = None
+        return evicted
+
+    def chart_points(self, width: int = CHART_POINTS) -> np.ndarray:
+        """Indices of the samples to draw; computed once per width"""
+        if self.points is None or self.width != width:
+            self.points = lttb(self.times, self.rates, width)
+            self.width = width
+        return self.points
+
+    def pages(self, rows: int = PAGE_ROWS) -> int:
+        return max(1, -(-len(self) // rows))
+
+    def page(self, number: int, rows: int = PAGE_ROWS) -> List[Tuple[str, float]]:
+        """(timestamp, KB/s) rows of one table page, newest first"""
+        end = len(self) - number * rows
+        start = max(0, end - rows)
+        if end <= 0:
+            return []
+        return [(time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t)), rate) for t, rate in
+                zip(self.times[start:end][::-1].tolist(), self.rates[start:end][::-1].tolist())]
+
+
+class SeriesCache:
+    """Recently viewed series, keyed by (mac, days, newest sample id)"""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._series: "OrderedDict[Tuple[str, int, int], RateSeries]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, series: RateSeries):
+        """Re-key a series that was extended in place, replacing older keys for it"""
+        with self._lock:
+            for key in [key for key, cached in self._series.items() if cached is series]:
+                del self._series[key]
+            self._series[(series.mac, series.days, series.last_id)] = series
+
+    def get(self, mac: str, days: int) -> RateSeries:
+        key = (mac, days, get_last_data_rate_id(mac))
+        with self._lock:
+            series = self._series.get(key)
+            if series is not None:
+                self._series.move_to_end(key)
+                self.hits += 1
+                return series
+        self.misses += 1
+        times, rates, _ = load_rate_series(mac, time.time() - days * 86400)
+        series = RateSeries(mac, days, key[2], times, rates)
+        with self._lock:
+            self._series[key] = series
+            while len(self._series) > self.size:
+                self._series.popitem(last=False)
+        return series
+
+    def invalidate(self, mac: str = None):
+        """Forget a device's series (after deleting samples), or all of them"""
+        with self._lock:
+            for key in [key for key in self._series if mac is None or key[0] == mac]:
+                del self._series[key]
+
+
+class LiveSeries:
+    """A RateSeries kept current for a live chart.
+
+    The window is the series' `days`. Drawn points are one per
+    window/points-second bucket: those from the initial LTTB selection,
+    then one per bucket closed since, chosen like LTTB with the next
+    bucket's first sample standing in for its mean. The open bucket is
+    drawn as its newest sample (`tail`). `high`/`low` follow the window and
+    are recomputed only when an evicted sample was the extreme.
+    """
+
+    def __init__(self, series: RateSeries, points: int = CHART_POINTS, now: float = None):
+        now = time.time() if now is None else now
+        self.series = series
+        self.window = series.days * DAY
+        self.bucket = max(1, self.window // points)
+        series.evict(now - self.window)
+        self.start = now - self.window
+        self.drawn = deque()
+        self.pending_times: List[int] = []
+        self.pending_rates: List[float] = []
+        self.high = self.low = None
+        self.cursor = int(self.start)
+        self.open_bucket = None
+        if len(series):
+            times, rates = series.times, series.rates
+            self.cursor = int(times[-1])
+            self.open_bucket = self.cursor // self.bucket
+            first_open = int(np.searchsorted(times, self.open_bucket * self.bucket, "left"))
+            indices = series.chart_points(points)
+            indices = indices[indices < first_open]
+            self.drawn.extend(zip(times[indices].tolist(), rates[indices].tolist()))
+            self.pending_times = times[first_open:].tolist()
+            self.pending_rates = rates[first_open:].tolist()
+            self.high, self.low = float(rates.max()), float(rates.min())
+
+    def __len__(self) -> int:
+        return len(self.series)
+
+    @property
+    def tail(self) -> Optional[Tuple[int, float]]:
+        if not self.pending_times:
+            return None
+        return self.pending_times[-1], self.pending_rates[-1]
+
+    def _close_bucket(self, next_time: int, next_rate: float) -> Tuple[int, float]:
+        times, rates = self.pending_times, self.pending_rates
+        if len(times) == 1 or not self.drawn:
+            best = int(np.argmax(rates))
+        else:
+            ax, ay = self.drawn[-1]
+            t, r = np.asarray(times, np.float64), np.asarray(rates, np.float64)
+            area = np.abs((ax - next_time) * (r - ay) - (ax - t) * (next_rate - ay))
+            best = int(area.argmax())
+        return times[best], rates[best]
+
+    def update(self, now: float = None) -> Tuple[List[Tuple[int, float]], List[Tuple[int, float]], int, bool]:
+        """Read rows newer than the last one seen and slide the window.
+
+        Returns (new samples, newly drawn points, drawn points evicted from
+        the front, whether high/low changed). The tail is not included.
+        """
+        now = time.time() if now is None else now
+        series = self.series
+        rows = [row for row in get_data_rate_rows(series.mac, self.cursor) if row[0] > series.last_id]
+        samples = [(row[1], row[2]) for row in rows]
+        added = []
+        bounds_changed = False
+        if rows:
+            times = [t for t, _ in samples]
+            rates = [rate for _, rate in samples]
+            series.append(times, rates, max(row[0] for row in rows))
+            self.cursor = max(self.cursor, max(times))
+            high, low = max(rates), min(rates)
+            if self.high is None or high > self.high:
+                self.high, bounds_changed = high, True
+            if self.low is None or low < self.low:
+                self.low, bounds_changed = low, True
+            for t, rate in samples:
+                bucket = t // self.bucket
+                if self.open_bucket is not None and bucket > self.open_bucket and self.pending_times:
+                    point = self._close_bucket(t, rate)
+                    self.drawn.append(point)
+                    added.append(point)
+                    self.pending_times, self.pending_rates = [], []
+                self.open_bucket = bucket if self.open_bucket is None else max(self.open_bucket, bucket)
+                self.pending_times.append(t)
+                self.pending_rates.append(rate)
+
+        self.start = now - self.window
+        evicted = series.evict(self.start)
+        if len(evicted) and (evicted.max() >= self.high or evicted.min() <= self.low):
+            rates = series.rates
+            self.high, self.low = (float(rates.max()), float(rates.min())) if len(rates) else (None, None)
+            bounds_changed = True
+        removed = 0
+        while self.drawn and self.drawn[0][0] < self.start:
+            self.drawn.popleft()
+            removed += 1
+        return samples, added, removed, bounds_changed
+
+
+cache = SeriesCache()
@@ -0,0 +1,379 @@
+# simulator.py
+"""Drive IPSMonitor from synthetic or recorded traffic in virtual time.
+
+Virtual devices emit traffic according to rate profiles. Their bytes go
+through the real TrafficAccountant (windows and early threshold publishes),
+the IPS rate listener, DeviceRateTable and ThrottleManager, against a
+throwaway SQLite database. Firewall shaping, notifications and evidence
+captures are replaced by fakes that record what the IPS asked for, and
+throttles cap the traffic the device can send afterwards.
+
+    python simulator.py [devices] [hours]
+"""
+import math
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+import database
+from accounting import TrafficAccountant
+from throttle import ThrottleManager, TimerWheel
+
+WINDOW_SECONDS = 5.0
+
+# Frames per device per window; more chunks give finer early-detection timing
+CHUNKS_PER_WINDOW = 5
+
+# Fixed virtual start (a Monday, 00:00 UTC) so runs are repeatable
+DEFAULT_START = 1700438400.0
+
+GATEWAY_MAC = "02:00:00:00:00:fe"
+
+
+class VirtualClock:
+    def __init__(self, start: float = DEFAULT_START):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def set(self, now: float):
+        self.now = now
+
+
+class SteadyProfile:
+    """Constant rate with multiplicative noise"""
+
+    def __init__(self, mean: float, jitter: float = 0.2):
+        self.mean = mean
+        self.jitter = jitter
+
+    def rate(self, t: float, rng: random.Random) -> float:
+        return max(0.0, self.mean * (1 + rng.gauss(0, self.jitter)))
+
+    def attacking(self, t: float) -> bool:
+        return False
+
+
+class BurstyProfile(SteadyProfile):
+    """Low idle rate with short, frequent bursts (cameras, backups, updates)"""
+
+    def __init__(self, mean: float, burst_rate: float, burst_prob: float = 0.02,
+                 burst_seconds: float = 30.0, jitter: float = 0.3):
+        super().__init__(mean, jitter)
+        self.burst_rate = burst_rate
+        self.burst_prob = burst_prob
+        self.burst_seconds = burst_seconds
+        self._burst_until = -math.inf
+
+    def rate(self, t: float, rng: random.Random) -> float:
+        if t >= self._burst_until and rng.random() < self.burst_prob:
+            self._burst_until = t + self.burst_seconds
+        if t < self._burst_until:
+            return self.burst_rate * (1 + rng.gauss(0, self.jitter))
+        return super().rate(t, rng)
+
+
+class ExfiltrationProfile(SteadyProfile):
+    """Normal traffic, then a slow ramp up to a sustained upload"""
+
+    def __init__(self, mean: float, start: float, ramp_seconds: float, peak: float,
+                 jitter: float = 0.2):
+        super().__init__(mean, jitter)
+        self.start = start
+        self.ramp_seconds = ramp_seconds
+        self.peak = peak
+
+    def rate(self, t: float, rng: random.Random) -> float:
+        base = super().rate(t, rng)
+        if t < self.start:
+            return base
+        progress = min(1.0, (t - self.start) / self.ramp_seconds)
+        return base + (self.peak - self.mean) * progress
+
+    def attacking(self, t: float) -> bool:
+        return t >= self.start
+
+
+class DdosProfile(SteadyProfile):
+    """Normal traffic with a flood for the duration of a DDoS campaign"""
+
+    def __init__(self, mean: float, start: float, duration: float, flood_rate: float,
+                 jitter: float = 0.2):
+        super().__init__(mean, jitter)
+        self.start = start
+        self.duration = duration
+        self.flood_rate = flood_rate
+
+    def rate(self, t: float, rng: random.Random) -> float:
+        if self.attacking(t):
+            return self.flood_rate * (1 + rng.gauss(0, 0.1))
+        return super().rate(t, rng)
+
+    def attacking(self, t: float) -> bool:
+        return self.start <= t < self.start + self.duration
+
+
+class ReplayProfile:
+    """Replays recorded (offset_seconds, rate) samples, looping at the end"""
+
+    def __init__(self, samples: List[Tuple[float, float]]):
+        self.offsets = [offset for offset, _ in samples]
+        self.rates = [rate for _, rate in samples]
+        self.length = (self.offsets[-1] + WINDOW_SECONDS) if samples else 0.0
+        self.origin = None
+
+    def rate(self, t: float, rng: random.Random) -> float:
+        if not self.offsets:
+            return 0.0
+        if self.origin is None:
+            self.origin = t
+        offset = (t - self.origin) % self.length
+        lo, hi = 0, len(self.offsets) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.offsets[mid] <= offset:
+                lo = mid
+            else:
+                hi = mid - 1
+        return self.rates[lo]
+
+    def attacking(self, t: float) -> bool:
+        return False
+
+
+def load_recorded_profiles(db_path: str, days: int = 7) -> Dict[str, ReplayProfile]:
+    """Build replay profiles from the device_data_rates table of an existing database"""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute('''SELECT mac, CAST(strftime('%s', timestamp) AS REAL), data_rate
+                 FROM device_data_rates
+                 WHERE timestamp >= datetime('now', ?)
+                 ORDER BY mac, timestamp''', (f'-{days} days',))
+    samples: Dict[str, List[Tuple[float, float]]] = {}
+    for mac, ts, rate in c.fetchall():
+        samples.setdefault(mac, []).append((ts, rate))
+    conn.close()
+    return {mac: ReplayProfile([(ts - rows[0][0], rate) for ts, rate in rows])
+            for mac, rows in samples.items()}
+
+
+class SimDevice:
+    def __init__(self, mac: str, profile, max_rate: float, min_rate: float):
+        self.mac = mac
+        self.profile = profile
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+
+
+class FakeBackend:
+    """Records shaping calls; the simulator caps throttled devices' traffic"""
+
+    def __init__(self):
+        self.interface = "sim0"
+        self.throttled: Dict[str, float] = {}
+        self.calls: List[Tuple] = []
+
+    def throttle(self, slot, mac, rate_kbps, ipv4=None):
+        self.throttled[mac] = rate_kbps
+        self.calls.append(("throttle", slot, mac, rate_kbps))
+
+    def remove_throttle(self, slot, mac, ipv4=None):
+        self.throttled.pop(mac, None)
+        self.calls.append(("remove_throttle", slot, mac))
+
+
+class FakeNotifier:
+    def __init__(self):
+        self.sent: List[Tuple] = []
+
+    def notify(self, channel, recipient, subject, body, dedup_key=None):
+        self.sent.append((channel, recipient, dedup_key))
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class FakeCapturePool:
+    def __init__(self):
+        self.requests: List[Tuple] = []
+
+    def submit(self, mac, severity=1.0, reason=None):
+        self.requests.append((mac, severity, reason))
+        return True
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def build_scenario(devices: int = 200, attackers: float = 0.1, hours: float = 2.0,
+                   start: float = DEFAULT_START, seed: int = 1) -> List[SimDevice]:
+    """Benign steady/bursty devices plus exfiltration and DDoS attackers.
+
+    Attacks begin in the second half of the run, after baselines warm up.
+    """
+    rng = random.Random(seed)
+    duration = hours * 3600
+    n_attackers = int(devices * attackers)
+    result = []
+    for i in range(devices):
+        mac = f"02:00:00:{i >> 16 & 0xff:02x}:{i >> 8 & 0xff:02x}:{i & 0xff:02x}"
+        mean = rng.uniform(2.0, 40.0)
+        max_rate = mean * 10
+        if i < n_attackers:
+            attack_start = start + duration * rng.uniform(0.5, 0.8)
+            if i % 2:
+                profile = DdosProfile(mean, attack_start, duration * 0.1, flood_rate=max_rate * 3)
+            else:
+                # Ramps to just under the cap, so only the baseline can see it
+                profile = ExfiltrationProfile(mean, attack_start, rng.choice([30, 120, 600]),
+                                              peak=max_rate * 0.8)
+        elif i % 3 == 0:
+            profile = BurstyProfile(mean, burst_rate=mean * 6)
+        else:
+            profile = SteadyProfile(mean)
+        result.append(SimDevice(mac, profile, max_rate, max(1.0, mean / 2)))
+    return result
+
+
+def run_simulation(devices: List[SimDevice], hours: float = 2.0,
+                   window_seconds: float = WINDOW_SECONDS,
+                   chunks: int = CHUNKS_PER_WINDOW, start: float = DEFAULT_START,
+                   seed: int = 1, db_path: Optional[str] = None) -> Dict:
+    """Run the IPS over the given devices and return detection statistics"""
+    from ips import IPSMonitor
+
+    tmpdir = None
+    if db_path is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmpdir.name, "sim.db")
+    saved_db_path = database.DB_PATH
+    database.DB_PATH = db_path
+    database.init_db()
+    for device in devices:
+        database.save_device_info({'mac': device.mac, 'name': device.mac})
+        database.set_device_thresholds(device.mac, device.max_rate, device.min_rate)
+
+    rng = random.Random(seed)
+    clock = VirtualClock(start)
+    backend = FakeBackend()
+    monitor = IPSMonitor(None, backend=backend, clock=clock)
+    wheel = TimerWheel(clock=clock)
+    monitor.throttles = ThrottleManager(backend, wheel=wheel, wall_clock=clock)
+    monitor.notifier = FakeNotifier()
+    monitor.captures = FakeCapturePool()
+    accountant = TrafficAccountant(backend.interface, window_seconds=window_seconds, clock=clock)
+
+    alerts: List[Tuple[float, str, str]] = []
+    handle_anomaly = monitor._handle_anomaly
+
+    def record_alert(device, current_rate, config):
+        alerts.append((clock(), device['mac'], device.get('reason')))
+        handle_anomaly(device, current_rate, config)
+
+    monitor._handle_anomaly = record_alert
+
+    def drain():
+        events = monitor.rate_events.drain(timeout=0)
+        if events:
+            monitor._process(events)
+
+    monitor.subscribe()
+    windows = int(hours * 3600 / window_seconds)
+    chunk_seconds = window_seconds / chunks
+    benign_samples = 0
+    wall_start = time.perf_counter()
+    try:
+        for w in range(windows):
+            t0 = start + w * window_seconds
+            for c in range(chunks):
+                clock.set(t0 + c * chunk_seconds)
+                for device in devices:
+                    rate = device.profile.rate(clock(), rng)
+                    rate = min(rate, backend.throttled.get(device.mac, rate))
+                    accountant.add_frame(device.mac, GATEWAY_MAC, int(rate * 1024 * chunk_seconds))
+                drain()
+            clock.set(t0 + window_seconds)
+            accountant.close_window()
+            drain()
+            wheel.run_due()
+            benign_samples += sum(1 for device in devices if not device.profile.attacking(t0))
+    finally:
+        monitor.unsubscribe()
+        database.DB_PATH = saved_db_path
+        if tmpdir:
+            tmpdir.cleanup()
+    wall_seconds = time.perf_counter() - wall_start
+
+    # Score alerts against the profiles' ground truth
+    by_mac = {device.mac: device for device in devices}
+    false_positives = 0
+    first_detection: Dict[str, float] = {}
+    for at, mac, reason in alerts:
+        profile = by_mac[mac].profile
+        # An alert up to one window after an attack ends is still a true positive
+        if profile.attacking(at) or profile.attacking(at - window_seconds):
+            first_detection.setdefault(mac, at)
+        else:
+            false_positives += 1
+
+    attackers = [d for d in devices if hasattr(d.profile, 'start')]
+    latencies = sorted(first_detection[d.mac] - d.profile.start
+                       for d in attackers if d.mac in first_detection)
+
+    by_profile: Dict[str, List[int]] = {}
+    for device in attackers:
+        counts = by_profile.setdefault(type(device.profile).__name__, [0, 0])
+        counts[0] += device.mac in first_detection
+        counts[1] += 1
+
+    def percentile(values, q):
+        return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+    return {
+        'devices': len(devices),
+        'attackers': len(attackers),
+        'detected': len(latencies),
+        'detected_by_profile': by_profile,
+        'alerts': len(alerts),
+        'false_positives': false_positives,
+        'false_positive_rate': false_positives / max(benign_samples, 1),
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_max': latencies[-1] if latencies else float('nan'),
+        'throttles': sum(1 for call in backend.calls if call[0] == "throttle"),
+        'windows': windows,
+        'wall_seconds': wall_seconds,
+        'ticks_per_second': windows / wall_seconds,
+        'speedup': windows * window_seconds / wall_seconds,
+    }
+
+
+def print_report(report: Dict):
+    print(f"devices / attackers:  {report['devices']} / {report['attackers']}")
+    print(f"detected:             {report['detected']} ("
+          + ", ".join(f"{name} {hit}/{total}" for name, (hit, total)
+                      in sorted(report['detected_by_profile'].items())) + ")")
+    print(f"alerts:               {report['alerts']}")
+    print(f"false positives:      {report['false_positives']} "
+          f"(rate {report['false_positive_rate']:.2e} per device-window)")
+    print(f"latency p50/p95/max:  {report['latency_p50']:.1f} / {report['latency_p95']:.1f} / "
+          f"{report['latency_max']:.1f} s")
+    print(f"throttles applied:    {report['throttles']}")
+    print(f"windows:              {report['windows']} in {report['wall_seconds']:.1f} s "
+          f"({report['ticks_per_second']:.0f} ticks/s, {report['speedup']:.0f}x real time)")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    print_report(run_simulation(build_scenario(n, hours=hours), hours=hours))
@@ -0,0 +1,386 @@
+# sync.py
+"""Node → collector sync for running many sites from one place.
+
+A node is an ordinary IoT Guardian collector with a sync URL. Triggers log
+every device, presence, rollup and IPS event row that changes
+(database.enable_sync_changes()). The node ships the current values of
+those rows in batches and then forgets the entries the collector
+acknowledged. A row that changes many times between syncs is sent once, so
+traffic follows the number of changed rows, not the size of the database.
+
+    POST /sync/<site>   zlib-compressed JSON batch  ->  {"acked": seq}
+    GET  /sync/<site>   {"acked": seq}
+    GET  /sites         per-site row counts and last sync time
+
+Each batch carries the sequence range (after, upto] it covers. The collector
+applies it and advances the site's acked seq in one transaction:
+
+    upto <= acked    a retry of a batch already applied: nothing is written
+    after > acked    the collector lost data: 409, the node logs every row again
+                     above the collector's seq (restart_sync_changes)
+    otherwise        applied; rows are upserts and events are keyed by their
+                     node id, so a batch overlapping an applied one is harmless
+
+The collector keeps one SQLite file per site in its directory, so sites
+never contend for a write lock and a site can be dropped by deleting its file.
+
+    python sync.py serve --port 8766 --dir sites       # the collector
+    python daemon.py --sync-url http://collector:8766 --site lab-3
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from database import (SYNC_COLUMNS, enable_sync_changes, restart_sync_changes, get_sync_batch,
+                      prune_sync_changes, get_sync_backlog, get_sync_seq)
+from daemon import PeriodicService
+from metrics import REGISTRY
+
+SYNC_URL = os.environ.get("IOT_GUARDIAN_SYNC_URL", "")
+SITE = os.environ.get("IOT_GUARDIAN_SITE", socket.gethostname())
+SYNC_TOKEN = os.environ.get("IOT_GUARDIAN_SYNC_TOKEN", "")
+SYNC_HOST = os.environ.get("IOT_GUARDIAN_SYNC_HOST", "127.0.0.1")
+SYNC_PORT = int(os.environ.get("IOT_GUARDIAN_SYNC_PORT", "8766"))
+SITES_DIR = os.environ.get("IOT_GUARDIAN_SITES_DIR", "sites")
+
+SYNC_INTERVAL = 30
+# Changed rows per batch
+BATCH_ROWS = 5000
+# Largest decompressed batch the collector accepts
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+SITE_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+SYNC_BYTES = REGISTRY.counter("iot_guardian_sync_bytes_total",
+                              "Compressed sync batch bytes sent")
+SYNC_ROWS = REGISTRY.counter("iot_guardian_sync_rows_total",
+                             "Rows sent in sync batches", ["kind"])
+SYNC_BACKLOG = REGISTRY.gauge("iot_guardian_sync_backlog",
+                              "Changed rows not yet acknowledged by the collector")
+
+
+class SyncConflict(Exception):
+    """The batch starts past what the collector has; carries the collector's acked seq"""
+
+    def __init__(self, acked: int):
+        super().__init__(f"collector is at seq {acked}")
+        self.acked = acked
+
+
+def encode_batch(batch: Dict) -> bytes:
+    return zlib.compress(json.dumps(batch, separators=(",", ":")).encode())
+
+
+def decode_batch(body: bytes) -> Dict:
+    decompressor = zlib.decompressobj()
+    raw = decompressor.decompress(body, MAX_BATCH_BYTES)
+    if decompressor.unconsumed_tail:
+        raise ValueError("batch too large")
+    return json.loads(raw)
+
+
+class SiteStore:
+    """The collector's copy of every site, one SQLite file per site"""
+
+    def __init__(self, directory: str = SITES_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def path(self, site: str) -> str:
+        if not SITE_NAME.match(site):
+            raise ValueError(f"invalid site name {site!r}")
+        return os.path.join(self.directory, f"{site}.db")
+
+    def _lock(self, site: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(site, threading.Lock())
+
+    def _connect(self, site: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path(site))
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS devices
+                     (mac TEXT PRIMARY KEY,
+                      name TEXT,
+                      ipv4 TEXT,
+                      vendor TEXT,
+                      model TEXT,
+                      os_version TEXT,
+                      description TEXT,
+                      interface TEXT,
+                      last_seen TIMESTAMP,
+                      state TEXT,
+                      first_seen REAL,
+                      seen_at REAL)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS data_rate_rollups
+                     (mac TEXT,
+                      resolution INTEGER,
+                      bucket INTEGER,
+                      samples INTEGER,
+                      total REAL,
+                      min_rate REAL,
+                      max_rate REAL,
+                      PRIMARY KEY (mac, resolution, bucket)) WITHOUT ROWID''')
+        c.execute('''CREATE TABLE IF NOT EXISTS ips_events
+                     (id INTEGER PRIMARY KEY,
+                      mac TEXT,
+                      timestamp TIMESTAMP,
+                      detected_rate REAL,
+                      action_taken TEXT)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS sync_state
+                     (id INTEGER PRIMARY KEY,
+                      acked INTEGER,
+                      batches INTEGER,
+                      synced_at REAL)''')
+        c.execute('INSERT OR IGNORE INTO sync_state (id, acked, batches, synced_at) VALUES (1, 0, 0, NULL)')
+        return conn
+
+    def acked(self, site: str) -> int:
+        conn = self._connect(site)
+        c = conn.cursor()
+        c.execute('SELECT acked FROM sync_state WHERE id = 1')
+        acked = c.fetchone()[0]
+        conn.commit()
+        conn.close()
+        return acked
+
+    def ingest(self, site: str, batch: Dict) -> int:
+        """Apply one batch exactly once; returns the site's acked seq"""
+        after, upto = int(batch['after']), batch.get('upto')
+        with self._lock(site):
+            conn = self._connect(site)
+            c = conn.cursor()
+            try:
+                c.execute('SELECT acked FROM sync_state WHERE id = 1')
+                acked = c.fetchone()[0]
+                if upto is None or upto <= acked:
+                    return acked
+                if after > acked:
+                    raise SyncConflict(acked)
+
+                for kind, table in (('devices', 'devices'), ('rollups', 'data_rate_rollups'),
+                                    ('events', 'ips_events')):
+                    rows = batch.get(kind) or []
+                    columns = SYNC_COLUMNS[kind]
+                    c.executemany(f'''INSERT OR REPLACE INTO {table} ({', '.join(columns)})
+                                      VALUES ({', '.join('?' * len(columns))})''',
+                                  [row for row in rows if len(row) == len(columns)])
+                c.execute('''UPDATE sync_state SET acked = ?, batches = batches + 1, synced_at = ?
+                             WHERE id = 1''', (upto, time.time()))
+                conn.commit()
+                return upto
+            finally:
+                conn.close()
+
+    def sites(self) -> List[str]:
+        return sorted(name[:-3] for name in os.listdir(self.directory)
+                      if name.endswith(".db") and SITE_NAME.match(name[:-3]))
+
+    def summary(self, site: str) -> Dict:
+        conn = self._connect(site)
+        c = conn.cursor()
+        c.execute('''SELECT (SELECT COUNT(*) FROM devices),
+                            (SELECT COUNT(*) FROM devices WHERE state != 'offline'),
+                            (SELECT COUNT(*) FROM ips_events),
+                            acked, batches, synced_at
+                     FROM sync_state WHERE id = 1''')
+        row = c.fetchone()
+        conn.commit()
+        conn.close()
+        return {'site': site, 'devices': row[0], 'present': row[1], 'ips_events': row[2],
+                'acked': row[3], 'batches': row[4], 'synced_at': row[5]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    store: SiteStore = None
+    token = ""
+
+    def _reply(self, status: int, document: Dict):
+        body = json.dumps(document).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _site(self) -> Optional[str]:
+        if self.token and self.headers.get("Authorization") != f"Bearer {self.token}":
+            self._reply(401, {'error': 'bad token'})
+            return None
+        match = re.fullmatch(r"/sync/([^/?]+)", self.path.split("?", 1)[0])
+        if not match or not SITE_NAME.match(match.group(1)):
+            self._reply(404, {'error': 'unknown path'})
+            return None
+        return match.group(1)
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] == "/sites":
+            if self.token and self.headers.get("Authorization") != f"Bearer {self.token}":
+                self._reply(401, {'error': 'bad token'})
+                return
+            self._reply(200, {'items': [self.store.summary(site) for site in self.store.sites()]})
+            return
+        site = self._site()
+        if site:
+            self._reply(200, {'acked': self.store.acked(site)})
+
+    def do_POST(self):
+        site = self._site()
+        if not site:
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            batch = decode_batch(self.rfile.read(length))
+            self._reply(200, {'acked': self.store.ingest(site, batch)})
+        except SyncConflict as e:
+            self._reply(409, {'acked': e.acked, 'error': str(e)})
+        except (ValueError, KeyError, TypeError, zlib.error) as e:
+            self._reply(400, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SyncServer:
+    """The collector's ingest endpoint, on a background thread"""
+
+    def __init__(self, store: SiteStore, host: str = SYNC_HOST, port: int = SYNC_PORT,
+                 token: str = SYNC_TOKEN):
+        handler = type("Handler", (_Handler,), {"store": store, "token": token})
+        self.store = store
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="sync-server", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread:
+            self.thread.join()
+
+
+class SyncService(PeriodicService):
+    """Ships this node's changed rows to the collector every SYNC_INTERVAL"""
+
+    name = "sync"
+
+    def __init__(self, url: str = SYNC_URL, site: str = SITE, token: str = SYNC_TOKEN,
+                 interval: float = SYNC_INTERVAL, batch_rows: int = BATCH_ROWS,
+                 timeout: float = 30.0):
+        super().__init__(interval)
+        if not SITE_NAME.match(site):
+            raise ValueError(f"invalid site name {site!r}")
+        self.url = url.rstrip("/") + f"/sync/{site}"
+        self.site = site
+        self.token = token
+        self.batch_rows = batch_rows
+        self.timeout = timeout
+        self.acked: Optional[int] = None
+        self.batches = 0
+        self.bytes_sent = 0
+        self.rows_sent = 0
+
+    def _request(self, body: bytes = None) -> Dict:
+        headers = {'Content-Type': 'application/json'}
+        if body is not None:
+            headers['Content-Encoding'] = 'deflate'
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        request = urllib.request.Request(self.url, data=body, headers=headers,
+                                         method='POST' if body is not None else 'GET')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 409:
+                raise SyncConflict(json.loads(e.read())['acked'])
+            raise
+
+    def start(self):
+        enable_sync_changes()
+        super().start()
+
+    def run_once(self):
+        if self.acked is None:
+            # Resume from what the collector has, not from what we last sent
+            self.acked = self._request()['acked']
+            if self.acked > get_sync_seq():
+                # This database is newer than the collector's copy of the site
+                restart_sync_changes(self.acked)
+            prune_sync_changes(self.acked)
+        while not self._stop.is_set():
+            batch = get_sync_batch(self.acked, self.batch_rows)
+            if batch['upto'] is None:
+                break
+            body = encode_batch(batch)
+            try:
+                acked = self._request(body)['acked']
+            except SyncConflict as e:
+                print(f"Sync: collector is behind (seq {e.acked}), sending a full copy")
+                restart_sync_changes(e.acked)
+                self.acked = e.acked
+                continue
+            self.batches += 1
+            self.bytes_sent += len(body)
+            SYNC_BYTES.inc(len(body))
+            for kind in SYNC_COLUMNS:
+                self.rows_sent += len(batch[kind])
+                SYNC_ROWS.labels(kind).inc(len(batch[kind]))
+            prune_sync_changes(acked)
+            self.acked = acked
+        SYNC_BACKLOG.set(get_sync_backlog())
+
+    def status(self) -> str:
+        return (f"site={self.site} acked={self.acked} batches={self.batches} "
+                f"rows={self.rows_sent} bytes={self.bytes_sent} " + super().status())
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="IoT Guardian multi-site sync")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the collector")
+    serve.add_argument("--host", default=SYNC_HOST)
+    serve.add_argument("--port", type=int, default=SYNC_PORT)
+    serve.add_argument("--dir", default=SITES_DIR, help="one SQLite file per site here")
+    push = commands.add_parser("push", help="send this node's changes once")
+    push.add_argument("--url", default=SYNC_URL)
+    push.add_argument("--site", default=SITE)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = SyncServer(SiteStore(args.dir), args.host, args.port)
+        print(f"Sync collector on {args.host}:{server.port}, sites in {args.dir}")
+        try:
+            server.server.serve_forever()
+        except KeyboardInterrupt:
+            server.server.server_close()
+        return
+
+    from database import init_db
+    init_db()
+    service = SyncService(args.url, args.site)
+    enable_sync_changes()
+    service.run_once()
+    print(service.status())
+
+
+if __name__ == "__main__":
+    main()
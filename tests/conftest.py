@@ -0,0 +1,28 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FAKE_BIN = os.path.join(ROOT, "tests", "fake_bin.py")
+
+
+@pytest.fixture
+def fake_bin(tmp_path, monkeypatch):
+    """Point firewall_backend's binaries at the recording fake; returns a
+    function giving the recorded invocations"""
+    import firewall_backend
+    log = tmp_path / "calls.jsonl"
+    monkeypatch.setenv("FAKE_BIN_LOG", str(log))
+    for name in ("NFT_BIN", "TC_BIN", "IP_BIN", "PFCTL_BIN", "DNCTL_BIN"):
+        monkeypatch.setattr(firewall_backend, name, FAKE_BIN)
+    monkeypatch.setattr(firewall_backend, "SUDO", [])
+
+    def calls():
+        if not log.exists():
+            return []
+        return [json.loads(line) for line in log.read_text().splitlines()]
+    return calls
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""Recording stand-in for nft, tc, ip, pfctl and dnctl.
+
+Appends one JSON line per invocation to $FAKE_BIN_LOG with the arguments
+and, for every `-f <file>` argument, the file's contents at call time (the
+backends reuse one rules file). Exits with $FAKE_BIN_EXIT, default 0.
+"""
+import json
+import os
+import sys
+
+
+def main():
+    args = sys.argv[1:]
+    files = {}
+    for flag, value in zip(args, args[1:]):
+        if flag == "-f" and os.path.exists(value):
+            with open(value) as f:
+                files[value] = f.read()
+    with open(os.environ["FAKE_BIN_LOG"], "a") as log:
+        log.write(json.dumps({'args': args, 'files': files}) + "\n")
+    return int(os.environ.get("FAKE_BIN_EXIT", "0"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
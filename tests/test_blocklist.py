@@ -0,0 +1,51 @@
+import pytest
+
+import blocklist
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "guardian.db")
+    monkeypatch.setattr(database, "DB_PATH", path)
+    database.init_db()
+    return path
+
+
+def test_domains_are_exported_for_dnsmasq_until_their_list_is_removed(db, tmp_path):
+    hosts = tmp_path / "hosts.txt"
+    hosts.write_text("0.0.0.0 ads.example.com\n"
+                     "0.0.0.0 example.com\n"
+                     "192.0.2.7 tracker.example.org metrics.example.net\n"
+                     "198.51.100.0/24\n")
+    other = tmp_path / "other.txt"
+    other.write_text("||tracker.example.org^\n")
+    blocklist.import_blocklist("ads", str(hosts), db_path=db)
+    blocklist.import_blocklist("other", str(other), db_path=db)
+    out = tmp_path / "blocklist.conf"
+
+    # Subdomains of listed domains are dropped; CIDRs stay with the firewall
+    assert blocklist.export_dnsmasq(str(out), reload_command="") == 3
+    assert out.read_text().splitlines()[1:] == ["address=/example.com/",
+                                                "address=/metrics.example.net/",
+                                                "address=/tracker.example.org/"]
+
+    blocklist.remove_blocklist("ads")
+    assert [s['name'] for s in database.get_blocklist_sources()] == ["other"]
+    assert database.get_blocklist_networks() == []
+    assert blocklist.export_dnsmasq(str(out), reload_command="") == 1
+    assert out.read_text().splitlines()[1:] == ["address=/tracker.example.org/"]
+
+
+def test_cli_removes_a_named_list(db, tmp_path, monkeypatch, capsys):
+    hosts = tmp_path / "hosts.txt"
+    hosts.write_text("0.0.0.0 ads.example.com\n")
+    out = tmp_path / "blocklist.conf"
+    monkeypatch.setattr(blocklist, "DNSMASQ_FILE", str(out))
+    monkeypatch.setattr(blocklist, "DNS_RELOAD", "")
+    blocklist.import_blocklist("ads", str(hosts), db_path=db)
+
+    blocklist.main(["remove", "ads"])
+    assert database.get_blocklist_sources() == []
+    assert out.read_text().splitlines()[1:] == []
+    assert capsys.readouterr().out.strip() == f"0 domains written to {out}"
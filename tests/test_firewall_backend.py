@@ -0,0 +1,141 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import firewall_backend
+from conftest import FAKE_BIN, ROOT
+from firewall_backend import NftablesBackend
+
+MAC = "aa:bb:cc:dd:ee:01"
+
+
+@pytest.fixture
+def nft(tmp_path):
+    backend = NftablesBackend("br-test")
+    backend.rules_file = str(tmp_path / "rules.nft")
+    return backend
+
+
+def map_elements(script: str, name: str) -> list:
+    """The elements of one verdict map in an nft script"""
+    block = re.search(r"map %s \{(.*?)\n    \}" % name, script, re.S).group(1)
+    listed = re.search(r"elements = \{(.*)\}", block, re.S)
+    return [element.strip() for element in listed.group(1).split(",")] if listed else []
+
+
+def map_flags(script: str, name: str) -> bool:
+    block = re.search(r"map %s \{(.*?)\n    \}" % name, script, re.S).group(1)
+    return "flags interval" in block
+
+
+def test_binaries_come_from_the_environment():
+    env = dict(os.environ, IOT_GUARDIAN_NFT=FAKE_BIN, IOT_GUARDIAN_TC=FAKE_BIN, IOT_GUARDIAN_IP=FAKE_BIN,
+               IOT_GUARDIAN_SUDO="")
+    out = subprocess.run([sys.executable, "-c",
+                          "import firewall_backend as f; print(f.NFT_BIN, f.TC_BIN, f.IP_BIN, f.SUDO)"],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout.split()
+    assert out == [FAKE_BIN, FAKE_BIN, FAKE_BIN, "[]"]
+
+
+def test_apply_rules_checks_then_applies_one_script(nft, fake_bin):
+    rules = [
+        {'type': 'ip', 'target': '10.0.0.0/8', 'protocol': None, 'action': 'DROP'},
+        {'type': 'ip', 'target': '10.1.0.0/16', 'protocol': None, 'action': 'REJECT'},
+        {'type': 'ip', 'target': '192.168.1.100', 'protocol': 'tcp', 'action': 'DROP'},
+        {'type': 'ip', 'target': '2001:db8::1', 'protocol': None, 'action': 'REJECT'},
+        {'type': 'port', 'target': '22', 'protocol': None, 'action': 'DROP'},
+        {'type': 'port', 'target': '53', 'protocol': 'udp', 'action': 'REJECT'},
+    ]
+    nft.apply_rules(rules, blocklist=["203.0.113.0/24", "203.0.113.128/25"])
+
+    calls = fake_bin()
+    assert [call['args'] for call in calls] == [["-c", "-f", nft.rules_file], ["-f", nft.rules_file]]
+    script = calls[0]['files'][nft.rules_file]
+    assert calls[1]['files'][nft.rules_file] == script
+
+    # Replaced atomically: declare, delete and recreate in one transaction
+    assert script.splitlines()[:3] == ["table inet iot_guardian {}", "delete table inet iot_guardian",
+                                       "table inet iot_guardian {"]
+    # The /16 reject lies inside the /8 drop (drop wins); the blocklist /25 is collapsed
+    assert sorted(map_elements(script, "addr_v4")) == ["10.0.0.0/8 : drop", "203.0.113.0/24 : drop"]
+    assert map_elements(script, "addr_v6") == ["2001:db8::1/128 : jump reject_traffic"]
+    assert map_elements(script, "proto_addr_v4") == ["tcp . 192.168.1.100/32 : drop"]
+    assert map_elements(script, "proto_addr_v6") == []
+    assert sorted(map_elements(script, "proto_port")) == ["tcp . 22 : drop", "udp . 22 : drop",
+                                                           "udp . 53 : jump reject_traffic"]
+    assert all(map_flags(script, name) for name in ("addr_v4", "addr_v6", "proto_addr_v4", "proto_addr_v6"))
+    assert not map_flags(script, "proto_port")
+    for line in ("ip saddr vmap @addr_v4", "ip6 daddr vmap @addr_v6",
+                 "meta l4proto . ip daddr vmap @proto_addr_v4",
+                 "meta l4proto { tcp, udp } meta l4proto . th dport vmap @proto_port",
+                 "type filter hook forward priority filter; policy accept;"):
+        assert line in script
+
+
+def test_failed_check_is_not_applied(nft, fake_bin, monkeypatch):
+    monkeypatch.setenv("FAKE_BIN_EXIT", "1")
+    with pytest.raises(subprocess.CalledProcessError):
+        nft.apply_rules([{'type': 'ip', 'target': '10.0.0.1', 'protocol': None, 'action': 'DROP'}])
+    assert [call['args'][0] for call in fake_bin()] == ["-c"]
+
+
+def test_reset_rules_deletes_the_table(nft, fake_bin):
+    nft.reset_rules()
+    (call,) = fake_bin()
+    assert call['args'] == ["-f", nft.rules_file]
+    assert call['files'][nft.rules_file] == "table inet iot_guardian {}\ndelete table inet iot_guardian\n"
+
+
+def test_throttle_uses_htb_classes_and_flower_filters(nft, fake_bin):
+    nft.throttle(10, MAC, 12.5)
+    nft.throttle(11, "aa:bb:cc:dd:ee:02", 0.2)
+    nft.remove_throttle(10, MAC)
+
+    assert [call['args'] for call in fake_bin()] == [
+        ["qdisc", "replace", "dev", "br-test", "root", "handle", "1:", "htb"],
+        ["link", "add", "name", "ifb-br-test", "type", "ifb"],
+        ["link", "set", "dev", "ifb-br-test", "up"],
+        ["qdisc", "replace", "dev", "ifb-br-test", "root", "handle", "1:", "htb"],
+        ["qdisc", "replace", "dev", "br-test", "handle", "ffff:", "ingress"],
+        ["filter", "replace", "dev", "br-test", "parent", "ffff:", "protocol", "all", "prio", "1",
+         "matchall", "action", "mirred", "egress", "redirect", "dev", "ifb-br-test"],
+        ["class", "replace", "dev", "br-test", "parent", "1:", "classid", "1:a",
+         "htb", "rate", "12.5kbps", "ceil", "12.5kbps"],
+        ["filter", "replace", "dev", "br-test", "parent", "1:", "protocol", "all", "prio", "10",
+         "flower", "dst_mac", MAC, "classid", "1:a"],
+        ["class", "replace", "dev", "ifb-br-test", "parent", "1:", "classid", "1:a",
+         "htb", "rate", "12.5kbps", "ceil", "12.5kbps"],
+        ["filter", "replace", "dev", "ifb-br-test", "parent", "1:", "protocol", "all", "prio", "10",
+         "flower", "src_mac", MAC, "classid", "1:a"],
+        # The roots are installed once; rates below 1 KB/s are raised to 1
+        ["class", "replace", "dev", "br-test", "parent", "1:", "classid", "1:b",
+         "htb", "rate", "1kbps", "ceil", "1kbps"],
+        ["filter", "replace", "dev", "br-test", "parent", "1:", "protocol", "all", "prio", "11",
+         "flower", "dst_mac", "aa:bb:cc:dd:ee:02", "classid", "1:b"],
+        ["class", "replace", "dev", "ifb-br-test", "parent", "1:", "classid", "1:b",
+         "htb", "rate", "1kbps", "ceil", "1kbps"],
+        ["filter", "replace", "dev", "ifb-br-test", "parent", "1:", "protocol", "all", "prio", "11",
+         "flower", "src_mac", "aa:bb:cc:dd:ee:02", "classid", "1:b"],
+        ["filter", "del", "dev", "br-test", "parent", "1:", "protocol", "all", "prio", "10"],
+        ["class", "del", "dev", "br-test", "classid", "1:a"],
+        ["filter", "del", "dev", "ifb-br-test", "parent", "1:", "protocol", "all", "prio", "10"],
+        ["class", "del", "dev", "ifb-br-test", "classid", "1:a"],
+    ]
+
+
+def test_existing_ifb_device_is_reused(fake_bin):
+    def runner(cmd, input_text=None):
+        if cmd[1:3] == ["link", "add"]:
+            raise subprocess.CalledProcessError(2, cmd, stderr="RTNETLINK answers: File exists")
+        return firewall_backend._run_command(cmd, input_text)
+    backend = NftablesBackend("a-very-long-ifname", runner=runner)
+    assert backend.ifb == "ifb-a-very-long"
+
+    backend.throttle(1, MAC, 100)
+    args = [call['args'] for call in fake_bin()]
+    assert ["link", "set", "dev", "ifb-a-very-long", "up"] in args
+    assert args[-1] == ["filter", "replace", "dev", "ifb-a-very-long", "parent", "1:", "protocol", "all",
+                        "prio", "1", "flower", "src_mac", MAC, "classid", "1:1"]
@@ -0,0 +1,33 @@
+import threading
+
+from metrics import CounterChild, HistogramChild
+
+
+def run_threads(target, count):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_exited_threads_are_folded_into_the_total():
+    counter = CounterChild()
+    counter.inc()
+    run_threads(lambda: counter.inc(2), 50)
+
+    assert counter.value() == 101
+    # Only the main thread still has a cell; the others were folded
+    assert len(counter._cells) == 1
+    run_threads(lambda: counter.inc(), 10)
+    assert counter.value() == 111
+    assert len(counter._cells) == 1
+
+
+def test_histogram_keeps_exited_threads_observations():
+    histogram = HistogramChild((1.0, 10.0))
+    run_threads(lambda: histogram.observe(5.0), 20)
+    histogram.observe(0.5)
+
+    assert histogram.snapshot() == ([1, 21, 21], 100.5, 21)
+    assert len(histogram._cells) == 1
@@ -0,0 +1,115 @@
+import email
+import socketserver
+import threading
+
+import pytest
+
+import database
+from notify import EmailChannel, NotificationDispatcher, SmsChannel
+
+
+class DebuggingSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail and keep it for inspection"""
+
+    def reply(self, line: str):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost debugging SMTP")
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline().decode().rstrip("\r\n")
+            if not line:
+                return
+            command = line.split(" ", 1)[0].upper()
+            if command in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif command == "MAIL":
+                sender, recipients = line.split(":", 1)[1].strip(), []
+                self.reply("250 OK")
+            elif command == "RCPT":
+                recipients.append(line.split(":", 1)[1].strip())
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    chunk = self.rfile.readline().decode()
+                    if chunk in (".\r\n", ""):
+                        break
+                    chunk = chunk[1:] if chunk.startswith("..") else chunk
+                    data.append(chunk.replace("\r\n", "\n"))
+                self.server.messages.append((sender, recipients, email.message_from_string("".join(data))))
+                self.reply("250 OK")
+            elif command in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), DebuggingSMTPHandler)
+    server.daemon_threads = True
+    server.messages = []
+    server.connections = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def outbox(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "notify.db"))
+    database.init_db()
+
+
+def test_alerts_reach_the_smtp_server_as_one_digest(outbox, smtp_server):
+    channel = EmailChannel("127.0.0.1", smtp_server.server_address[1], sender="guardian@test")
+    dispatcher = NotificationDispatcher({'email': channel}, clock=lambda: 1000.0)
+    dispatcher.notify("email", "admin@test", "IPS Alert", "cam over threshold", "cam:threshold")
+    dispatcher.notify("email", "admin@test", "IPS Alert", "cam over threshold", "cam:threshold")
+    dispatcher.notify("email", "admin@test", "IPS Alert", "plug over baseline", "plug:baseline")
+    dispatcher.notify("email", "ops@test", "IPS Alert", "plug over baseline", "plug:baseline")
+
+    assert dispatcher.dispatch() == 2
+    channel.close()
+
+    # One connection, reused for both recipients
+    assert smtp_server.connections == 1
+    by_recipient = {message['To']: message for _, _, message in smtp_server.messages}
+    digest = by_recipient["admin@test"]
+    assert digest['Subject'] == "IoT Guardian: 2 alerts"
+    assert digest['From'] == "guardian@test"
+    assert "cam over threshold\n(repeated 2 times)" in digest.get_payload()
+    assert "plug over baseline" in digest.get_payload()
+    assert by_recipient["ops@test"]['Subject'] == "IPS Alert"
+    assert database.get_due_notifications(10 ** 6) == []
+
+
+def test_unreachable_server_is_retried(outbox, smtp_server):
+    port = smtp_server.server_address[1]
+    smtp_server.shutdown()
+    smtp_server.server_close()
+    dispatcher = NotificationDispatcher({'email': EmailChannel("127.0.0.1", port)}, clock=lambda: 1000.0)
+    dispatcher.notify("email", "admin@test", "IPS Alert", "cam over threshold")
+
+    assert dispatcher.dispatch() == 0
+    (pending,) = database.get_due_notifications(10 ** 6)
+    assert pending['attempts'] == 1
+
+
+def test_sms_without_gateway_is_not_queued(outbox):
+    dispatcher = NotificationDispatcher({'sms': SmsChannel(url=None)}, clock=lambda: 1000.0)
+    dispatcher.notify("sms", "+15550100", "IPS Alert", "cam over threshold")
+    assert database.get_due_notifications(10 ** 6) == []
+
+    dispatcher = NotificationDispatcher({'sms': SmsChannel(url="http://127.0.0.1:9/sms")}, clock=lambda: 1000.0)
+    dispatcher.notify("sms", "+15550100", "IPS Alert", "cam over threshold")
+    assert len(database.get_due_notifications(10 ** 6)) == 1
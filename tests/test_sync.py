@@ -0,0 +1,120 @@
+import sqlite3
+import urllib.error
+
+import pytest
+
+import database
+from sync import SiteStore, SyncServer, SyncService
+
+
+@pytest.fixture
+def collector(tmp_path):
+    server = SyncServer(SiteStore(str(tmp_path / "sites")), "127.0.0.1", 0, token="")
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def nodes(tmp_path, monkeypatch):
+    """Switch database.DB_PATH between per-node databases"""
+    def use(name: str):
+        monkeypatch.setattr(database, "DB_PATH", str(tmp_path / f"{name}.db"))
+        database.init_db()
+        database.enable_sync_changes()
+    return use
+
+
+def node_service(collector, site: str) -> SyncService:
+    return SyncService(f"http://127.0.0.1:{collector.port}", site, token="", batch_rows=2, timeout=5)
+
+
+def add_activity(prefix: str, devices: int, events: int):
+    for i in range(devices):
+        database.save_device_info({'mac': f"{prefix}:{i:02x}", 'name': f"{prefix}-{i}"})
+    for i in range(events):
+        database.record_ips_event(f"{prefix}:00", 100.0 + i, f"event {i}")
+
+
+def site_rows(collector, site: str, table: str) -> list:
+    conn = sqlite3.connect(collector.store.path(site))
+    rows = conn.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall()
+    conn.close()
+    return rows
+
+
+def drop_acks(service: SyncService, after: int):
+    """Let `after` batches through, then apply the next one but lose its reply"""
+    request = service._request
+    sent = []
+
+    def lossy(body=None):
+        reply = request(body)
+        if body is not None:
+            sent.append(reply['acked'])
+            if len(sent) > after:
+                raise urllib.error.URLError("connection reset")
+        return reply
+    service._request = lossy
+    return sent
+
+
+def test_two_nodes_resume_exactly_once_after_a_dropped_ack(collector, nodes):
+    nodes("a")
+    add_activity("aa:aa:aa:aa:aa", devices=3, events=4)
+    nodes("b")
+    add_activity("bb:bb:bb:bb:bb", devices=2, events=1)
+
+    # Node a: the collector applies its second batch, but the ack never arrives
+    nodes("a")
+    service = node_service(collector, "site-a")
+    sent = drop_acks(service, after=1)
+    with pytest.raises(urllib.error.URLError):
+        service.run_once()
+    assert collector.store.acked("site-a") == sent[-1] > service.acked
+    assert database.get_sync_backlog() > 0
+
+    # Node b syncs meanwhile; sites do not see each other's rows
+    nodes("b")
+    node_service(collector, "site-b").run_once()
+    assert database.get_sync_backlog() == 0
+
+    # A restarted node a resumes from the collector's seq, not from what it sent
+    nodes("a")
+    add_activity("aa:aa:aa:aa:aa", devices=0, events=1)
+    restarted = node_service(collector, "site-a")
+    restarted.run_once()
+    assert database.get_sync_backlog() == 0
+    assert restarted.acked == collector.store.acked("site-a") == database.get_sync_seq()
+    node_events = [list(e) for e in sqlite3.connect(database.DB_PATH).execute(
+        "SELECT id, mac, timestamp, detected_rate, action_taken FROM ips_events ORDER BY id")]
+
+    summary = {site: collector.store.summary(site) for site in collector.store.sites()}
+    assert set(summary) == {"site-a", "site-b"}
+    assert [list(e) for e in site_rows(collector, "site-a", "ips_events")] == node_events
+    assert [row[0] for row in site_rows(collector, "site-a", "devices")] == \
+        [f"aa:aa:aa:aa:aa:{i:02x}" for i in range(3)]
+    assert [row[0] for row in site_rows(collector, "site-b", "devices")] == \
+        ["bb:bb:bb:bb:bb:00", "bb:bb:bb:bb:bb:01"]
+    assert summary["site-a"]['ips_events'] == 5
+    assert summary["site-b"]['ips_events'] == 1
+
+
+def test_retry_without_restart_does_not_apply_a_batch_twice(collector, nodes):
+    nodes("a")
+    add_activity("aa:aa:aa:aa:aa", devices=1, events=3)
+    service = node_service(collector, "site-a")
+    sent = drop_acks(service, after=0)
+    with pytest.raises(urllib.error.URLError):
+        service.run_once()
+    batches = collector.store.summary("site-a")['batches']
+
+    # The same service retries from its stale seq; the applied batch is a no-op
+    del service._request
+    service.run_once()
+    assert database.get_sync_backlog() == 0
+    assert service.acked == database.get_sync_seq()
+    summary = collector.store.summary("site-a")
+    assert summary['ips_events'] == 3
+    assert sent == [2]
+    assert summary['batches'] == batches + 1
@@ -0,0 +1,128 @@
+import pytest
+
+import database
+from throttle import ThrottleManager, TimerWheel
+
+MAC_1 = "aa:bb:cc:dd:ee:01"
+MAC_2 = "aa:bb:cc:dd:ee:02"
+MAC_3 = "aa:bb:cc:dd:ee:03"
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RecordingBackend:
+    def __init__(self, interface: str):
+        self.interface = interface
+        self.calls = []
+
+    def throttle(self, slot, mac, rate_kbps, ipv4=None):
+        self.calls.append(("throttle", slot, mac, rate_kbps))
+
+    def remove_throttle(self, slot, mac, ipv4=None):
+        self.calls.append(("remove", slot, mac))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "guardian.db"))
+    database.init_db()
+
+
+def run_until(wheel: TimerWheel, clock: FakeClock, tick: int):
+    """Step the clock one tick at a time, as the wheel thread would"""
+    while wheel.current_tick < tick:
+        clock.now += wheel.tick_seconds
+        wheel.run_due()
+
+
+def test_timers_fire_on_their_tick_across_level_boundaries():
+    # Levels span 4, 16 and 64 ticks; later timers park on the top level
+    clock = FakeClock()
+    wheel = TimerWheel(tick_seconds=1.0, wheel_size=4, levels=3, clock=clock)
+    fired = []
+    run_until(wheel, clock, 7)  # not aligned to any slot boundary
+
+    delays = [1, 3, 4, 5, 9, 15, 16, 17, 63, 64, 65, 200]
+    for delay in delays:
+        wheel.schedule(delay, lambda d: fired.append((d, wheel.current_tick)), delay)
+    run_until(wheel, clock, 7 + max(delays) + 5)
+
+    assert fired == [(delay, 7 + delay) for delay in delays]
+    assert len(wheel) == 0
+
+
+def test_fractional_delays_round_up_and_cancelled_timers_never_fire():
+    clock = FakeClock()
+    wheel = TimerWheel(tick_seconds=0.5, wheel_size=8, levels=2, clock=clock)
+    fired = []
+    kept = wheel.schedule(1.2, fired.append, "kept")
+    cancelled = wheel.schedule(40, fired.append, "cancelled")
+
+    run_until(wheel, clock, 2)
+    assert fired == []
+    run_until(wheel, clock, 3)
+    assert fired == ["kept"]
+
+    assert wheel.cancel(cancelled)
+    assert not wheel.cancel(kept)
+    run_until(wheel, clock, 100)
+    assert fired == ["kept"]
+
+
+def test_scheduling_after_a_stall_counts_from_the_clock():
+    clock = FakeClock()
+    wheel = TimerWheel(tick_seconds=1.0, wheel_size=4, levels=3, clock=clock)
+    fired = []
+    clock.now += 30  # the wheel thread has not caught up yet
+    wheel.schedule(10, lambda: fired.append(wheel.current_tick))
+
+    wheel.run_due()
+    assert fired == []
+    run_until(wheel, clock, 39)
+    assert fired == []
+    run_until(wheel, clock, 40)
+    assert fired == [40]
+
+
+def test_restart_reapplies_live_throttles_and_lifts_expired_ones(db):
+    wall = FakeClock(1_000_000.0)
+    lan, iot = RecordingBackend("br0"), RecordingBackend("br-iot")
+    interfaces = {MAC_1: "br0", MAC_2: "br-iot"}
+    before = ThrottleManager(lan, TimerWheel(clock=FakeClock()), wall_clock=wall,
+                             backends={"br-iot": iot}, interface_for=interfaces.get)
+    before.throttle(MAC_1, 50.0, 1, ipv4="10.0.0.1")
+    before.throttle(MAC_2, 20.0, 10, ipv4="10.0.0.2")
+
+    # Restart two minutes later with empty in-memory state
+    wall.now += 120
+    lan.calls.clear()
+    iot.calls.clear()
+    monotonic = FakeClock()
+    wheel = TimerWheel(clock=monotonic)
+    after = ThrottleManager(lan, wheel, wall_clock=wall,
+                            backends={"br-iot": iot}, interface_for=interfaces.get)
+    after.restore()
+
+    assert lan.calls == [("remove", 1, MAC_1)]
+    assert iot.calls == [("throttle", 2, MAC_2, 20.0)]
+    assert list(after.active) == [MAC_2]
+    assert [t['mac'] for t in database.get_active_throttles()] == [MAC_2]
+    events = database.get_ips_events()
+    assert [(e['mac'], e['action_taken']) for e in events] == [(MAC_1, "Throttle removed")]
+
+    # The expired throttle's slot is reused; the restored one is not
+    assert after.throttle(MAC_3, 10.0, 30, ipv4="10.0.0.3")['slot'] == 1
+
+    # The restored throttle still expires on time, on the interface it was applied to
+    run_until(wheel, monotonic, 8 * 60 - 1)
+    assert MAC_2 in after.active
+    run_until(wheel, monotonic, 8 * 60 + 1)
+    assert MAC_2 not in after.active
+    assert iot.calls[-1] == ("remove", 2, MAC_2)
+    assert [t['mac'] for t in database.get_active_throttles()] == [MAC_3]
@@ -0,0 +1,295 @@
+# throttle.py
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, Optional
+from database import (save_active_throttle, delete_active_throttle,
+                      get_active_throttles, record_ips_event, get_device_info)
+
+# Shaping slots double as dnctl pipe numbers and tc HTB class/filter ids
+MIN_SLOT = 1
+MAX_SLOT = 0xFFFF
+
+
+class TimerWheel:
+    """Hierarchical timing wheel driven by a single thread.
+
+    Level 0 has `wheel_size` slots of `tick_seconds` each; every higher level
+    covers `wheel_size` slots of the level below. Scheduling and cancelling
+    are O(1); timers cascade down one level each time the wheel below wraps.
+    Callbacks run on the wheel thread and should be short.
+    """
+
+    def __init__(self, tick_seconds: float = 1.0, wheel_size: int = 64, levels: int = 4,
+                 clock: Callable[[], float] = time.monotonic):
+        self.tick_seconds = tick_seconds
+        self.wheel_size = wheel_size
+        self.levels = levels
+        self.clock = clock
+        self.wheels = [[{} for _ in range(wheel_size)] for _ in range(levels)]
+        self.current_tick = 0
+        self.start_time = clock()
+        self._locations: Dict[int, tuple] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self):
+        return len(self._locations)
+
+    def _place(self, timer_id: int, expire_tick: int, callback, args):
+        delta = max(expire_tick - self.current_tick, 1)
+        level = 0
+        span = self.wheel_size
+        while delta >= span and level < self.levels - 1:
+            level += 1
+            span *= self.wheel_size
+        # Timers beyond the top level's range park there and get re-placed
+        slot_width = self.wheel_size ** level
+        slot = (max(expire_tick, self.current_tick + 1) // slot_width) % self.wheel_size
+        self.wheels[level][slot][timer_id] = (expire_tick, callback, args)
+        self._locations[timer_id] = (level, slot)
+
+    def schedule(self, delay: float, callback: Callable, *args) -> int:
+        """Run callback(*args) after `delay` seconds; returns a timer id"""
+        with self._lock:
+            now_tick = int((self.clock() - self.start_time) / self.tick_seconds)
+            expire_tick = max(now_tick, self.current_tick) + max(1, int(-(-delay // self.tick_seconds)))
+            timer_id = next(self._ids)
+            self._place(timer_id, expire_tick, callback, args)
+            return timer_id
+
+    def cancel(self, timer_id: int) -> bool:
+        """Cancel a pending timer; returns False if it already fired"""
+        with self._lock:
+            location = self._locations.pop(timer_id, None)
+            if location is None:
+                return False
+            level, slot = location
+            self.wheels[level][slot].pop(timer_id, None)
+            return True
+
+    def advance(self, ticks: int = 1):
+        """Advance the wheel by `ticks`, firing due timers"""
+        for _ in range(ticks):
+            due = []
+            with self._lock:
+                self.current_tick += 1
+                # Cascade higher levels whose slot boundary we just crossed
+                for level in range(1, self.levels):
+                    slot_width = self.wheel_size ** level
+                    if self.current_tick % slot_width:
+                        break
+                    slot = (self.current_tick // slot_width) % self.wheel_size
+                    timers = self.wheels[level][slot]
+                    self.wheels[level][slot] = {}
+                    for timer_id, (expire_tick, callback, args) in timers.items():
+                        if expire_tick <= self.current_tick:
+                            self._locations.pop(timer_id, None)
+                            due.append((callback, args))
+                        else:
+                            self._place(timer_id, expire_tick, callback, args)
+
+                slot = self.current_tick % self.wheel_size
+                timers = self.wheels[0][slot]
+                self.wheels[0][slot] = {}
+                for timer_id, (expire_tick, callback, args) in timers.items():
+                    if expire_tick <= self.current_tick:
+                        self._locations.pop(timer_id, None)
+                        due.append((callback, args))
+                    else:
+                        self._place(timer_id, expire_tick, callback, args)
+
+            for callback, args in due:
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"Timer callback error: {e}")
+
+    def run_due(self):
+        """Advance to the clock's current tick, firing everything due"""
+        target_tick = int((self.clock() - self.start_time) / self.tick_seconds)
+        if target_tick > self.current_tick:
+            self.advance(target_tick - self.current_tick)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_due()
+            next_at = self.start_time + (self.current_tick + 1) * self.tick_seconds
+            self._stop.wait(max(0.0, next_at - self.clock()))
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+class ThrottleManager:
+    """Per-device throttles with persisted state and timer-wheel expiry.
+
+    Each throttled device gets its own shaping slot from the backend, so
+    lifting one throttle leaves the others in place. Active throttles are
+    kept in the `active_throttles` table and re-applied (or expired) by
+    `restore()` after a restart.
+
+    With `backends` (one per monitored interface), a device is shaped on the
+    interface `interface_for(mac)` reports for it; unknown interfaces fall
+    back to `backend`. The interface is stored with the throttle, so it is
+    lifted where it was applied even if the device has moved since.
+    """
+
+    def __init__(self, backend, wheel: TimerWheel = None,
+                 wall_clock: Callable[[], float] = time.time,
+                 backends: Dict[str, object] = None,
+                 interface_for: Callable[[str], Optional[str]] = None):
+        self.backend = backend
+        self.backends = dict(backends or {})
+        self.backends.setdefault(backend.interface, backend)
+        self.interface_for = interface_for
+        # An empty wheel is falsy (it has __len__)
+        self.wheel = wheel if wheel is not None else TimerWheel()
+        self.wall_clock = wall_clock
+        self.active: Dict[str, Dict] = {}
+        self._timers: Dict[str, int] = {}
+        self._free_slots = []
+        self._used_slots = set()
+        self._next_slot = MIN_SLOT
+        self._lock = threading.Lock()
+
+    def _allocate_slot(self) -> int:
+        if self._free_slots:
+            slot = heapq.heappop(self._free_slots)
+        elif self._next_slot <= MAX_SLOT:
+            slot = self._next_slot
+            self._next_slot += 1
+        else:
+            raise RuntimeError("No free throttle slots")
+        self._used_slots.add(slot)
+        return slot
+
+    def _free_slot(self, slot: int):
+        if slot in self._used_slots:
+            self._used_slots.discard(slot)
+            heapq.heappush(self._free_slots, slot)
+
+    def _interface(self, mac: str) -> str:
+        interface = self.interface_for(mac) if self.interface_for else None
+        return interface if interface in self.backends else self.backend.interface
+
+    def _backend(self, throttle: Dict):
+        return self.backends.get(throttle.get('interface'), self.backend)
+
+    def _schedule_expiry(self, mac: str, expires_at: float):
+        old_timer = self._timers.pop(mac, None)
+        if old_timer is not None:
+            self.wheel.cancel(old_timer)
+        delay = max(0.0, expires_at - self.wall_clock())
+        self._timers[mac] = self.wheel.schedule(delay, self.release, mac)
+
+    def start(self):
+        """Restore persisted throttles and start the expiry thread"""
+        self.restore()
+        self.wheel.start()
+
+    def stop(self):
+        self.wheel.stop()
+
+    def restore(self):
+        """Re-apply throttles that outlived a restart; lift expired ones"""
+        now = self.wall_clock()
+        throttles = get_active_throttles()
+        with self._lock:
+            for throttle in throttles:
+                self.active[throttle['mac']] = throttle
+                self._used_slots.add(throttle['slot'])
+            self._next_slot = max([self._next_slot] + [t['slot'] + 1 for t in throttles])
+            self._free_slots = [slot for slot in range(MIN_SLOT, self._next_slot)
+                                if slot not in self._used_slots]
+            heapq.heapify(self._free_slots)
+
+        for throttle in throttles:
+            mac = throttle['mac']
+            if throttle['expires_at'] <= now:
+                self.release(mac)
+                continue
+            try:
+                self._backend(throttle).throttle(throttle['slot'], mac, throttle['rate'],
+                                                 throttle['ipv4'])
+            except Exception as e:
+                print(f"Failed to restore throttle for {mac}: {e}")
+            with self._lock:
+                self._schedule_expiry(mac, throttle['expires_at'])
+
+    def throttle(self, mac: str, rate: float, minutes: float, ipv4: str = None) -> Dict:
+        """Throttle a device, or extend/re-rate its existing throttle"""
+        if ipv4 is None:
+            ipv4 = get_device_info(mac).get('ipv4')
+        interface = self._interface(mac)
+        now = self.wall_clock()
+        with self._lock:
+            existing = self.active.get(mac)
+            slot = existing['slot'] if existing else self._allocate_slot()
+            throttle = {
+                'mac': mac,
+                'slot': slot,
+                'rate': rate,
+                'ipv4': ipv4,
+                'interface': interface,
+                'started_at': existing['started_at'] if existing else now,
+                'expires_at': now + minutes * 60
+            }
+            self.active[mac] = throttle
+
+        try:
+            self._backend(throttle).throttle(slot, mac, rate, ipv4)
+        except Exception:
+            with self._lock:
+                if existing:
+                    self.active[mac] = existing
+                else:
+                    self.active.pop(mac, None)
+                    self._free_slot(slot)
+            raise
+
+        if existing and existing.get('interface') != interface:
+            # The device moved; lift the shaping left on its old interface
+            try:
+                self._backend(existing).remove_throttle(slot, mac, existing['ipv4'])
+            except Exception as e:
+                print(f"Failed to remove throttle for {mac} on {existing.get('interface')}: {e}")
+
+        save_active_throttle(mac, slot, rate, ipv4, throttle['started_at'], throttle['expires_at'],
+                             interface)
+        with self._lock:
+            self._schedule_expiry(mac, throttle['expires_at'])
+        return throttle
+
+    def release(self, mac: str):
+        """Lift a device's throttle and free its slot"""
+        with self._lock:
+            throttle = self.active.pop(mac, None)
+            timer = self._timers.pop(mac, None)
+        if timer is not None:
+            self.wheel.cancel(timer)
+        if not throttle:
+            return
+
+        try:
+            self._backend(throttle).remove_throttle(throttle['slot'], mac, throttle['ipv4'])
+            record_ips_event(mac, 0, "Throttle removed")
+        except Exception as e:
+            record_ips_event(mac, 0, f"Failed to remove throttle: {str(e)}")
+        finally:
+            delete_active_throttle(mac)
+            with self._lock:
+                self._free_slot(throttle['slot'])
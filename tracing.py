@@ -0,0 +1,251 @@
+# tracing.py
+"""Hot-path spans and an on-demand sampling profiler.
+
+Spans are recorded into a fixed-size ring buffer and exported in Chrome
+trace format (load the file in chrome://tracing or https://ui.perfetto.dev):
+
+    @traced("db")
+    def save(...): ...
+
+    with span("arp", cat="discovery"):
+        ...
+
+The profiler samples every thread's stack from a background thread; while it
+is stopped nothing runs. In the collector, SIGUSR1 writes the span buffer and
+SIGUSR2 starts/stops the profiler (writing collapsed stacks on stop).
+"""
+import collections
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from functools import wraps
+from typing import Dict, List, Optional
+
+TRACE_DIR = os.environ.get("IOT_GUARDIAN_TRACE_DIR", "traces")
+
+# Spans kept in memory; the oldest are overwritten first
+RING_SIZE = int(os.environ.get("IOT_GUARDIAN_TRACE_SPANS", "50000"))
+
+PROFILE_INTERVAL = 0.005
+
+_enabled = os.environ.get("IOT_GUARDIAN_TRACE", "1") != "0"
+_spans = collections.deque(maxlen=RING_SIZE)
+_pid = os.getpid()
+
+
+def now_us() -> int:
+    return time.perf_counter_ns() // 1000
+
+
+def set_enabled(enabled: bool):
+    """Turn span recording on or off at runtime"""
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def add_span(name: str, cat: str, start_us: int, end_us: int, args: Dict = None):
+    """Record a span timed by the caller (microseconds from now_us())"""
+    if _enabled:
+        # deque.append is atomic, so recording takes no lock
+        _spans.append((name, cat, start_us, end_us - start_us, threading.get_ident(), args))
+
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "start")
+
+    def __init__(self, name: str, cat: str, args: Optional[Dict]):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = now_us()
+        return self
+
+    def __exit__(self, *exc):
+        add_span(self.name, self.cat, self.start, now_us(), self.args)
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, cat: str = "app", **args):
+    """Context manager recording one span"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, cat, args or None)
+
+
+def traced(cat: str = "app", name: str = None):
+    """Decorator recording a span per call, named after the function"""
+    def decorate(function):
+        span_name = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = now_us()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add_span(span_name, cat, start, now_us())
+        return wrapper
+    return decorate
+
+
+def clear():
+    _spans.clear()
+
+
+def chrome_trace() -> Dict:
+    """The span buffer as a Chrome trace event document"""
+    spans = list(_spans)
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    events: List[Dict] = [
+        {'name': 'thread_name', 'ph': 'M', 'pid': _pid, 'tid': tid,
+         'args': {'name': names.get(tid, str(tid))}}
+        for tid in {s[4] for s in spans}
+    ]
+    for name, cat, start, duration, tid, args in spans:
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'ts': start, 'dur': duration,
+                 'pid': _pid, 'tid': tid}
+        if args:
+            event['args'] = {key: str(value) for key, value in args.items()}
+        events.append(event)
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def export_chrome_trace(path: str = None) -> str:
+    """Write the span buffer as Chrome trace JSON; returns the file path"""
+    if path is None:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        path = os.path.join(TRACE_DIR, f"trace_{_pid}_{int(time.time())}.json")
+    with open(path, "w") as f:
+        json.dump(chrome_trace(), f)
+    return path
+
+
+class SamplingProfiler:
+    """Samples every thread's Python stack every `interval` seconds.
+
+    Stacks are aggregated into collapsed form ("thread;outer;...;inner" -> count),
+    as read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks: collections.Counter = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for tid, frame in sys._current_frames().items():
+            if tid == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(tid, str(tid)))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def top(self, n: int = 20) -> List[tuple]:
+        """(function, self samples) for the innermost frames seen most often"""
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
+
+    def write_collapsed(self, path: str = None) -> str:
+        if path is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            path = os.path.join(TRACE_DIR, f"profile_{_pid}_{int(time.time())}.folded")
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+profiler: Optional[SamplingProfiler] = None
+
+
+def start_profiler(interval: float = PROFILE_INTERVAL) -> SamplingProfiler:
+    global profiler
+    if profiler is None or not profiler.running:
+        profiler = SamplingProfiler(interval)
+        profiler.start()
+    return profiler
+
+
+def stop_profiler() -> Optional[SamplingProfiler]:
+    """Stop sampling; returns the profiler holding the collected stacks"""
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def toggle_profiler() -> Optional[str]:
+    """Start the profiler, or stop it and return the collapsed stacks file"""
+    if profiler is not None and profiler.running:
+        return stop_profiler().write_collapsed()
+    start_profiler()
+    return None
+
+
+def install_signal_handlers():
+    """SIGUSR1 dumps the span buffer, SIGUSR2 toggles the profiler (POSIX, main thread only)"""
+    if not hasattr(signal, "SIGUSR1"):
+        return
+
+    def dump(*_):
+        print(f"Trace written to {export_chrome_trace()}")
+
+    def toggle(*_):
+        path = toggle_profiler()
+        print(f"Profile written to {path}" if path else "Profiler started")
+
+    signal.signal(signal.SIGUSR1, dump)
+    signal.signal(signal.SIGUSR2, toggle)
@@ -0,0 +1,235 @@
+# workers.py
+"""One worker process per monitored interface.
+
+Each worker runs traffic accounting on its interface and scans it for
+devices on request. Nothing in a worker writes to SQLite: closed windows,
+early rates and scan results go back over one shared queue, and the
+collector's merge thread stores and publishes them, and feeds scans through
+the device registry, like a single-interface collector does in-process.
+
+    collector                          worker (per interface)
+    ---------                          ----------------------
+    commands ("scan", id) ----------->  scan_interface()
+             ("watch", levels) ------>  set_watch_levels()
+             ("stop", None) --------->
+    results  <-----------------------  ("rates", iface, (rates, frames))
+             <-----------------------  ("early", iface, (mac, rate))
+             <-----------------------  ("scan", iface, (id, observations))
+             <-----------------------  ("error", iface, message)
+"""
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from accounting import FRAMES, WINDOW_SECONDS, get_watch_levels, publish_early, publish_rates
+from daemon import Service
+from metrics import REGISTRY
+
+SCAN_TIMEOUT = 30
+
+# How often the merge thread checks for new watch levels and dead workers
+MERGE_POLL_SECONDS = 1.0
+
+# Minimum time between restarts of one interface's worker
+RESTART_DELAY_SECONDS = 5.0
+
+WORKERS = REGISTRY.gauge("iot_guardian_interface_workers",
+                         "Interface worker processes alive")
+WORKER_MESSAGES = REGISTRY.counter("iot_guardian_interface_messages_total",
+                                   "Messages merged from interface workers", ["kind"])
+WORKER_RESTARTS = REGISTRY.counter("iot_guardian_interface_restarts_total",
+                                   "Interface worker processes restarted after dying", ["interface"])
+
+
+def interface_worker(interface: str, subnet: Optional[str], commands, results,
+                     accounting: bool = True, window: float = WINDOW_SECONDS,
+                     command: List[str] = None):
+    """Entry point of a worker process; runs until it is sent ("stop", None)"""
+    from accounting import TrafficAccountant, set_watch_levels
+    from device_utils import scan_interface
+
+    accountant = None
+    if accounting:
+        accountant = TrafficAccountant(
+            interface, window,
+            on_rates=lambda rates: results.put(("rates", interface, (rates, accountant.frames))),
+            on_early=lambda mac, rate: results.put(("early", interface, (mac, rate))),
+            command=command)
+        try:
+            accountant.start()
+        except Exception as e:
+            results.put(("error", interface, f"accounting: {e}"))
+            accountant = None
+
+    try:
+        while True:
+            kind, arg = commands.get()
+            if kind == "stop":
+                break
+            if kind == "scan":
+                results.put(("scan", interface, (arg, scan_interface(interface, subnet))))
+            elif kind == "watch":
+                set_watch_levels(arg)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if accountant:
+            accountant.stop()
+
+
+class InterfaceSupervisor(Service):
+    """Starts a worker process per interface and merges what they report.
+
+    `interfaces` are dicts with a name and an optional subnet, as returned
+    by database.get_interfaces(). A worker that dies is restarted by the
+    merge thread, at most once every RESTART_DELAY_SECONDS per interface.
+    """
+
+    name = "interfaces"
+
+    def __init__(self, interfaces: List[Dict], accounting: bool = True,
+                 window: float = WINDOW_SECONDS, command: List[str] = None):
+        self.interfaces = interfaces
+        self.accounting = accounting
+        self.window = window
+        self.command = command
+        self._context = multiprocessing.get_context("spawn")
+        self.results = None
+        self.workers: Dict[str, Tuple[multiprocessing.Process, object]] = {}
+        self.frames: Dict[str, int] = {}
+        self.errors: Dict[str, str] = {}
+        self.windows = 0
+        self.restarts: Dict[str, int] = {}
+        self._started_at: Dict[str, float] = {}
+        self._scan_ids = itertools.count(1)
+        self._scans: Dict[int, Dict[str, list]] = {}
+        self._cond = threading.Condition()
+        self._watch_levels = None
+        self._merge_thread: Optional[threading.Thread] = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.results = self._context.Queue()
+        for interface in self.interfaces:
+            self._spawn(interface)
+        WORKERS.set_function(lambda: sum(p.is_alive() for p, _ in self.workers.values()))
+        self._merge_thread = threading.Thread(target=self._merge, name="interfaces-merge", daemon=True)
+        self._merge_thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        for process, commands in self.workers.values():
+            commands.put(("stop", None))
+        for process, commands in self.workers.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.results.put(None)
+        self._merge_thread.join()
+        self._merge_thread = None
+        self.workers = {}
+
+    def _spawn(self, interface: Dict):
+        commands = self._context.Queue()
+        process = self._context.Process(
+            target=interface_worker, name=f"iface-{interface['name']}", daemon=True,
+            args=(interface['name'], interface.get('subnet'), commands, self.results,
+                  self.accounting, self.window, self.command))
+        process.start()
+        self.workers[interface['name']] = (process, commands)
+        self._started_at[interface['name']] = time.monotonic()
+        # A fresh worker counts its frames from zero
+        self.frames[interface['name']] = 0
+
+    def _restart_dead(self):
+        """Respawn workers that exited; runs on the merge thread only"""
+        now = time.monotonic()
+        for interface in self.interfaces:
+            name = interface['name']
+            process, _ = self.workers[name]
+            if process.is_alive() or now - self._started_at[name] < RESTART_DELAY_SECONDS:
+                continue
+            if not self.running:
+                return
+            self.errors[name] = f"worker exited with code {process.exitcode}; restarted"
+            print(f"Interface {name}: worker exited with code {process.exitcode}, restarting")
+            self.restarts[name] = self.restarts.get(name, 0) + 1
+            WORKER_RESTARTS.labels(name).inc()
+            self._spawn(interface)
+            if self._watch_levels is not None:
+                self.workers[name][1].put(("watch", self._watch_levels))
+
+    def _send(self, message):
+        for process, commands in self.workers.values():
+            if process.is_alive():
+                commands.put(message)
+
+    def _forward_watch_levels(self):
+        levels = get_watch_levels()
+        if levels is not self._watch_levels:
+            self._watch_levels = levels
+            self._send(("watch", levels))
+
+    def _merge(self):
+        while True:
+            self._forward_watch_levels()
+            self._restart_dead()
+            try:
+                message = self.results.get(timeout=MERGE_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if message is None:
+                break
+            kind, interface, payload = message
+            WORKER_MESSAGES.labels(kind).inc()
+            try:
+                self._handle(kind, interface, payload)
+            except Exception as e:
+                print(f"Interface merge error ({interface}): {e}")
+
+    def _handle(self, kind: str, interface: str, payload):
+        if kind == "rates":
+            rates, frames = payload
+            FRAMES.inc(frames - self.frames.get(interface, 0))
+            self.frames[interface] = frames
+            self.windows += 1
+            publish_rates(rates)
+        elif kind == "early":
+            publish_early(*payload)
+        elif kind == "scan":
+            scan_id, observations = payload
+            with self._cond:
+                if scan_id in self._scans:
+                    self._scans[scan_id][interface] = observations
+                    self._cond.notify_all()
+        elif kind == "error":
+            self.errors[interface] = payload
+            print(f"Interface {interface}: {payload}")
+
+    def scan(self, timeout: float = SCAN_TIMEOUT) -> List[Tuple[str, str, Dict]]:
+        """Scan every interface in parallel; the observations of all that answer in time"""
+        alive = {name for name, (process, _) in self.workers.items() if process.is_alive()}
+        scan_id = next(self._scan_ids)
+        with self._cond:
+            self._scans[scan_id] = {}
+            self._send(("scan", scan_id))
+            self._cond.wait_for(lambda: alive <= set(self._scans[scan_id]), timeout)
+            replies = self._scans.pop(scan_id)
+        return [observation for name in sorted(replies) for observation in replies[name]]
+
+    def status(self) -> str:
+        alive = sum(process.is_alive() for process, _ in self.workers.values())
+        status = f"interfaces={','.join(self.workers)} alive={alive} windows={self.windows}"
+        if self.restarts:
+            status += " restarts=" + ",".join(f"{k}:{v}" for k, v in self.restarts.items())
+        if self.errors:
+            status += " errors=" + ";".join(f"{k}: {v}" for k, v in self.errors.items())
+        return status